@@ -82,6 +82,14 @@ for f in "${EXTRAS_SRC}"/*.py; do
   ln -sfn "$f" "${EXTRAS_DST}/${bn}"
 done
 
+# Offline tools moved to scripts/, drop their stale links
+for link in "${EXTRAS_DST}"/*.py; do
+  if [[ -L "${link}" && ! -e "${link}" && "$(readlink "${link}")" == "${EXTRAS_SRC}/"* ]]; then
+    info "  removing stale link $(basename "${link}")"
+    rm -f "${link}"
+  fi
+done
+
 echo
 info "Restarting Klipper service ..."
 if command -v systemctl >/dev/null 2>&1; then
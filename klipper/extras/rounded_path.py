@@ -6,23 +6,60 @@
 # speed changes in sharp corners. It supports arbitrary paths in XYZ space.
 # Each corner is rounded to a maximum deviation distance D.
 # Because each corner depends on the next one, the path chain must end with a
-# command R=0 to flush any pending moves.
-# The generated coordinates are converted into G0 (rapid move) commands.
+# command R=0 to flush any pending moves. ROUNDED_PATH takes a whole polyline
+# in one command and always ends at its last point.
+# With corner_mode: g2 corners are blended with quintic Bezier curves instead
+# of arcs, so the curvature has no jump where the curve meets the lines.
+# With auto_flush a pending chain is ended by the next foreign move: a travel
+# move becomes the last point of the chain, anything else flushes it first.
+# ROUNDED_PATH_PREVIEW plans a path without moving and estimates its travel
+# time with the toolhead's acceleration and cornering limits. With a target
+# corner speed V each rounding is only as large as needed to take the corner
+# at V with the toolhead's max_accel (radius v^2/a), D becomes its maximum.
+# The generated coordinates are converted into G0 (rapid move) commands, or
+# with direct_moves queued on the toolhead without G-code command handling.
+# Overlapping roundings of neighbouring corners are resolved as the points
+# arrive, so each corner is emitted as soon as the point after the next one
+# is known. The arc geometry of the emitted corners is computed in one batch
+# with NumPy when it is available.
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
 
 import math
+try:
+    import numpy
+except ImportError:
+    numpy = None
 EPSILON = 0.001
 EPSILON_ANGLE = 0.001
+GEOMETRY_ENGINES = {'auto': 'auto', 'python': 'python', 'numpy': 'numpy'}
+CORNER_MODES = {'arc': 'arc', 'g2': 'g2'}
+# Commands that move the toolhead, wait for it or change the G-code position.
+# With auto_flush a pending chain is completed before they run.
+FLUSH_COMMANDS = ('G2', 'G3', 'G4', 'G28', 'G92', 'M400', 'SET_GCODE_OFFSET',
+                  'SAVE_GCODE_STATE', 'RESTORE_GCODE_STATE', 'SET_KINEMATIC_POSITION',
+                  'FORCE_MOVE', 'MANUAL_STEPPER')
+# Distance of the second Bezier control point from the corner, relative to the
+# first. The third one comes from _g2_k2().
+G2_K1 = 0.8
+# Below this many arc points per flush the NumPy call overhead outweighs the
+# per-point savings. From rounded_path_bench.py --crossover: a single corner
+# breaks even at about 95 points, batches of 8 or more corners at about 60.
+NUMPY_MIN_POINTS = 96
+# Points held by the planner; full rings emit their final corners early
+RING_SIZE = 512
 
 
 class ControlPoint:
     """Represents a path point with position, feedrate, and rounding parameters."""
 
-    def __init__(self, x, y, z, d, f):
+    __slots__ = ('vec', 'f', 'maxd', 'v', 'angle', 'len', 'lin_d', 'lin_d_to_r')
+
+    def __init__(self, x, y, z, d, f, v=0.0):
         self.vec = [x, y, z]
         self.f = f
         self.maxd = d
+        self.v = v  # Target corner speed in mm/s, 0 for the full D
         self.angle = 0.0
         self.len = 0.0  # Distance to the previous point
         # Maximum linear distance of the rounding from the corner based on D and angle
@@ -30,6 +67,55 @@ class ControlPoint:
         self.lin_d_to_r = 0.0
 
 
+class PointRing:
+    """Fixed-capacity ring buffer of ControlPoints, index 0 is the oldest.
+
+    Supports the list operations the planner uses (len, indexing from both
+    ends, append, clear) plus taking and dropping the oldest points."""
+
+    __slots__ = ('points', 'size', 'head', 'count')
+
+    def __init__(self, size):
+        self.points = [None] * size
+        self.size = size
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("ring index out of range")
+        return self.points[(self.head + index) % self.size]
+
+    def append(self, point):
+        if self.count >= self.size:
+            raise IndexError("ring is full")
+        self.points[(self.head + self.count) % self.size] = point
+        self.count += 1
+
+    def oldest(self, num):
+        """The num oldest points as a list."""
+        end = self.head + num
+        if end <= self.size:
+            return self.points[self.head:end]
+        return self.points[self.head:] + self.points[:end - self.size]
+
+    def drop(self, num):
+        """Remove the num oldest points."""
+        for i in range(num):
+            self.points[(self.head + i) % self.size] = None
+        self.head = (self.head + num) % self.size
+        self.count -= num
+
+    def clear(self):
+        self.drop(self.count)
+        self.head = 0
+
+
 # --- Basic vector math helpers ---
 
 def _vecto(f: ControlPoint, t: ControlPoint) -> list:
@@ -113,77 +199,144 @@ def _vtransform(vec: list, transform: list) -> list:
     ]
 
 
-class RoundedPath:
+def _cross_rows(a, b):
+    """Row-wise cross product of two (n, 3) arrays, numpy.cross has a large
+    per-call overhead for the few rows of a typical flush."""
+    result = numpy.empty_like(a)
+    result[:, 0] = a[:, 1] * b[:, 2] - a[:, 2] * b[:, 1]
+    result[:, 1] = a[:, 2] * b[:, 0] - a[:, 0] * b[:, 2]
+    result[:, 2] = a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+    return result
+
+
+def _g2_k2(angle):
+    """Relative distance of the third control point of a G2 blend.
+
+    Fitted so that the peak curvature stays within 10% of the arc with the
+    same D for corners from 30 to 180 degrees."""
+    return min(0.27 + 0.5 * (1.0 - math.sin(angle / 2)), 0.79)
+
+
+def _g2_peak_curvature(angle):
+    """Peak curvature of a G2 blend with lin_d 1, sampled on its first half
+    (the blend is symmetric). The arc with the same lin_d has 1 / tan(a/2)."""
+    k2 = _g2_k2(angle)
+    cosa = math.cos(angle)
+    sina = math.sin(angle)
+    ctrl = [(1.0, 0.0), (G2_K1, 0.0), (k2, 0.0), (k2 * cosa, k2 * sina),
+            (G2_K1 * cosa, G2_K1 * sina), (cosa, sina)]
+    d1 = [(5.0 * (b[0] - a[0]), 5.0 * (b[1] - a[1])) for a, b in zip(ctrl, ctrl[1:])]
+    d2 = [(4.0 * (b[0] - a[0]), 4.0 * (b[1] - a[1])) for a, b in zip(d1, d1[1:])]
+    peak = 0.0
+    for step in range(1, 33):
+        t = step / 64.0
+        s = 1.0 - t
+        b4 = (s ** 4, 4.0 * t * s ** 3, 6.0 * t * t * s * s, 4.0 * t ** 3 * s, t ** 4)
+        b3 = (s ** 3, 3.0 * t * s * s, 3.0 * t * t * s, t ** 3)
+        dx = sum(b * d[0] for b, d in zip(b4, d1))
+        dy = sum(b * d[1] for b, d in zip(b4, d1))
+        ddx = sum(b * d[0] for b, d in zip(b3, d2))
+        ddy = sum(b * d[1] for b, d in zip(b3, d2))
+        peak = max(peak, abs(dx * ddy - dy * ddx) / math.hypot(dx, dy) ** 3)
+    return peak
+
+
+def _g2_weights(t, k2):
+    """Bezier weights of both legs at t, control points at 1, G2_K1 and k2."""
+    s = 1.0 - t
+    t2 = t * t
+    s2 = s * s
+    wp = s2 * s2 * s + 5.0 * G2_K1 * t * s2 * s2 + 10.0 * k2 * t2 * s2 * s
+    wn = 10.0 * k2 * t2 * t * s2 + 5.0 * G2_K1 * t2 * t2 * s + t2 * t2 * t
+    return wp, wn
+
+
+class PathPlanner:
     """
-    Generates rounded G0 travel paths by buffering move commands.
-    It replaces abrupt cornering with smooth arc segments based on the D parameter.
+    Rounds the corners of a buffered polyline, in G-code coordinates.
+    Generated points are collected as (position, feedrate) pairs and handed
+    to submit_moves(); no Klipper objects are needed here.
     """
 
-    buffer: list[ControlPoint]
-
-    def __init__(self, config):
-        self.printer = config.get_printer()
-        self.mm_per_arc_segment = config.getfloat('resolution', 1., above=0.0)
-
-        self.gcode_move = self.printer.load_object(config, 'gcode_move')
-        self.gcode = self.printer.lookup_object('gcode')
-        self.G0_params = {}
-        self.G0_cmd = self.gcode.create_gcode_command("G0", "G0", self.G0_params)
-        self.real_G0 = self.gcode_move.cmd_G1
-        self.gcode.register_command("ROUNDED_G0", self.cmd_ROUNDED_G0)
-        self.buffer = []
+    buffer: PointRing
+
+    def __init__(self, mm_per_arc_segment, max_chord_error=0.0, min_segment_time=0.0,
+                 numpy_min_points=None, corner_mode='arc', ring_size=RING_SIZE):
+        self.mm_per_arc_segment = mm_per_arc_segment
+        self.corner_mode = corner_mode
+        # Arc points per flush from which the NumPy batch is used, None for never
+        self.numpy_min_points = numpy_min_points
+        self.max_chord_error = max_chord_error
+        self.min_segment_time = min_segment_time
+        self.default_speed = 0.0  # mm/s, used for points without F
+        self.accel = 0.0  # mm/s^2, sizes the roundings of points with a corner speed
+        # Oldest point is the chain start or the last emitted corner, with
+        # its position moved to the end of its rounding
+        self.buffer = PointRing(ring_size)
         self.lastg0 = []
+        self.moves = []
 
-        if config.getboolean('replace_g0', False):
-            # Replace native G0 handling with rounded motion
-            self.gcode.register_command("G0", None)
-            self.gcode.register_command("G0", self.cmd_ROUNDED_G0)
-
-    def cmd_ROUNDED_G0(self, gcmd):
-        """Intercepts G0 moves and applies rounding depending on D."""
-        d = gcmd.get_float("D", 0.0)
-        if d <= 0.0 and len(self.buffer) < 2:
-            self.real_G0(gcmd)
-            return
-
-        gcodestatus = self.gcode_move.get_status()
-        if not gcodestatus['absolute_coordinates']:
-            raise gcmd.error("ROUNDED_G0 does not support relative move mode")
-
-        currentPos = gcodestatus['gcode_position']
-        if len(self.buffer) == 0:
-            # Initialize with current position and zero radius
-            self.buffer.append(ControlPoint(x=currentPos[0], y=currentPos[1], z=currentPos[2], d=0.0, f=0.0))
-        else:
-            origin = self.buffer[0].vec
-            if _vdist(currentPos, origin) > EPSILON:
-                raise gcmd.error("ROUNDED_G0: Current position changed since the last command. The last ROUNDED_G0 before other moves must have D=0.")
-            last = self.buffer[-1]
-            currentPos = last.vec
-
-        self._lineto(ControlPoint(
-            x=gcmd.get_float("X", currentPos[0]),
-            y=gcmd.get_float("Y", currentPos[1]),
-            z=gcmd.get_float("Z", currentPos[2]),
-            f=gcmd.get_float("F", 0.0),
-            d=d)
-        )
+    def submit_moves(self, moves):
+        """Receives the moves generated by one _lineto call."""
+        raise NotImplementedError()
 
     def _lineto(self, pos):
         """Add a linear move point and compute arcs if possible."""
-        self.buffer.append(pos)
-        if len(self.buffer) >= 3:
-            self._calculate_corner(self.buffer[-2], self.buffer[-3], self.buffer[-1])
-
-        if len(self.buffer) >= 2 and self.buffer[-1].maxd <= 0.0:
-            self._calculate_zero_corner(self.buffer[-1], self.buffer[-2])
+        self._plan(pos)
+        self._submit_pending()
+
+    def _submit_pending(self):
+        if self.moves:
+            moves = self.moves
+            self.moves = []
+            self.submit_moves(moves)
+
+    def _plan(self, pos):
+        self._add_point(pos)
+        if self.buffer.count >= 2 and pos.maxd <= 0.0:
             # Zero radius — flush everything
-            self._flush_buffer(len(self.buffer) - 2)
-            self._g0(self.buffer[-1])
-            self.buffer.clear()
-        elif len(self.buffer) >= 4 and self.buffer[-3].lin_d + self.buffer[-2].lin_d <= self.buffer[-2].len:
-            # Non-overlapping max offsets, flush all but last segment
-            self._flush_buffer(len(self.buffer) - 3)
+            self._close()
+        else:
+            self._emit_corners(self.buffer.count - 3)
+
+    def _add_point(self, pos):
+        """Append a point, compute the corner before it and resolve the
+        overlap on the segment leading to that corner. The corner before
+        that segment is final afterwards."""
+        buffer = self.buffer
+        if buffer.count == buffer.size:
+            self._emit_corners(buffer.count - 3)
+        buffer.append(pos)
+        if buffer.count >= 3:
+            c = buffer[-2]
+            p = buffer[-3]
+            self._calculate_corner(c, p, pos)
+            self._deconflict_lin_d(p, c)
+
+    def _plan_path(self, points):
+        """Plan a whole polyline in one pass, ending at its last point.
+
+        Corners are only emitted when the ring fills up or at the end, so the
+        arcs are generated in large batches and submitted once."""
+        for pos in points:
+            self._add_point(pos)
+        self._finish_path()
+
+    def _finish_path(self, end_move=True):
+        """Flush the whole buffer, ending at its last point. Without end_move
+        the line to the last point is left to the caller."""
+        self._close(end_move)
+        self._submit_pending()
+
+    def _close(self, end_move=True):
+        buffer = self.buffer
+        if len(buffer) >= 2:
+            self._calculate_zero_corner(buffer[-1], buffer[-2])
+            self._deconflict_lin_d(buffer[-2], buffer[-1])
+            self._emit_corners(len(buffer) - 2)
+            if end_move:
+                self._g0(buffer[-1])
+        buffer.clear()
 
     def _calculate_corner(self, c: ControlPoint, v1: ControlPoint, v2: ControlPoint):
         """Compute corner rounding parameters for intermediate vertex c."""
@@ -198,7 +351,21 @@ class RoundedPath:
         tana2 = math.tan(c.angle / 2)
         radius = c.maxd * sina2 / (1 - sina2)
         c.lin_d_to_r = tana2
-        c.lin_d = radius / tana2
+        if self.corner_mode == 'g2':
+            # The blend midpoint, closest to the corner, is at
+            # lin_d * cos(a/2) * (1 + 5 * k1 + 10 * k2) / 16. lin_d_to_r stays
+            # the tangent arc ratio, the blend radius scales the same way.
+            c.lin_d = 16.0 * c.maxd / (math.cos(c.angle / 2)
+                                       * (1.0 + 5.0 * G2_K1 + 10.0 * _g2_k2(c.angle)))
+        else:
+            c.lin_d = radius / tana2
+        if c.v > 0.0 and self.accel > 0.0:
+            # Just large enough for a centripetal acceleration of accel at v
+            if self.corner_mode == 'g2':
+                peak_curvature = _g2_peak_curvature(c.angle)
+            else:
+                peak_curvature = 1.0 / tana2
+            c.lin_d = min(c.lin_d, c.v * c.v / self.accel * peak_curvature)
 
     def _calculate_zero_corner(self, c: ControlPoint, vp: ControlPoint):
         """Handle the corner with zero rounding distance."""
@@ -206,101 +373,603 @@ class RoundedPath:
         c.len = math.hypot(*vec1)
         c.angle = 0
 
-    def _flush_buffer(self, num_segments):
-        """Flush buffered path segments as G0 or arc sequences."""
-        if num_segments <= 0:
+    def _emit_corners(self, num_corners):
+        """Generate the arcs of the num_corners oldest corners, whose
+        roundings are final, and drop them from the buffer."""
+        if num_corners <= 0:
             return
-        if len(self.buffer) < 2:
-            self.buffer.clear()
-            return
-        if len(self.buffer) == 2:
-            self._g0(self.buffer[-1])
-            self.buffer.clear()
-            return
-
-        self._deconflict_lin_d(num_segments + 1)
-
-        for i in range(num_segments):
-            self._arc(self.buffer[i + 1], self.buffer[i], self.buffer[i + 2])
-
-        self.buffer = self.buffer[num_segments:]
+        points = self.buffer.oldest(num_corners + 2)
+        if self.numpy_min_points is not None:
+            self._arcs_numpy(points)
+        else:
+            for i in range(num_corners):
+                self._arc(points[i + 1], points[i], points[i + 2])
+        self.buffer.drop(num_corners)
         # Update position after flushing
-        self.buffer[0].vec = self.lastg0
-
-    def _deconflict_lin_d(self, num_segments):
-        """Ensure that consecutive rounding arcs do not overlap."""
-        order = [i + 1 for i in range(num_segments)]
-        order = sorted(order, key=lambda a: self.buffer[a].len)
-        for i in order:
-            p0 = self.buffer[i - 1]
-            p1 = self.buffer[i]
-            missingd = p1.lin_d + p0.lin_d - p1.len
-            if missingd <= 0:
-                continue
+        points[num_corners].vec = self.lastg0
 
-            # First, reduce the larger radius
-            r0 = p0.lin_d * p0.lin_d_to_r
-            r1 = p1.lin_d * p1.lin_d_to_r
-            if r0 > r1:
-                missingr0 = missingd * p0.lin_d_to_r + EPSILON
-                r0 = max(r1, r0 - missingr0)
-                p0.lin_d = r0 / p0.lin_d_to_r
-            elif r1 > r0:
-                missingr1 = missingd * p1.lin_d_to_r + EPSILON
-                r1 = max(r0, r1 - missingr1)
-                p1.lin_d = r1 / p1.lin_d_to_r
-            missingd = p1.lin_d + p0.lin_d - p1.len
-            if missingd <= 0:
-                continue
-            if p0.lin_d_to_r <= 0.0 or p1.lin_d_to_r <= 0.0:
-                # Safety fallback — should not occur, but floating-point precision can bite
-                p0.lin_d = 0
-                p1.lin_d = 0
-                continue
-            # Reduce both proportionally
-            missingr_shared = missingd / (1 / p0.lin_d_to_r + 1 / p1.lin_d_to_r)
-            p0.lin_d = max(0.0, p0.lin_d - missingr_shared / p0.lin_d_to_r)
-            p1.lin_d = max(0.0, p1.lin_d - missingr_shared / p1.lin_d_to_r)
+    def _deconflict_lin_d(self, p0: ControlPoint, p1: ControlPoint):
+        """Ensure that the roundings at both ends of the segment p0-p1 do not
+        overlap. Only ever shrinks them, so segments resolved before stay free."""
+        missingd = p1.lin_d + p0.lin_d - p1.len
+        if missingd <= 0:
+            return
 
-    def _arc(self, c: ControlPoint, p: ControlPoint, n: ControlPoint):
+        # First, reduce the larger radius
+        r0 = p0.lin_d * p0.lin_d_to_r
+        r1 = p1.lin_d * p1.lin_d_to_r
+        if r0 > r1:
+            missingr0 = missingd * p0.lin_d_to_r + EPSILON
+            r0 = max(r1, r0 - missingr0)
+            p0.lin_d = r0 / p0.lin_d_to_r
+        elif r1 > r0:
+            missingr1 = missingd * p1.lin_d_to_r + EPSILON
+            r1 = max(r0, r1 - missingr1)
+            p1.lin_d = r1 / p1.lin_d_to_r
+        missingd = p1.lin_d + p0.lin_d - p1.len
+        if missingd <= 0:
+            return
+        if p0.lin_d_to_r <= 0.0 or p1.lin_d_to_r <= 0.0:
+            # Only one end is rounded and floating-point precision left it
+            # slightly too long (huge D on a nearly straight corner): fit it
+            # to the segment instead of dropping it
+            if p0.lin_d_to_r > 0.0:
+                p0.lin_d = max(0.0, p1.len - p1.lin_d)
+            if p1.lin_d_to_r > 0.0:
+                p1.lin_d = max(0.0, p1.len - p0.lin_d)
+            return
+        # Reduce both proportionally
+        missingr_shared = missingd / (1 / p0.lin_d_to_r + 1 / p1.lin_d_to_r)
+        p0.lin_d = max(0.0, p0.lin_d - missingr_shared / p0.lin_d_to_r)
+        p1.lin_d = max(0.0, p1.lin_d - missingr_shared / p1.lin_d_to_r)
+
+    def _corner_deviation(self, c: ControlPoint):
+        """Distance between the corner and its final rounding."""
+        if c.lin_d <= 0.0 or c.lin_d_to_r <= 0.0:
+            return 0.0
+        if self._arc_segments(c, c.lin_d * c.lin_d_to_r, math.pi - c.angle) < 1:
+            return 0.0
+        if self.corner_mode == 'g2':
+            return (c.lin_d * math.cos(c.angle / 2)
+                    * (1.0 + 5.0 * G2_K1 + 10.0 * _g2_k2(c.angle)) / 16.0)
+        sina2 = math.sin(c.angle / 2)
+        return c.lin_d * c.lin_d_to_r * (1 - sina2) / sina2
+
+    def _arc_segments(self, c: ControlPoint, radius, sweep):
+        """Number of segments for an arc, fixed length or adaptive."""
+        arc_len = radius * sweep
+        if arc_len <= 0.0:
+            return 0
+        if self.max_chord_error <= 0.0:
+            num_segments = math.floor(arc_len / self.mm_per_arc_segment)
+        elif self.max_chord_error >= radius:
+            num_segments = 1
+        else:
+            # Sagitta of a segment r*(1-cos(a/2)) stays below max_chord_error
+            seg_angle = 2.0 * math.acos(1.0 - self.max_chord_error / radius)
+            num_segments = math.ceil(sweep / seg_angle)
+        speed = c.f / 60.0 if c.f > 0.0 else self.default_speed
+        if self.min_segment_time > 0.0 and speed > 0.0:
+            # Segments shorter than speed * min_segment_time only load the queue
+            num_segments = min(num_segments,
+                               max(1, math.floor(arc_len / (speed * self.min_segment_time))))
+        return num_segments
+
+    def _arc(self, c: ControlPoint, p: ControlPoint, n: ControlPoint, num_segments=None):
         """Generate intermediate arc segments for a rounded corner."""
         radius = c.lin_d * c.lin_d_to_r
-        num_segments = math.floor(radius * c.angle / self.mm_per_arc_segment)
+        # c.angle is the angle between both legs, the arc turns by its supplement
+        sweep = math.pi - c.angle
+        if num_segments is None:
+            num_segments = self._arc_segments(c, radius, sweep)
         if num_segments < 1:
             self._g0(c)
             return
         vp = _vnorm(_vecto(c, p))
         vn = _vnorm(_vecto(c, n))
+        if self.corner_mode == 'g2':
+            self._blend(c, vp, vn, num_segments)
+            return
         rotaxis = _vnorm(_cross(vp, vn))
         start = _vadd(c.vec, _vmul(vp, c.lin_d))
         spoke = _vmul(_vrot(vp, math.pi / 2, rotaxis), -radius)
         center = _vadd(start, _vmul(spoke, -1.0))
 
         # Rotate opposite to the segment direction
-        rot_transform = _vrot_transform(-c.angle / num_segments, rotaxis)
+        rot_transform = _vrot_transform(-sweep / num_segments, rotaxis)
         rotspoke = spoke
         self._g0p(c, _vadd(center, rotspoke))
         for step in range(num_segments):
             rotspoke = _vtransform(rotspoke, rot_transform)
             self._g0p(c, _vadd(center, rotspoke))
 
+    def _blend(self, c: ControlPoint, vp: list, vn: list, num_segments):
+        """Quintic Bezier from lin_d before to lin_d after the corner. Three
+        control points on each leg give zero curvature at both ends."""
+        k2 = _g2_k2(c.angle)
+        for step in range(num_segments + 1):
+            wp, wn = _g2_weights(step / num_segments, k2)
+            wp *= c.lin_d
+            wn *= c.lin_d
+            self._g0p(c, [c.vec[i] + vp[i] * wp + vn[i] * wn for i in range(3)])
+
+    def _arcs_numpy(self, points):
+        """Same moves as _arc for the corners between the first and last of
+        points, with all arcs or blends computed in one vectorised batch."""
+        corners = points[1:-1]
+        radius = [p.lin_d * p.lin_d_to_r for p in corners]
+        sweep = [math.pi - p.angle for p in corners]
+        counts = [self._arc_segments(p, r, a) for p, r, a in zip(corners, radius, sweep)]
+        if sum(counts) < self.numpy_min_points:
+            for i, count in enumerate(counts):
+                self._arc(points[i + 1], points[i], points[i + 2], count)
+            return
+        vecs = numpy.array([p.vec for p in points], dtype=float)
+        c = vecs[1:-1]
+        arcs = numpy.array(counts) >= 1
+        if arcs.any():
+            n = numpy.array(counts)[arcs]
+            c = c[arcs]
+            vp = vecs[:-2][arcs] - c
+            vp /= numpy.linalg.norm(vp, axis=1)[:, None]
+            vn = vecs[2:][arcs] - c
+            vn /= numpy.linalg.norm(vn, axis=1)[:, None]
+            lin_d = numpy.array([p.lin_d for p in corners])[arcs]
+            # Corner index and step number of every generated point
+            arc = numpy.repeat(numpy.arange(len(n)), n + 1)
+            first = numpy.cumsum(n + 1) - (n + 1)
+            step = numpy.arange(len(arc)) - first[arc]
+            if self.corner_mode == 'g2':
+                k2 = numpy.array([_g2_k2(p.angle) for p in corners])[arcs]
+                wp, wn = _g2_weights(step / n[arc], k2[arc])
+                arc_points = (c[arc] + vp[arc] * (wp * lin_d[arc])[:, None]
+                              + vn[arc] * (wn * lin_d[arc])[:, None]).tolist()
+            else:
+                axis = _cross_rows(vp, vn)
+                axis /= numpy.linalg.norm(axis, axis=1)[:, None]
+                r = numpy.array(radius)[arcs][:, None]
+                # vp rotated by pi/2 around the perpendicular axis is axis x vp
+                spoke = _cross_rows(axis, vp) * -r
+                center = c + vp * lin_d[:, None] - spoke
+                # Rodrigues with spoke perpendicular to axis: rotating by theta
+                # gives spoke * cos(theta) + (axis x spoke) * sin(theta), where
+                # axis x spoke = -r * axis x (axis x vp) = r * vp
+                normal = vp * r
+                theta = -step * (numpy.array(sweep)[arcs] / n)[arc]
+                arc_points = (center[arc] + spoke[arc] * numpy.cos(theta)[:, None]
+                              + normal[arc] * numpy.sin(theta)[:, None]).tolist()
+        pos = 0
+        moves = self.moves
+        for p, count in zip(corners, counts):
+            if count < 1:
+                moves.append((p.vec, p.f))
+                continue
+            f = p.f
+            moves.extend([(vec, f) for vec in arc_points[pos:pos + count + 1]])
+            pos += count + 1
+        self.lastg0 = moves[-1][0]
+
     def _g0(self, p: ControlPoint):
         """Send a direct G0 move."""
         self._g0p(p, p.vec)
 
     def _g0p(self, p: ControlPoint, vec: list):
-        """Send a G0 move to a specific position."""
-        self.G0_params["X"] = vec[0]
-        self.G0_params["Y"] = vec[1]
-        self.G0_params["Z"] = vec[2]
-        if p.f > 0.0:
-            self.G0_params['F'] = p.f
-        else:
-            self.G0_params.pop('F', None)
+        """Queue a move to a specific position."""
         self.lastg0 = vec
-        self.real_G0(self.G0_cmd)
+        self.moves.append((vec, p.f))
+
+
+class PreviewPlanner(PathPlanner):
+    """Dry run of a planner: keeps the generated moves and the rounding
+    actually used at every corner instead of queuing anything."""
+
+    def __init__(self, planner: PathPlanner):
+        PathPlanner.__init__(self, planner.mm_per_arc_segment, planner.max_chord_error,
+                             planner.min_segment_time, planner.numpy_min_points,
+                             planner.corner_mode)
+        self.default_speed = planner.default_speed
+        self.accel = planner.accel
+        self.segments = []
+        self.corners = []
+
+    def submit_moves(self, moves):
+        self.segments.extend(moves)
+
+    def _emit_corners(self, num_corners):
+        for c in self.buffer.oldest(num_corners + 1)[1:]:
+            self.corners.append((list(c.vec), c.maxd, self._corner_deviation(c)))
+        PathPlanner._emit_corners(self, num_corners)
+
+
+def estimate_time(start, moves, speed, speed_factor, max_velocity, accel,
+                  square_corner_velocity):
+    """Length and duration of moves starting and ending at rest.
+
+    Trapezoidal profiles with the junction speeds of Klipper's lookahead
+    (junction deviation from square_corner_velocity plus the centripetal
+    limit of both moves); minimum_cruise_ratio is not modelled.
+    speed is the initial speed in mm/s, F values are scaled by speed_factor."""
+    junction_deviation = square_corner_velocity ** 2 * (math.sqrt(2.0) - 1.0) / accel
+    lengths = []
+    cruise_v2 = []
+    # Highest squared speed at the start of each move, then at the end
+    node_v2 = [0.0]
+    prev_pos = start
+    prev_axes = None
+    for vec, f in moves:
+        axes = [vec[i] - prev_pos[i] for i in range(3)]
+        move_d = math.hypot(*axes)
+        if move_d < 1e-9:
+            continue
+        if f > 0.0:
+            speed = f * speed_factor
+        velocity = min(speed, max_velocity)
+        axes = [a / move_d for a in axes]
+        if prev_axes is not None:
+            cos_theta = -(axes[0] * prev_axes[0] + axes[1] * prev_axes[1]
+                          + axes[2] * prev_axes[2])
+            if cos_theta > 0.999999:
+                junction_v2 = 0.0
+            else:
+                cos_theta = max(cos_theta, -0.999999)
+                sin_theta_d2 = math.sqrt(0.5 * (1.0 - cos_theta))
+                r_jd = sin_theta_d2 / (1.0 - sin_theta_d2)
+                tan_theta_d2 = sin_theta_d2 / math.sqrt(0.5 * (1.0 + cos_theta))
+                junction_v2 = min(r_jd * junction_deviation * accel,
+                                  0.5 * move_d * tan_theta_d2 * accel,
+                                  0.5 * lengths[-1] * tan_theta_d2 * accel,
+                                  velocity ** 2, cruise_v2[-1])
+            node_v2.append(junction_v2)
+        lengths.append(move_d)
+        cruise_v2.append(velocity ** 2)
+        prev_pos = vec
+        prev_axes = axes
+    node_v2.append(0.0)
+    # Forward pass limits the speed reachable from the start, backward pass
+    # the speed that still allows stopping at the end
+    for i in range(len(lengths)):
+        node_v2[i + 1] = min(node_v2[i + 1], node_v2[i] + 2.0 * accel * lengths[i])
+    for i in range(len(lengths) - 1, -1, -1):
+        node_v2[i] = min(node_v2[i], node_v2[i + 1] + 2.0 * accel * lengths[i])
+    total_time = 0.0
+    for i, move_d in enumerate(lengths):
+        start_v2 = node_v2[i]
+        end_v2 = node_v2[i + 1]
+        peak_v2 = min(cruise_v2[i], (start_v2 + end_v2) / 2.0 + accel * move_d)
+        peak_v = math.sqrt(peak_v2)
+        accel_d = (peak_v2 - start_v2) / (2.0 * accel)
+        decel_d = (peak_v2 - end_v2) / (2.0 * accel)
+        total_time += ((peak_v - math.sqrt(start_v2)) / accel
+                       + (peak_v - math.sqrt(end_v2)) / accel
+                       + max(0.0, move_d - accel_d - decel_d) / peak_v)
+    return sum(lengths), total_time
+
+
+class RoundedPath(PathPlanner):
+    """
+    Generates rounded G0 travel paths by buffering move commands.
+    It replaces abrupt cornering with smooth arc segments based on the D parameter.
+    """
+
+    def __init__(self, config):
+        PathPlanner.__init__(self, config.getfloat('resolution', 1., above=0.0),
+                             config.getfloat('max_chord_error', 0., minval=0.),
+                             config.getfloat('min_segment_time', 0., minval=0.))
+        self.printer = config.get_printer()
+        self.corner_mode = config.getchoice('corner_mode', CORNER_MODES, 'arc')
+        engine = config.getchoice('geometry_engine', GEOMETRY_ENGINES, 'auto')
+        if engine == 'numpy' and numpy is None:
+            raise config.error("rounded_path: geometry_engine: numpy, but NumPy is not installed")
+        if engine == 'numpy':
+            self.numpy_min_points = 0
+        elif engine == 'auto' and numpy is not None:
+            self.numpy_min_points = NUMPY_MIN_POINTS
+        self.direct_moves = config.getboolean('direct_moves', False)
+        self.corner_speed = config.getfloat('corner_speed', 0., minval=0.)
+
+        self.gcode_move = self.printer.load_object(config, 'gcode_move')
+        self.gcode = self.printer.lookup_object('gcode')
+        self.G0_params = {}
+        self.G0_cmd = self.gcode.create_gcode_command("G0", "G0", self.G0_params)
+        self.real_G0 = self.gcode_move.cmd_G1
+        self.gcode.register_command("ROUNDED_G0", self.cmd_ROUNDED_G0)
+        self.gcode.register_command("ROUNDED_PATH", self.cmd_ROUNDED_PATH,
+                                    desc=self.cmd_ROUNDED_PATH_help)
+        self.gcode.register_command("ROUNDED_PATH_PREVIEW", self.cmd_ROUNDED_PATH_PREVIEW,
+                                    desc=self.cmd_ROUNDED_PATH_PREVIEW_help)
+        self.last_preview = {}
+
+        self.replace_g0 = config.getboolean('replace_g0', False)
+        if self.replace_g0:
+            # Replace native G0 handling with rounded motion
+            self.gcode.register_command("G0", None)
+            self.gcode.register_command("G0", self.cmd_ROUNDED_G0)
+
+        if config.getboolean('auto_flush', False):
+            # Wrap at connect, after all other modules replaced their handlers
+            self.printer.register_event_handler('klippy:connect', self._handle_connect)
+
+    def _handle_connect(self):
+        for move_cmd in ('G0', 'G1'):
+            if move_cmd == 'G0' and self.replace_g0:
+                continue
+            move_handler = self.gcode.register_command(move_cmd, None)
+            self.gcode.register_command(move_cmd, self._wrap_move(move_handler))
+        for cmd in FLUSH_COMMANDS:
+            handler = self.gcode.register_command(cmd, None)
+            if handler is not None:
+                self.gcode.register_command(cmd, self._wrap_flush(handler))
+
+    def cmd_ROUNDED_G0(self, gcmd):
+        """Intercepts G0 moves and applies rounding depending on D."""
+        d = gcmd.get_float("D", 0.0)
+        if d <= 0.0 and len(self.buffer) < 2:
+            self.real_G0(gcmd)
+            return
+
+        currentPos = self._start_position("ROUNDED_G0")
+        x, y, z = self._move_target(gcmd, currentPos)
+        v = gcmd.get_float("V", self.corner_speed, minval=0.)
+        if v > 0.0:
+            self.accel = self._max_accel()
+        self._lineto(ControlPoint(x=x, y=y, z=z, f=gcmd.get_float("F", 0.0), d=d, v=v))
+
+    def _move_target(self, gcmd, pos):
+        """X/Y/Z of a move command from pos, in absolute or relative mode."""
+        if self.gcode_move.absolute_coord:
+            return [gcmd.get_float(axis, pos[i]) for i, axis in enumerate('XYZ')]
+        return [pos[i] + gcmd.get_float(axis, 0.0) for i, axis in enumerate('XYZ')]
+
+    def _wrap_move(self, move_handler):
+        def cmd_move(gcmd):
+            if len(self.buffer) < 2:
+                move_handler(gcmd)
+                return
+            self._end_chain_with(gcmd, move_handler)
+        return cmd_move
+
+    def _end_chain_with(self, gcmd, move_handler):
+        """Completes the pending chain before a foreign G0/G1.
+
+        An absolute travel move becomes the last point of the chain, so the
+        pending corner is rounded towards it; the move itself still runs
+        through move_handler, with all axes set as it starts from the end of
+        the rounding. Extruding and relative moves get a plain flush first."""
+        params = gcmd.get_command_parameters()
+        travel = 'E' not in params and any(axis in params for axis in 'XYZ')
+        if not travel or not self.gcode_move.absolute_coord:
+            self._finish_path()
+            move_handler(gcmd)
+            return
+        target = self._move_target(gcmd, self._start_position(gcmd.get_command()))
+        self._add_point(ControlPoint(target[0], target[1], target[2], 0.0,
+                                     gcmd.get_float("F", 0.0)))
+        self._finish_path(end_move=False)
+        move_handler(self.gcode.create_gcode_command(
+            gcmd.get_command(), gcmd.get_commandline(),
+            {**params, 'X': target[0], 'Y': target[1], 'Z': target[2]}))
+
+    def _wrap_flush(self, handler):
+        def cmd_flush(gcmd):
+            self.flush()
+            handler(gcmd)
+        return cmd_flush
+
+    def flush(self):
+        """Complete a pending ROUNDED_G0 chain. Called by other modules before
+        they wait for the toolhead or read its position, so a chain left
+        without its closing D=0 move is not held back there."""
+        if self.buffer:
+            self._finish_path()
+
+    cmd_ROUNDED_PATH_help = "Move along a polyline with rounded corners"
+    def cmd_ROUNDED_PATH(self, gcmd):
+        """ROUNDED_PATH POINTS="x,y,z,d,f|..." - empty or omitted fields keep
+        the previous coordinate, D and F default to 0."""
+        try:
+            points = parse_points(gcmd.get("POINTS"))
+        except ValueError as e:
+            raise gcmd.error("ROUNDED_PATH: %s" % (e,))
+        self.move_path(points, relative=not self.gcode_move.absolute_coord,
+                       corner_speed=gcmd.get_float("V", self.corner_speed, minval=0.))
+
+    def move_path(self, points, relative=False, corner_speed=None):
+        """Move along a polyline of (x, y, z, d, f) tuples in G-code
+        coordinates, None keeps the previous coordinate. With relative each
+        point is an offset from the previous one. corner_speed (mm/s, default
+        the corner_speed option) sizes the roundings, D is their maximum.
+        Continues a pending ROUNDED_G0 chain, plans all corners at once and
+        ends at the last point."""
+        pos = self._start_position("ROUNDED_PATH")
+        if corner_speed is None:
+            corner_speed = self.corner_speed
+        if corner_speed > 0.0:
+            self.accel = self._max_accel()
+        planned = []
+        for point in points:
+            if relative:
+                pos = [pos[i] + (point[i] or 0.0) for i in range(3)]
+            else:
+                pos = [pos[i] if point[i] is None else point[i] for i in range(3)]
+            planned.append(ControlPoint(pos[0], pos[1], pos[2], point[3] or 0.0,
+                                        point[4] or 0.0, corner_speed))
+        self._plan_path(planned)
+
+    def _max_accel(self):
+        toolhead = self.printer.lookup_object('toolhead')
+        return toolhead.get_max_velocity()[1]
+
+    cmd_ROUNDED_PATH_PREVIEW_help = "Plan a ROUNDED_PATH without moving and estimate its time"
+    def cmd_ROUNDED_PATH_PREVIEW(self, gcmd):
+        """ROUNDED_PATH_PREVIEW POINTS="x,y,z,d,f|..." [V=] [ACCEL=] [SQUARE_CORNER_VELOCITY=]
+        [VELOCITY=] [SEGMENTS=1] - limits default to the current toolhead ones."""
+        try:
+            points = parse_points(gcmd.get("POINTS"))
+        except ValueError as e:
+            raise gcmd.error("ROUNDED_PATH_PREVIEW: %s" % (e,))
+        toolhead = self.printer.lookup_object('toolhead')
+        limits = toolhead.get_status(self.printer.get_reactor().monotonic())
+        preview = self.preview_path(
+            points, not self.gcode_move.absolute_coord,
+            gcmd.get_float('ACCEL', limits['max_accel'], above=0.),
+            gcmd.get_float('SQUARE_CORNER_VELOCITY', limits['square_corner_velocity'],
+                           minval=0.),
+            gcmd.get_float('VELOCITY', limits['max_velocity'], above=0.),
+            gcmd.get_float('V', self.corner_speed, minval=0.))
+        lines = ["ROUNDED_PATH_PREVIEW: %d segments, %.3f mm, %.4f s"
+                 % (len(preview['segments']), preview['length'], preview['time'])]
+        for i, corner in enumerate(preview['corners']):
+            lines.append("corner %d (%.3f, %.3f, %.3f): D=%.3f used %.3f"
+                         % ((i + 1,) + tuple(corner['position'])
+                            + (corner['d'], corner['deviation'])))
+        if gcmd.get_int('SEGMENTS', 0):
+            lines.extend("%.3f, %.3f, %.3f @ %.1f mm/s" % tuple(segment)
+                         for segment in preview['segments'])
+        gcmd.respond_info("\n".join(lines))
+
+    def preview_path(self, points, relative=False, accel=None,
+                     square_corner_velocity=None, max_velocity=None, corner_speed=None):
+        """Dry run of move_path(): nothing is queued and a pending chain is
+        left untouched (its last corner is not part of the preview). accel
+        also sizes the roundings for corner_speed.
+
+        Returns a dict with 'segments' ([x, y, z, speed in mm/s] of every
+        generated move), 'corners' (position, requested 'd' and 'deviation'
+        actually used), 'length' and 'time' in seconds; limits default to the
+        current toolhead ones."""
+        if None in (accel, square_corner_velocity, max_velocity):
+            toolhead = self.printer.lookup_object('toolhead')
+            limits = toolhead.get_status(self.printer.get_reactor().monotonic())
+            accel = accel or limits['max_accel']
+            if square_corner_velocity is None:
+                square_corner_velocity = limits['square_corner_velocity']
+            max_velocity = max_velocity or limits['max_velocity']
+        if corner_speed is None:
+            corner_speed = self.corner_speed
+
+        gcodestatus = self.gcode_move.get_status()
+        if len(self.buffer):
+            pos = list(self.buffer[-1].vec)
+        else:
+            pos = gcodestatus['gcode_position'][:3]
+        start = pos
+        planner = PreviewPlanner(self)
+        planner.default_speed = gcodestatus['speed'] / 60.0
+        planner.accel = accel
+        planner.buffer.append(ControlPoint(pos[0], pos[1], pos[2], 0.0, 0.0))
+        planned = []
+        for point in points:
+            if relative:
+                pos = [pos[i] + (point[i] or 0.0) for i in range(3)]
+            else:
+                pos = [pos[i] if point[i] is None else point[i] for i in range(3)]
+            planned.append(ControlPoint(pos[0], pos[1], pos[2], point[3] or 0.0,
+                                        point[4] or 0.0, corner_speed))
+        planner._plan_path(planned)
+
+        speed_factor = self.gcode_move.speed_factor
+        length, total_time = estimate_time(start, planner.segments, self.gcode_move.speed,
+                                           speed_factor, max_velocity, accel,
+                                           square_corner_velocity)
+        segments = []
+        speed = self.gcode_move.speed
+        for vec, f in planner.segments:
+            if f > 0.0:
+                speed = f * speed_factor
+            segments.append([vec[0], vec[1], vec[2], min(speed, max_velocity)])
+        corners = [{'position': position, 'd': d, 'deviation': deviation}
+                   for position, d, deviation in planner.corners]
+        self.last_preview = {'segments': len(segments), 'length': length,
+                             'time': total_time,
+                             'deviations': [c['deviation'] for c in corners]}
+        return {'segments': segments, 'corners': corners, 'length': length,
+                'time': total_time}
+
+    def get_status(self, eventtime):
+        return {'last_preview': self.last_preview}
+
+    def _start_position(self, command):
+        """Start the buffer at the current position if empty, check that no
+        other move happened otherwise. Returns the last buffered position."""
+        gcodestatus = self.gcode_move.get_status()
+        currentPos = gcodestatus['gcode_position']
+        self.default_speed = gcodestatus['speed'] / 60.0
+        if len(self.buffer) == 0:
+            # Initialize with current position and zero radius
+            self.buffer.append(ControlPoint(x=currentPos[0], y=currentPos[1], z=currentPos[2], d=0.0, f=0.0))
+            return currentPos
+        origin = self.buffer[0].vec
+        if _vdist(currentPos, origin) > EPSILON:
+            raise self.printer.command_error("%s: Current position changed since the last command. The last ROUNDED_G0 before other moves must have D=0." % (command,))
+        return self.buffer[-1].vec
+
+    def submit_moves(self, moves):
+        if self.direct_moves:
+            self._submit_direct(moves)
+            return
+        # The generated positions are absolute, also in relative mode
+        absolute_coord = self.gcode_move.absolute_coord
+        self.gcode_move.absolute_coord = True
+        try:
+            for vec, f in moves:
+                self.G0_params["X"] = vec[0]
+                self.G0_params["Y"] = vec[1]
+                self.G0_params["Z"] = vec[2]
+                if f > 0.0:
+                    self.G0_params['F'] = f
+                else:
+                    self.G0_params.pop('F', None)
+                self.real_G0(self.G0_cmd)
+        finally:
+            self.gcode_move.absolute_coord = absolute_coord
+
+    def _submit_direct(self, moves):
+        """Queue the moves on the toolhead, same result as G0 in absolute mode.
+
+        The G-code offsets and speed factor are read once per batch instead
+        of parsing a G0 command for every segment."""
+        gcode_move = self.gcode_move
+        base = gcode_move.base_position
+        speed_factor = gcode_move.speed_factor
+        move_with_transform = gcode_move.move_with_transform
+        last_position = gcode_move.last_position
+        speed = gcode_move.speed
+        for vec, f in moves:
+            if f > 0.0:
+                speed = f * speed_factor
+            last_position[0] = vec[0] + base[0]
+            last_position[1] = vec[1] + base[1]
+            last_position[2] = vec[2] + base[2]
+            move_with_transform(last_position, speed)
+        gcode_move.speed = speed
+
+
+# Klipper cuts G-code lines at ';' (comment), also in macros, and does not
+# accept '#' or '*' in extended command arguments
+POINT_SEPARATOR = '|'
+
+
+def parse_points(text):
+    """Parse "x,y,z,d,f|..." into (x, y, z, d, f) tuples, None for empty fields."""
+    points = []
+    for index, point in enumerate(text.split(POINT_SEPARATOR)):
+        if not point.strip():
+            continue
+        fields = point.split(',')
+        if len(fields) > 5:
+            raise ValueError("point %d has more than 5 fields" % (index + 1,))
+        try:
+            values = [float(v) if v.strip() else None for v in fields]
+        except ValueError:
+            raise ValueError("invalid point %d '%s'" % (index + 1, point.strip()))
+        if any(v is not None and not math.isfinite(v) for v in values):
+            raise ValueError("invalid point %d '%s'" % (index + 1, point.strip()))
+        points.append(tuple(values + [None] * (5 - len(values))))
+    if not points:
+        raise ValueError("POINTS is empty")
+    return points
 
 
 def load_config(config):
     """Entry point for Klipper module loading."""
-    return RoundedPath(config)
\ No newline at end of file
+    return RoundedPath(config)
@@ -0,0 +1,129 @@
+# Toolchanger event log: fixed-size binary records in an in-memory ring
+#
+# The toolchanger records status transitions, detection edges, template
+# runs, applied offsets and errors into an EventLog. TOOLCHANGER_DUMP_LOG
+# writes it to a file, scripts/tc_event_log.py decodes it.
+#
+# Copyright (C) 2025 PrintStructor
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import json, struct
+
+# eventtime, change id, event, tool number, two event specific values
+RECORD = struct.Struct('<dIBhff')
+# magic, version, record size, stored records, total records, string table size
+HEADER = struct.Struct('<4sBHIQI')
+MAGIC = b'TCEL'
+VERSION = 1
+MAX_STRINGS = 1024
+
+EV_STATUS = 1           # a: index in STATUS_NAMES
+EV_DETECT = 2           # a: detect state (-1 unavailable, 0 absent, 1 present)
+EV_TEMPLATE_START = 3   # a: template name
+EV_TEMPLATE_END = 4     # a: template name, b: duration in seconds
+EV_OFFSET_Z = 5         # a: total Z offset, b: extra Z offset
+EV_OFFSET_XY = 6        # a: X offset, b: Y offset
+EV_ERROR = 7            # a: error message
+EV_CHANGE_START = 8     # a: tool number changed from
+EV_CHANGE_END = 9       # a: duration in seconds
+EVENT_NAMES = {
+    EV_STATUS: 'status', EV_DETECT: 'detect',
+    EV_TEMPLATE_START: 'template_start', EV_TEMPLATE_END: 'template_end',
+    EV_OFFSET_Z: 'offset_z', EV_OFFSET_XY: 'offset_xy', EV_ERROR: 'error',
+    EV_CHANGE_START: 'change_start', EV_CHANGE_END: 'change_end',
+}
+# Events whose first value is an index into the string table
+STRING_EVENTS = (EV_TEMPLATE_START, EV_TEMPLATE_END, EV_ERROR)
+STATUS_NAMES = ('uninitialized', 'initializing', 'ready', 'changing', 'error')
+DETECT_NAMES = {-1: 'unavailable', 0: 'absent', 1: 'present'}
+
+
+class EventLog:
+    """Ring buffer of fixed-size event records.
+
+    Recording is a single struct.pack_into into a preallocated bytearray,
+    strings (template names, error messages) are interned once.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.buffer = bytearray(size * RECORD.size)
+        self.total = 0
+        self.strings = ['']
+        self.string_ids = {'': 0}
+
+    def record(self, eventtime, event, change_id=0, tool_number=-1, a=0., b=0.):
+        RECORD.pack_into(self.buffer, (self.total % self.size) * RECORD.size,
+                         eventtime, change_id & 0xffffffff, event, tool_number, a, b)
+        self.total += 1
+
+    def intern(self, text):
+        """Returns the string table id of text, 0 once the table is full."""
+        string_id = self.string_ids.get(text)
+        if string_id is None:
+            if len(self.strings) >= MAX_STRINGS:
+                return 0
+            string_id = self.string_ids[text] = len(self.strings)
+            self.strings.append(text)
+        return string_id
+
+    def dump(self, path):
+        """Writes the records oldest first, returns how many were written."""
+        count = min(self.total, self.size)
+        first = self.total - count
+        strings = json.dumps(self.strings).encode()
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, count, self.total,
+                                len(strings)))
+            f.write(strings)
+            split = (first % self.size) * RECORD.size
+            if count < self.size:
+                f.write(self.buffer[:count * RECORD.size])
+            else:
+                f.write(self.buffer[split:])
+                f.write(self.buffer[:split])
+        return count
+
+
+def read_dump(path):
+    """Returns (total recorded, string table, list of record tuples)."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError("%s: file too short" % (path,))
+    magic, version, record_size, count, total, strings_len = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+        raise ValueError("%s: not a toolchanger event log (version %d)" % (path, VERSION))
+    offset = HEADER.size
+    strings = json.loads(data[offset:offset + strings_len].decode())
+    offset += strings_len
+    records = [RECORD.unpack_from(data, offset + i * RECORD.size) for i in range(count)]
+    return total, strings, records
+
+
+def decode_record(record, strings):
+    """Returns a record as a dict with names resolved."""
+    eventtime, change_id, event, tool_number, a, b = record
+    result = {'eventtime': round(eventtime, 6), 'change': change_id,
+              'event': EVENT_NAMES.get(event, 'event_%d' % (event,))}
+    if tool_number >= 0:
+        result['tool'] = tool_number
+    if event in STRING_EVENTS:
+        index = int(a)
+        result['text'] = strings[index] if 0 < index < len(strings) else '?'
+        if event == EV_TEMPLATE_END:
+            result['duration'] = round(b, 4)
+    elif event == EV_STATUS:
+        index = int(a)
+        result['status'] = STATUS_NAMES[index] if 0 <= index < len(STATUS_NAMES) else '?'
+    elif event == EV_DETECT:
+        result['state'] = DETECT_NAMES.get(int(a), '?')
+    elif event == EV_OFFSET_Z:
+        result['z'] = round(a, 4)
+        result['extra_z'] = round(b, 4)
+    elif event == EV_OFFSET_XY:
+        result['x'] = round(a, 4)
+        result['y'] = round(b, 4)
+    elif event == EV_CHANGE_START:
+        result['from_tool'] = int(a) if a >= 0 else None
+    elif event == EV_CHANGE_END:
+        result['duration'] = round(a, 4)
+    return result
@@ -0,0 +1,471 @@
+# Tool change analysis of G-code files
+#
+# Indexes every T<n> in a print file with its byte offset, layer and the
+# extrusion since the previous change, and models the change time from the
+# toolchanger configuration. Used by TOOL_ASSIGN_OPTIMIZE and by the
+# scripts/tc_gcode_analyzer.py command line tool.
+#
+# Copyright (C) 2025 PrintStructor
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import ast, configparser, glob, itertools, math, mmap
+import multiprocessing, os, re
+
+# Lines that start a new segment: tool changes, layer markers, extrusion
+# mode changes and extruder resets. Everything else is only looked at for
+# its E word, see EXTRUDE_RE.
+MARKER_RE = re.compile(
+    rb'\n(?:T(\d+)[ \t]*(?=[;\r\n]|\Z)'
+    rb'|;LAYER_CHANGE()'
+    rb'|;LAYER:(-?\d+)'
+    rb'|;Z:(-?[.\d]+)'
+    rb'|SET_PRINT_STATS_INFO[^\n]*CURRENT_LAYER=(\d+)'
+    rb'|G92[ \t][^\n;]*E(-?[.\d]+)'
+    rb'|M8([23])\b)')
+EXTRUDE_RE = re.compile(rb'\nG[0-3] [^\nE;]*E(-?[.\d]+)')
+INCLUDE_RE = re.compile(r'^\[include\s+([^\]]+?)\s*\]')
+
+# Files are split into chunks that are scanned in parallel, and chunks into
+# windows for the extrusion pass to keep the match lists small
+CHUNK_SIZE = 64 * 1024 * 1024
+WINDOW_SIZE = 8 * 1024 * 1024
+
+
+def _extrusion(mm, start, end):
+    """Returns (sum, max) of the E words of the moves in [start, end)."""
+    total, high = 0., None
+    while start < end:
+        stop = end
+        if stop - start > WINDOW_SIZE:
+            stop = mm.rfind(b'\n', start, start + WINDOW_SIZE)
+            if stop <= start:
+                stop = mm.find(b'\n', start + 1, end)
+                if stop < 0:
+                    stop = end
+        values = EXTRUDE_RE.findall(mm, start, stop)
+        if values:
+            try:
+                numbers = list(map(float, values))
+            except ValueError:
+                numbers = []
+                for value in values:
+                    try:
+                        numbers.append(float(value))
+                    except ValueError:
+                        pass
+            if numbers:
+                total += sum(numbers)
+                window_high = max(numbers)
+                if high is None or window_high > high:
+                    high = window_high
+        start = stop
+    return total, high
+
+
+def _scan_chunk(job):
+    """Scans the bytes [start, end) of a file.
+
+    Chunks start at a newline (or the file start) and end right before one.
+    Returns the markers with their offsets and the extrusion between them,
+    one more interval than markers."""
+    path, start, end = job
+    markers, intervals = [], []
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = start
+            if start == 0:
+                # The patterns anchor on the preceding newline, the first line has none
+                newline = mm.find(b'\n', 0, end)
+                first = mm[:newline if newline >= 0 else end]
+                match = MARKER_RE.match(b'\n' + first)
+                if match is not None:
+                    intervals.append((0., None))
+                    markers.append((0, match.groups()))
+                    pos = len(first)
+            for match in MARKER_RE.finditer(mm, pos, end):
+                intervals.append(_extrusion(mm, pos, match.start()))
+                markers.append((match.start() + 1, match.groups()))
+                pos = match.end()
+            intervals.append(_extrusion(mm, pos, end))
+    return markers, intervals
+
+
+class ToolChange:
+    """One T<n> occurrence in the file."""
+    __slots__ = ('offset', 'tool', 'previous', 'layer', 'z', 'extruded')
+
+    def __init__(self, offset, tool, previous, layer, z, extruded):
+        self.offset = offset
+        self.tool = tool
+        self.previous = previous
+        self.layer = layer
+        self.z = z
+        self.extruded = extruded
+
+
+class GcodeScan:
+    """Streams a G-code file and collects tool change statistics.
+
+    The file is memory mapped and scanned in chunks with two regular
+    expressions, on several processes for large files. Only the markers
+    come back to this process, the Python heap holds per-tool and per-layer
+    counters. Individual changes are passed to on_change as they are found.
+    """
+    def __init__(self, on_change=None, jobs=None):
+        self.on_change = on_change
+        self.jobs = jobs or os.cpu_count() or 1
+        self.size = 0
+        self.changes = 0
+        self.redundant = 0
+        self.layers = 0
+        self.tool_extruded = {}
+        self.tool_selects = {}
+        self.tool_layers = {}
+        self.layer_changes = {}
+        self.transitions = {}
+        # Scanner state
+        self._tool = None
+        self._layer_change_count = 0
+        self._layer_number = -1
+        self._stats_layer = 0
+        self._z = 0.
+        self._absolute = True
+        self._e_high = 0.
+        self._extruded = 0.
+
+    def scan(self, path):
+        with open(path, 'rb') as f:
+            self.size = os.fstat(f.fileno()).st_size
+            if not self.size:
+                return self
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                jobs = self._split(path, mm)
+        if self.jobs > 1 and len(jobs) > 1:
+            with multiprocessing.Pool(min(self.jobs, len(jobs))) as pool:
+                for result in pool.imap(_scan_chunk, jobs):
+                    self._merge(*result)
+        else:
+            for job in jobs:
+                self._merge(*_scan_chunk(job))
+        self._finish_segment()
+        return self
+
+    def _split(self, path, mm):
+        jobs = []
+        start = 0
+        while start < self.size:
+            end = mm.find(b'\n', start + CHUNK_SIZE)
+            if end < 0:
+                end = self.size
+            jobs.append((path, start, end))
+            start = end
+        return jobs
+
+    def _merge(self, markers, intervals):
+        self._add_extrusion(intervals[0])
+        for (offset, groups), interval in zip(markers, intervals[1:]):
+            self._handle_marker(groups, offset)
+            self._add_extrusion(interval)
+
+    def _add_extrusion(self, interval):
+        total, high = interval
+        if not self._absolute:
+            self._extruded += total
+        elif high is not None and high > self._e_high:
+            self._extruded += high - self._e_high
+            self._e_high = high
+
+    def _layer(self):
+        return max(self._layer_change_count, self._layer_number + 1,
+                   self._stats_layer)
+
+    def _finish_segment(self):
+        if self._tool is None:
+            return
+        extruded = max(0., self._extruded)
+        self.tool_extruded[self._tool] = self.tool_extruded.get(self._tool, 0.) + extruded
+
+    def _handle_marker(self, groups, offset):
+        tool, layer_change, layer_number, z, stats_layer, g92_e, mode = groups
+        if tool is not None:
+            self._handle_change(int(tool), offset)
+        elif layer_change is not None:
+            self._layer_change_count += 1
+        elif layer_number is not None:
+            self._layer_number = int(layer_number)
+        elif z is not None:
+            try:
+                self._z = float(z)
+            except ValueError:
+                pass
+        elif stats_layer is not None:
+            self._stats_layer = int(stats_layer)
+        elif g92_e is not None:
+            try:
+                self._e_high = float(g92_e)
+            except ValueError:
+                self._e_high = 0.
+        elif mode is not None:
+            self._absolute = mode == b'2'
+        layer = self._layer()
+        if layer > self.layers:
+            self.layers = layer
+
+    def _handle_change(self, tool, offset):
+        previous = self._tool
+        if tool == previous:
+            self.redundant += 1
+            return
+        self._finish_segment()
+        layer = self._layer()
+        change = ToolChange(offset, tool, previous, layer, self._z,
+                            max(0., self._extruded))
+        self._extruded = 0.
+        self._tool = tool
+        self.changes += 1
+        self.tool_selects[tool] = self.tool_selects.get(tool, 0) + 1
+        self.tool_layers.setdefault(tool, set()).add(layer)
+        self.layer_changes[layer] = self.layer_changes.get(layer, 0) + 1
+        key = (previous, tool)
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        if self.on_change is not None:
+            self.on_change(change)
+
+######################################################################
+# Toolchanger config and overhead model
+######################################################################
+
+def move_time(distance, speed, accel):
+    """Time of a single trapezoidal move that starts and ends at rest."""
+    if distance <= 0. or speed <= 0.:
+        return 0.
+    if accel <= 0.:
+        return distance / speed
+    if distance < speed * speed / accel:
+        return 2. * math.sqrt(distance / accel)
+    return distance / speed + speed / accel
+
+
+def read_config(path):
+    """Reads a Klipper config file including [include] sections."""
+    parser = configparser.RawConfigParser(
+        strict=False, inline_comment_prefixes=('#', ';'))
+    _read_config_file(parser, os.path.abspath(os.path.expanduser(path)), set())
+    return parser
+
+
+def _read_config_file(parser, path, visited):
+    if path in visited:
+        raise ValueError("Recursive include of config file '%s'" % (path,))
+    visited.add(path)
+    with open(path, 'r') as f:
+        lines = f.read().split('\n')
+    buffer = []
+    for line in lines:
+        match = INCLUDE_RE.match(line)
+        if match is None:
+            buffer.append(line)
+            continue
+        parser.read_string('\n'.join(buffer), path)
+        buffer = []
+        pattern = os.path.join(os.path.dirname(path), match.group(1))
+        filenames = sorted(glob.glob(pattern))
+        if not filenames and not glob.has_magic(pattern):
+            raise ValueError("Include file '%s' does not exist" % (pattern,))
+        for filename in filenames:
+            _read_config_file(parser, filename, visited)
+    parser.read_string('\n'.join(buffer), path)
+    visited.remove(path)
+
+
+def _literal(value):
+    if not isinstance(value, str):
+        return value
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+
+class Dock:
+    def __init__(self, name, x, y, z, path):
+        self.name = name
+        self.x = x
+        self.y = y
+        self.z = z
+        # Dock path offsets as (y, z, speed factor), in dropoff order
+        self.path = path or [(0., 0., 1.)]
+
+    def point(self, index):
+        dy, dz, _ = self.path[index]
+        return (self.x, self.y + dy, self.z + dz)
+
+
+class ChangeModel:
+    """Estimates tool change times from dock positions and speeds.
+
+    A change is modelled as: travel from the print to the old tool's dock,
+    the dock path, travel to the new tool's dock, the reversed dock path,
+    travel back to the print and a fixed settle time for verification and
+    template overhead. XY and Z travel are timed one after the other.
+    Docks are keyed by tool name ('tool T0'), numbers maps T numbers to
+    tool names.
+    """
+    def __init__(self, docks, numbers, fast_speed, path_speed, accel, z_speed,
+                 z_accel, print_position, settle_time=0.5):
+        self.docks = docks
+        self.numbers = numbers
+        self.fast_speed = fast_speed
+        self.path_speed = path_speed
+        self.accel = accel
+        self.z_speed = z_speed
+        self.z_accel = z_accel
+        self.print_position = print_position
+        self.settle_time = settle_time
+
+    @classmethod
+    def from_config(cls, path, settle_time=0.5):
+        config = read_config(path)
+        sections = {name: dict(config.items(name)) for name in config.sections()}
+        return cls.from_sections(sections, settle_time)
+
+    @classmethod
+    def from_sections(cls, sections, settle_time=0.5):
+        """Builds the model from raw config sections ({section: {option: value}}),
+        as read by read_config or from printer.configfile.config."""
+        toolchanger = sections.get('toolchanger')
+        if toolchanger is None:
+            raise ValueError("No [toolchanger] section in config")
+        tc_params = {k: _literal(v) for k, v in toolchanger.items()
+                     if k.startswith('params_')}
+        docks, numbers = {}, {}
+        for section, options in sections.items():
+            if not section.startswith('tool ') or 'tool_number' not in options:
+                continue
+            params = dict(tc_params)
+            params.update({k: _literal(v) for k, v in options.items()
+                           if k.startswith('params_')})
+            if 'params_park_x' not in params or 'params_park_y' not in params:
+                continue
+            path_points = params.get('params_%s_path' % (params.get('params_type'),), [])
+            dock_path = [(float(p.get('y', 0.)), float(p.get('z', 0.)), float(p.get('f', 1.)))
+                         for p in path_points]
+            docks[section] = Dock(section, float(params['params_park_x']),
+                               float(params['params_park_y']),
+                               float(params.get('params_park_z', 0.)), dock_path)
+            numbers[int(options['tool_number'])] = section
+        if not docks:
+            raise ValueError("No [tool] sections with params_park_x/y in config")
+
+        def getfloat(section, option, default):
+            return float(sections.get(section, {}).get(option, default))
+        max_velocity = getfloat('printer', 'max_velocity', 300.)
+        accel = getfloat('printer', 'max_accel', 3000.)
+        fast_speed = float(tc_params.get('params_fast_speed', max_velocity * 60.)) / 60.
+        path_speed = float(tc_params.get('params_path_speed', fast_speed * 60.)) / 60.
+        center = []
+        for axis in 'xy':
+            low = getfloat('stepper_' + axis, 'position_min', 0.)
+            high = getfloat('stepper_' + axis, 'position_max', 2. * low)
+            center.append((low + high) / 2.)
+        return cls(docks, numbers, min(fast_speed, max_velocity), path_speed, accel,
+                   getfloat('printer', 'max_z_velocity', max_velocity),
+                   getfloat('printer', 'max_z_accel', accel),
+                   (center[0], center[1], 0.), settle_time)
+
+    def travel_time(self, start, end, speed=None):
+        xy = math.hypot(end[0] - start[0], end[1] - start[1])
+        z = abs(end[2] - start[2])
+        return (move_time(xy, min(speed or self.fast_speed, self.fast_speed), self.accel)
+                + move_time(z, min(speed or self.z_speed, self.z_speed), self.z_accel))
+
+    def path_time(self, dock):
+        total = 0.
+        for i in range(1, len(dock.path)):
+            speed = self.path_speed * dock.path[i][2]
+            total += self.travel_time(dock.point(i - 1), dock.point(i), speed)
+        return total
+
+    def change_time(self, old, new, z=0.):
+        """Estimated duration of a change between two docks (tool names).
+
+        Either side may be None for the initial pickup or a final dropoff."""
+        origin = (self.print_position[0], self.print_position[1], z)
+        position = origin
+        total = self.settle_time
+        dock = self.docks.get(old)
+        if dock is not None:
+            total += self.travel_time(position, dock.point(0))
+            total += self.path_time(dock)
+            position = dock.point(-1)
+        dock = self.docks.get(new)
+        if dock is not None:
+            total += self.travel_time(position, dock.point(-1))
+            total += self.path_time(dock)
+            position = dock.point(0)
+        return total + self.travel_time(position, origin)
+
+######################################################################
+# Dock assignment
+######################################################################
+
+# Up to this many docks every assignment is tried, above that pairs of
+# docks are swapped until no swap improves the total
+EXHAUSTIVE_DOCKS = 8
+
+
+def assignment_cost(costs, transitions, assignment):
+    """Total change time of transitions ({(from, to): count}, T numbers)
+    with assignment ({number: tool name})."""
+    total = 0.
+    for (old, new), count in transitions.items():
+        total += count * costs[(assignment.get(old), assignment.get(new))]
+    return total
+
+
+def optimize_assignment(model, transitions, current):
+    """Finds the T number to dock assignment with the lowest change time.
+
+    current maps T numbers to tool names and defines which numbers and
+    docks take part. Returns (assignment, cost, current cost)."""
+    numbers = sorted(current)
+    docks = [current[n] for n in numbers]
+    transitions = {(old, new): count for (old, new), count in transitions.items()
+                   if (old is None or old in current) and (new is None or new in current)}
+    names = docks + [None]
+    costs = {(a, b): model.change_time(a, b) for a in names for b in names}
+    current_cost = assignment_cost(costs, transitions, current)
+    best, best_cost = dict(current), current_cost
+    if len(docks) <= EXHAUSTIVE_DOCKS:
+        # On equal cost prefer the assignment that moves the fewest tools
+        best_key = (round(best_cost, 6), 0)
+        for order in itertools.permutations(docks):
+            assignment = dict(zip(numbers, order))
+            cost = assignment_cost(costs, transitions, assignment)
+            key = (round(cost, 6), sum(current[n] != assignment[n] for n in numbers))
+            if key < best_key:
+                best, best_cost, best_key = assignment, cost, key
+        return best, best_cost, current_cost
+    improved = True
+    while improved:
+        improved = False
+        for i, j in itertools.combinations(numbers, 2):
+            assignment = dict(best)
+            assignment[i], assignment[j] = assignment[j], assignment[i]
+            cost = assignment_cost(costs, transitions, assignment)
+            if cost < best_cost - 1e-9:
+                best, best_cost, improved = assignment, cost, True
+    return best, best_cost, current_cost
+
+
+def assignment_commands(current, assignment):
+    """ASSIGN_TOOL commands that turn current into assignment."""
+    return ['ASSIGN_TOOL TOOL="%s" N=%d' % (name, number)
+            for number, name in sorted(assignment.items())
+            if current.get(number) != name]
+
+
+def scan_transitions(path):
+    """Returns the {(from, to): count} change transitions of a G-code file.
+
+    Runs single process, for use from a background process in Klippy."""
+    return GcodeScan(jobs=1).scan(path).transitions
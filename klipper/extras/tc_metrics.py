@@ -0,0 +1,232 @@
+# Toolchanger metrics in Prometheus text format
+#
+# Counters are kept in memory by the toolchanger and persisted to a JSON
+# state file, so per-dock cycle counts survive restarts. Rendering happens
+# on the reactor, file and socket IO on background threads.
+#
+# Copyright (C) 2025 PrintStructor
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import json, logging, os, queue, re, socket, threading
+
+CHANGE_DURATION_BUCKETS = (1., 2., 3., 5., 8., 13., 20., 30., 60.)
+SCRIPT_ERROR_RE = re.compile(r'^Script running error in ([\w.]+)')
+
+
+def failure_cause(message):
+    """Maps an error message to a low-cardinality cause label."""
+    match = SCRIPT_ERROR_RE.match(message)
+    if match:
+        return 'template_' + match.group(1).replace('.', '_')
+    lower = message.lower()
+    if 'pickup' in lower:
+        return 'pickup_verification'
+    if 'dropoff' in lower:
+        return 'dropoff_verification'
+    if 'detect' in lower:
+        return 'detection'
+    if 'initialize' in lower:
+        return 'initialization'
+    return 'other'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class ToolchangerMetrics:
+    def __init__(self, state_path, output_path=None, socket_path=None):
+        self.state_path = state_path
+        self.output_path = output_path
+        self.socket_path = socket_path
+        self.changes = 0
+        self.failures = {}
+        self.pickups = {}
+        self.dropoffs = {}
+        self.tool_losses = 0
+        self.heat_barrier_hidden = 0.
+        self.heat_barrier_waited = 0.
+        self.duration_buckets = [0] * len(CHANGE_DURATION_BUCKETS)
+        self.duration_sum = 0.
+        self.duration_count = 0
+        self.text = ''
+        self.queue = queue.Queue()
+        self.server = None
+        self.threads = []
+
+    # Reactor side
+
+    def start(self):
+        self._load_state()
+        writer = threading.Thread(target=self._write_loop, name='tc-metrics-writer')
+        writer.daemon = True
+        writer.start()
+        self.threads.append(writer)
+        if self.socket_path:
+            try:
+                if os.path.exists(self.socket_path):
+                    os.unlink(self.socket_path)
+                self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.server.bind(self.socket_path)
+                self.server.listen(4)
+            except (IOError, OSError):
+                logging.exception("toolchanger: unable to serve metrics on %s"
+                                  % (self.socket_path,))
+                self.server = None
+            else:
+                server = threading.Thread(target=self._serve_loop, name='tc-metrics-server')
+                server.daemon = True
+                server.start()
+                self.threads.append(server)
+        self.publish()
+
+    def stop(self):
+        self.queue.put(None)
+        if self.server is not None:
+            server, self.server = self.server, None
+            try:
+                server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            server.close()
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+
+    def note_change(self, dropoff_tool, pickup_tool, duration):
+        self.changes += 1
+        if dropoff_tool is not None:
+            self.dropoffs[dropoff_tool] = self.dropoffs.get(dropoff_tool, 0) + 1
+        if pickup_tool is not None:
+            self.pickups[pickup_tool] = self.pickups.get(pickup_tool, 0) + 1
+        for i, bound in enumerate(CHANGE_DURATION_BUCKETS):
+            if duration <= bound:
+                self.duration_buckets[i] += 1
+        self.duration_sum += duration
+        self.duration_count += 1
+        self.publish()
+
+    def note_failure(self, message):
+        cause = failure_cause(message)
+        self.failures[cause] = self.failures.get(cause, 0) + 1
+        self.publish()
+
+    def note_tool_loss(self):
+        self.tool_losses += 1
+        self.publish()
+
+    def note_heat_barrier(self, hidden, waited):
+        self.heat_barrier_hidden += hidden
+        self.heat_barrier_waited += waited
+
+    def publish(self):
+        """Renders the metrics and hands them to the writer thread."""
+        self.text = self.render()
+        self.queue.put((self.text, self.get_state()))
+
+    def render(self):
+        lines = []
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in samples:
+                label_text = ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels)
+                if label_text:
+                    label_text = '{%s}' % (label_text,)
+                lines.append('%s%s %r' % (name, label_text, value))
+        metric('toolchanger_changes_total', 'counter', "Completed tool changes",
+               [((), self.changes)])
+        metric('toolchanger_failures_total', 'counter', "Tool change errors by cause",
+               [((('cause', cause),), count) for cause, count in sorted(self.failures.items())])
+        metric('toolchanger_dock_pickups_total', 'counter', "Tool pickups per dock",
+               [((('tool', tool),), count) for tool, count in sorted(self.pickups.items())])
+        metric('toolchanger_dock_dropoffs_total', 'counter', "Tool dropoffs per dock",
+               [((('tool', tool),), count) for tool, count in sorted(self.dropoffs.items())])
+        metric('toolchanger_tool_losses_total', 'counter', "Tools lost during a print",
+               [((), self.tool_losses)])
+        metric('toolchanger_heat_barrier_hidden_seconds_total', 'counter',
+               "Heating time overlapped with change moves", [((), self.heat_barrier_hidden)])
+        metric('toolchanger_heat_barrier_waited_seconds_total', 'counter',
+               "Time waited for the new tool to heat", [((), self.heat_barrier_waited)])
+        name = 'toolchanger_change_duration_seconds'
+        metric(name, 'histogram', "Tool change duration, host side", [])
+        for bound, count in zip(CHANGE_DURATION_BUCKETS, self.duration_buckets):
+            lines.append('%s_bucket{le="%r"} %d' % (name, bound, count))
+        lines.append('%s_bucket{le="+Inf"} %d' % (name, self.duration_count))
+        lines.append('%s_sum %r' % (name, self.duration_sum))
+        lines.append('%s_count %d' % (name, self.duration_count))
+        return '\n'.join(lines) + '\n'
+
+    def get_state(self):
+        return {'changes': self.changes, 'failures': dict(self.failures),
+                'pickups': dict(self.pickups), 'dropoffs': dict(self.dropoffs),
+                'tool_losses': self.tool_losses,
+                'heat_barrier_hidden': self.heat_barrier_hidden,
+                'heat_barrier_waited': self.heat_barrier_waited,
+                'duration_buckets': list(self.duration_buckets),
+                'duration_sum': self.duration_sum, 'duration_count': self.duration_count}
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        self.changes = state.get('changes', 0)
+        self.failures = state.get('failures', {})
+        self.pickups = state.get('pickups', {})
+        self.dropoffs = state.get('dropoffs', {})
+        self.tool_losses = state.get('tool_losses', 0)
+        self.heat_barrier_hidden = state.get('heat_barrier_hidden', 0.)
+        self.heat_barrier_waited = state.get('heat_barrier_waited', 0.)
+        buckets = state.get('duration_buckets', [])
+        if len(buckets) == len(CHANGE_DURATION_BUCKETS):
+            self.duration_buckets = buckets
+            self.duration_sum = state.get('duration_sum', 0.)
+            self.duration_count = state.get('duration_count', 0)
+
+    # Background threads
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            # Only the latest snapshot matters
+            while item is not None and not self.queue.empty():
+                item = self.queue.get()
+            if item is None:
+                return
+            text, state = item
+            try:
+                if self.output_path:
+                    _write_atomic(self.output_path, text)
+                _write_atomic(self.state_path, json.dumps(state))
+            except (IOError, OSError):
+                logging.exception("toolchanger: metrics write failed")
+
+    def _serve_loop(self):
+        while True:
+            server = self.server
+            if server is None:
+                return
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            try:
+                conn.settimeout(1.)
+                conn.recv(4096)
+                body = self.text.encode()
+                conn.sendall(b'HTTP/1.0 200 OK\r\n'
+                             b'Content-Type: text/plain; version=0.0.4\r\n'
+                             b'Content-Length: %d\r\n\r\n' % (len(body),) + body)
+            except OSError:
+                pass
+            finally:
+                conn.close()
+
+
+def _write_atomic(path, text):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
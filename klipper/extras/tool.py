@@ -18,7 +18,7 @@
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
 
-from . import toolchanger
+from . import tc_event_log, toolchanger
 
 # ==============================================================================
 #                              Tool Class
@@ -73,9 +73,23 @@ class Tool:
         self.extruder_name = self._config_get(config, 'extruder', None)
         detect_pin_name = config.get('detection_pin', None)
         self.detect_state = toolchanger.DETECT_UNAVAILABLE
+        self.detection_endstop = None
+        self.detection_approach = self._config_getboolean(config, 'detection_approach', False)
+        self.tool_loss_trigger = self._config_getboolean(config, 'tool_loss_trigger', False)
         if detect_pin_name:
+            # The detection pin doubles as an endstop for TOOL_DETECT_MOVE, the
+            # speculative pickup check and the tool loss trigger, so it must be
+            # shareable before buttons claims it.
+            use_endstop = (self.detection_approach or self.tool_loss_trigger
+                           or self.toolchanger.speculative_pickup)
+            if use_endstop:
+                ppins = self.printer.lookup_object('pins')
+                pin_params = ppins.parse_pin(detect_pin_name, can_invert=True, can_pullup=True)
+                ppins.allow_multi_use_pin("%s:%s" % (pin_params['chip_name'], pin_params['pin']))
             self.printer.load_object(config, 'buttons').register_buttons([detect_pin_name], self._handle_detect)
             self.detect_state = toolchanger.DETECT_ABSENT
+            if use_endstop:
+                self.detection_endstop = DetectionEndstop(config, detect_pin_name)
 
         self.extruder_stepper_name = self._config_get(config, 'extruder_stepper', None)
         self.extruder = None
@@ -85,6 +99,9 @@ class Tool:
         self.t_command_restore_axis = self._config_get(config, 't_command_restore_axis', 'XYZ')
         self.tool_number = config.getint('tool_number', -1, minval=0)
 
+        # Motion profile, applied by the toolchanger when this tool is selected
+        self.motion_profile = self._load_motion_profile(config)
+
         # Z-offset matrix (dynamically sized based on toolchanger config)
         max_tool_count = self.toolchanger.params.get('max_tool_count', 6)
         self.z_offsets = {}
@@ -179,6 +196,8 @@ class Tool:
         # Pin LOW  (False) = Tool not detected (in dock) -> DETECT_ABSENT
         old_state = self.detect_state
         self.detect_state = toolchanger.DETECT_PRESENT if is_triggered else toolchanger.DETECT_ABSENT
+        self.toolchanger.log_event(tc_event_log.EV_DETECT, self, self.detect_state,
+                                   eventtime=eventtime)
 
         try:
             self.toolchanger.note_detect_change(self)
@@ -198,18 +217,24 @@ class Tool:
                 self.detect_state != toolchanger.DETECT_PRESENT and
                 is_printing):  # ← Only trigger during active print or pause!
                 # Tool has dropped during print! Call safety handler
-                self._handle_tool_loss()
+                self._handle_tool_loss(eventtime)
         except Exception as e:
             self.gcode.respond_info(f"Tool detect state update failed: {e}")
 
-    def _handle_tool_loss(self):
+    def _handle_tool_loss(self, eventtime):
         """Called when active tool is lost during operation (event-driven)."""
-        # 1. PAUSE print IMMEDIATELY (fastest response - before macro execution)
-        #    This stops the print and saves position automatically
+        # 1. Stop the SD feed in Python, before any G-code runs, and drop the
+        #    moves still in the lookahead. Records how long that took.
+        try:
+            self.toolchanger.stop_for_tool_loss(self, eventtime)
+        except Exception as e:
+            self.gcode.respond_info(f"Tool loss fast stop failed: {e}")
+
+        # 2. PAUSE print (saves position and temperature for RESUME)
         self.gcode.run_script_from_command("PAUSE")
 
         try:
-            # 2. Call the configured safety macro (heater off, Z-lift if safe, LED)
+            # 3. Call the configured safety macro (heater off, Z-lift if safe, LED)
             self.gcode.run_script_from_command("_TOOLCHANGER_TOOL_LOSS_HANDLER T=%d" % self.tool_number)
         except Exception as e:
             # Fallback: at minimum, report the error
@@ -347,7 +372,7 @@ class Tool:
         try:
             self.assign_tool(number, replace=True)
             try:
-                gcmd.respond_info(f"Tool {self.name} assigned to T{number}")
+                self.toolchanger.respond(f"Tool {self.name} assigned to T{number}", gcmd=gcmd)
             except Exception:
                 pass
         except Exception as e:
@@ -432,6 +457,75 @@ class Tool:
     def _config_getboolean(self, config, name, default_value):
         return config.getboolean(name, self.toolchanger.config.getboolean(name, default_value))
 
+    def _load_motion_profile(self, config):
+        """Resolves the per-tool motion options once, with the toolchanger
+        section and the legacy params_input_shaper_* values as fallbacks."""
+        shaper = {}
+        for axis in 'xy':
+            shaper_type = self._config_get(config, 'input_shaper_type_' + axis, None)
+            if shaper_type is None:
+                shaper_type = self.params.get('params_input_shaper_type_' + axis)
+            if shaper_type is not None:
+                shaper['SHAPER_TYPE_' + axis.upper()] = str(shaper_type).lower()
+            for option, key in (('input_shaper_freq_', 'SHAPER_FREQ_'),
+                                ('input_shaper_damping_ratio_', 'DAMPING_RATIO_')):
+                value = self._config_getfloat(config, option + axis, None)
+                if value is None and self.params.get('params_' + option + axis) is not None:
+                    try:
+                        value = float(self.params['params_' + option + axis])
+                    except (TypeError, ValueError):
+                        raise config.error("Option 'params_%s%s' in section '%s' must be a number"
+                                           % (option, axis, config.get_name()))
+                if value is not None:
+                    shaper[key + axis.upper()] = value
+        profile = {}
+        if shaper:
+            profile['input_shaper'] = shaper
+        for option in ('pressure_advance', 'pressure_advance_smooth_time',
+                       'max_accel', 'square_corner_velocity'):
+            value = self._config_getfloat(config, option, None)
+            if value is not None:
+                if value < 0.:
+                    raise config.error("Option '%s' in section '%s' must not be negative"
+                                       % (option, config.get_name()))
+                profile[option] = value
+        return profile
+
+# ==============================================================================
+#                       Detection Pin Endstop
+# ==============================================================================
+
+class DetectionEndstop:
+    """Endstop on the tool detection pin, used for detection-triggered moves,
+    the speculative pickup check and the MCU tool loss trigger."""
+
+    def __init__(self, config, pin):
+        self.printer = config.get_printer()
+        ppins = self.printer.lookup_object('pins')
+        pin_params = ppins.lookup_pin(pin, can_invert=True, can_pullup=True)
+        mcu = pin_params['chip']
+        self.mcu_endstop = mcu.setup_pin('endstop', pin_params)
+        self.printer.register_event_handler('klippy:mcu_identify',
+                                            self._handle_mcu_identify)
+        # Wrappers
+        self.get_mcu = self.mcu_endstop.get_mcu
+        self.add_stepper = self.mcu_endstop.add_stepper
+        self.get_steppers = self.mcu_endstop.get_steppers
+        self.home_start = self.mcu_endstop.home_start
+        self.home_wait = self.mcu_endstop.home_wait
+        self.query_endstop = self.mcu_endstop.query_endstop
+
+    def _handle_mcu_identify(self):
+        # Dock approaches move several axes at once, so every XYZ stepper
+        # has to stop when the pin triggers.
+        kin = self.printer.lookup_object('toolhead').get_kinematics()
+        for stepper in kin.get_steppers():
+            if any(stepper.is_active_axis(axis) for axis in 'xyz'):
+                self.add_stepper(stepper)
+
+    def get_position_endstop(self):
+        return 0.
+
 # ==============================================================================
 #                          Module Hooks
 # ==============================================================================
@@ -19,7 +19,8 @@
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
 
-import ast, bisect
+import ast, bisect, json, logging, multiprocessing, os, re, time, traceback
+from . import tc_event_log, tc_gcode_analyzer, tc_metrics
 
 # ==============================================================================
 #                              Constants
@@ -35,11 +36,42 @@ INIT_MANUAL = 1
 INIT_FIRST_USE = 2
 ON_AXIS_NOT_HOMED_ABORT = 0
 ON_AXIS_NOT_HOMED_HOME = 1
+VELOCITY_LIMIT_STATUS = {
+    'VELOCITY': 'max_velocity',
+    'ACCEL': 'max_accel',
+    'SQUARE_CORNER_VELOCITY': 'square_corner_velocity',
+    'MINIMUM_CRUISE_RATIO': 'minimum_cruise_ratio',
+}
+# Toolhead attribute behind each of those status values
+VELOCITY_LIMIT_ATTRIBUTE = {
+    'VELOCITY': 'max_velocity',
+    'ACCEL': 'max_accel',
+    'SQUARE_CORNER_VELOCITY': 'square_corner_velocity',
+    'MINIMUM_CRUISE_RATIO': 'min_cruise_ratio',
+}
 XYZ_TO_INDEX = {'x': 0, 'X': 0, 'y': 1, 'Y': 1, 'z': 2, 'Z': 2}
 INDEX_TO_XYZ = 'XYZ'
 DETECT_UNAVAILABLE = -1
 DETECT_ABSENT = 0
 DETECT_PRESENT = 1
+VERBOSITY_QUIET = 0
+VERBOSITY_NORMAL = 1
+VERBOSITY_DEBUG = 2
+VERBOSITY_LEVELS = {'quiet': VERBOSITY_QUIET, 'normal': VERBOSITY_NORMAL,
+                    'debug': VERBOSITY_DEBUG}
+# Pin sampling of the MCU tool loss trigger, same scheme as homing endstops
+LOSS_TRIGGER_SAMPLE_TIME = 0.000015
+LOSS_TRIGGER_SAMPLE_COUNT = 4
+LOSS_TRIGGER_REST_TIME = 0.001
+# Time after the last stage-1 move until the pickup is checked
+PICKUP_SETTLE_TIME = 0.2
+# How long the tool loss fast path waits for an armed MCU trigger to report
+LOSS_TRIGGER_REPORT_TIMEOUT = 0.1
+# Commands that depend on the G-code position. With lazy_restore a pending XY
+# restore is completed before they run. PAUSE and RESTORE_GCODE_STATE MOVE=1
+# drop it instead, see _wrap_pause() and _wrap_restore_state().
+LAZY_RESTORE_FLUSH_COMMANDS = ('G2', 'G3', 'G92', 'M114', 'GET_POSITION',
+                               'SET_KINEMATIC_POSITION')
 
 
 class Toolchanger:
@@ -63,6 +95,29 @@ class Toolchanger:
         self.verify_tool_dropoff = config.getboolean('verify_tool_dropoff', False)
         self.require_tool_present = config.getboolean('require_tool_present', False)
         self.transfer_fan_speed = config.getboolean('transfer_fan_speed', True)
+        self.verbosity = config.getchoice('verbosity', VERBOSITY_LEVELS, 'normal')
+        self.speculative_pickup = config.getboolean('speculative_pickup', False)
+        self.heat_barrier = config.getboolean('heat_barrier', False)
+        self.heat_barrier_tolerance = config.getfloat('heat_barrier_tolerance', 5.0, minval=0.)
+        self.heat_barrier_timeout = config.getfloat('heat_barrier_timeout', 600., minval=0.)
+        self.lazy_restore = config.getboolean('lazy_restore', False)
+        self.lazy_restore_speed = config.getfloat('lazy_restore_speed', 200., above=0.)
+        self.change_envelope = {}
+        for option, key in (('change_max_velocity', 'VELOCITY'),
+                            ('change_max_accel', 'ACCEL'),
+                            ('change_square_corner_velocity', 'SQUARE_CORNER_VELOCITY'),
+                            ('change_minimum_cruise_ratio', 'MINIMUM_CRUISE_RATIO')):
+            value = config.getfloat(option, None, minval=0.)
+            if value is not None:
+                self.change_envelope[key] = value
+        self.change_envelope_saved = None
+        self.change_coalescer = None
+        if config.getboolean('coalesce_changes', False):
+            self.change_coalescer = ChangeCoalescer(self, config)
+        self.journal = None
+        journal_file = config.get('journal_file', None)
+        if journal_file:
+            self.journal = ChangeJournal(os.path.expanduser(journal_file))
         self.uses_axis = config.get('uses_axis', 'xyz').lower()
         home_options = {'abort': ON_AXIS_NOT_HOMED_ABORT,
                         'home': ON_AXIS_NOT_HOMED_HOME}
@@ -87,9 +142,18 @@ class Toolchanger:
         config.get('t_command_restore_axis', None)
         config.get('extruder', None)
         config.get('fan', None)
+        config.getboolean('detection_approach', None)
+        config.getboolean('tool_loss_trigger', None)
+        for axis in 'xy':
+            config.get('input_shaper_type_' + axis, None)
+            config.getfloat('input_shaper_freq_' + axis, None)
+            config.getfloat('input_shaper_damping_ratio_' + axis, None)
+        for option in ('pressure_advance', 'pressure_advance_smooth_time',
+                       'max_accel', 'square_corner_velocity'):
+            config.getfloat(option, None)
         config.get_prefix_options('params_')
 
-        self.status = STATUS_UNINITALIZED
+        self._status = STATUS_UNINITALIZED
         self.active_tool = None
         self.initial_tool = None
         self.detected_tool = None
@@ -103,9 +167,50 @@ class Toolchanger:
         self.current_change_id = -1
         self.last_change_restore_position = None
         self.last_change_start_position = None
+        self.last_detect_position = None
+        self.detect_move_tool = None
+        self.heat_barrier_state = None
+        self.heat_barrier_hidden = 0.0
+        self.heat_barrier_waited = 0.0
+        self.deferred_restore = None
+        self.deferred_restore_z = 0.0
+        # Restore dropped by PAUSE or a tool loss, RESUME returns there
+        self.paused_restore = None
+        self.speculative_check = None  # Running speculative pickup check
+        self.change_history = {}  # (from number, to number) -> count, for TOOL_ASSIGN_OPTIMIZE
+        self.last_tool_loss = None
+        self.tool_loss_count = 0
+        self.loss_trigger = None  # Armed MCU tool loss trigger, see _arm_loss_trigger
+        self.homing_rails = False  # Between homing:home_rails_begin and _end
+        self.journal_recovery = None  # Unfinished change reloaded from the journal
+        self.last_applied_offsets = {}  # Offset breakdown, printed only at verbosity debug
+        self.event_log = None
+        event_log_size = config.getint('event_log_size', 4096, minval=0)
+        if event_log_size:
+            self.event_log = tc_event_log.EventLog(event_log_size)
+        self.metrics = None
+        metrics_file = config.get('metrics_file', None)
+        metrics_socket = config.get('metrics_socket', None)
+        if metrics_file or metrics_socket:
+            config_dir = os.path.dirname(self.printer.get_start_args().get('config_file', ''))
+            metrics_state_file = config.get(
+                'metrics_state_file', os.path.join(config_dir, 'toolchanger_metrics.json'))
+            self.metrics = tc_metrics.ToolchangerMetrics(
+                os.path.expanduser(metrics_state_file),
+                metrics_file and os.path.expanduser(metrics_file),
+                metrics_socket and os.path.expanduser(metrics_socket))
+            self.printer.register_event_handler('klippy:disconnect', self.metrics.stop)
 
         self.printer.register_event_handler("homing:home_rails_begin",
                                             self._handle_home_rails_begin)
+        self.printer.register_event_handler("homing:home_rails_end",
+                                            self._handle_home_rails_end)
+        self.printer.register_event_handler("homing:homing_move_begin",
+                                            self._handle_homing_move_begin)
+        self.printer.register_event_handler("homing:homing_move_end",
+                                            self._handle_homing_move_end)
+        self.printer.register_event_handler("idle_timeout:ready",
+                                            self._handle_idle_ready)
         self.printer.register_event_handler('klippy:connect',
                                             self._handle_connect)
         self.printer.register_event_handler("klippy:shutdown",
@@ -137,9 +242,31 @@ class Toolchanger:
                                     self.cmd_SAVE_TOOL_PARAMETER)
         self.gcode.register_command("VERIFY_TOOL_DETECTED",
                                     self.cmd_VERIFY_TOOL_DETECTED)
+        self.gcode.register_command("WAIT_TOOL_HEAT_BARRIER",
+                                    self.cmd_WAIT_TOOL_HEAT_BARRIER,
+                                    desc=self.cmd_WAIT_TOOL_HEAT_BARRIER_help)
+        self.gcode.register_command("TOOL_DETECT_MOVE",
+                                    self.cmd_TOOL_DETECT_MOVE,
+                                    desc=self.cmd_TOOL_DETECT_MOVE_help)
+        self.gcode.register_command("TOOL_ASSIGN_OPTIMIZE",
+                                    self.cmd_TOOL_ASSIGN_OPTIMIZE,
+                                    desc=self.cmd_TOOL_ASSIGN_OPTIMIZE_help)
+        self.gcode.register_command("SET_TOOLCHANGER_VERBOSITY",
+                                    self.cmd_SET_TOOLCHANGER_VERBOSITY,
+                                    desc=self.cmd_SET_TOOLCHANGER_VERBOSITY_help)
+        self.gcode.register_command("TOOLCHANGER_DUMP_LOG",
+                                    self.cmd_TOOLCHANGER_DUMP_LOG,
+                                    desc=self.cmd_TOOLCHANGER_DUMP_LOG_help)
         self.fan_switcher = None
         self.validate_tool_timer = None
 
+        # Lazy restore: the XY restore is merged into the first move after a change.
+        # Speculative pickup: stage-2 moves stop once the detection check failed.
+        if self.lazy_restore or self.speculative_pickup:
+            for move_cmd in ('G0', 'G1'):
+                move_handler = self.gcode.register_command(move_cmd, None)
+                self.gcode.register_command(move_cmd, self._wrap_move(move_handler))
+
         # Override SET_GCODE_OFFSET to hook baby-stepping
         gcode = self.printer.lookup_object('gcode')
         gcode.register_command('SET_GCODE_OFFSET', None)
@@ -167,6 +294,7 @@ class Toolchanger:
     def _wait_for_detection_state(self, expected, expect_present, retries=10, delay=0.1):
         """Polls expected.detect_state; returns True if the desired state is reached."""
         toolhead = self.printer.lookup_object('toolhead')
+        self._flush_rounded_path()
         toolhead.wait_moves()
         reactor = self.printer.get_reactor()
         for i in range(retries):
@@ -180,9 +308,109 @@ class Toolchanger:
         # Timeout - don't log, will be handled by error_gcode
         return False
 
+    def _start_detection_check(self, tool, pickup_trigger=False):
+        """Checks tool presence once the queued moves so far have completed.
+
+        Same lookahead timing as VERIFY_TOOL_DETECTED ASYNC=1, but the result
+        is handed back to select_tool instead of raising from the timer. With
+        pickup_trigger the detection pin is also armed as a trsync from that
+        point on, so the MCU halts the moves queued behind the check itself.
+        """
+        toolhead = self.printer.lookup_object('toolhead')
+        reactor = self.printer.get_reactor()
+        check = {'done': False, 'ok': False, 'retries': 10}
+        def timer_handler(eventtime):
+            check['retries'] -= 1
+            if tool.detect_state == DETECT_PRESENT or check['retries'] <= 0:
+                check['ok'] = tool.detect_state == DETECT_PRESENT
+                check['done'] = True
+                return reactor.NEVER
+            return eventtime + 0.1
+        def lookahead_callback(print_time):
+            delay = max(0.0, print_time - toolhead.mcu.estimated_print_time(reactor.monotonic()))
+            reactor.register_timer(timer_handler,
+                                   reactor.monotonic() + PICKUP_SETTLE_TIME + delay)
+            if pickup_trigger and self.loss_trigger is None:
+                self._start_trigger(tool, print_time + PICKUP_SETTLE_TIME, 'pickup', check)
+        # The check point is the end of stage 1, including an open ROUNDED_G0 chain
+        self._flush_rounded_path()
+        toolhead.register_lookahead_callback(lookahead_callback)
+        return check
+
+    def _flush_rounded_path(self):
+        """Ends a ROUNDED_G0 chain a template left open before waiting on the
+        toolhead, the waits below do not go through G-code."""
+        rounded_path = self.printer.lookup_object('rounded_path', None)
+        if rounded_path is not None:
+            rounded_path.flush()
+
+    def _speculative_check_failed(self):
+        check = self.speculative_check
+        return check is not None and check['done'] and not check['ok']
+
+    def _wait_detection_check(self, check):
+        """Waits for a check started by _start_detection_check; returns its result."""
+        reactor = self.printer.get_reactor()
+        while not check['done']:
+            reactor.pause(reactor.monotonic() + 0.05)
+        return check['ok']
+
+    def _verify_pickup_detection(self, tool, ok):
+        """Runs the stage-1 failure path if needed; returns False if the pickup failed."""
+        if not ok:
+            self._flush_motion_and_freeze_position()
+            safe_y = self.params.get('params_safe_y', 105)
+
+            # CRITICAL SAFETY: Save temperature BEFORE error_gcode runs!
+            # This is part of the safety system - error_gcode might turn off heaters
+            self._save_tool_temperature_for_resume(tool)
+
+            self.gcode.respond_info("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+            self.gcode.respond_info("📋 RECOVERY STEPS:")
+            self.gcode.respond_info("1. Manually attach T%d to the shuttle" % tool.tool_number)
+            self.gcode.respond_info("2. Run: G0 Y%d F6000" % safe_y)
+            self.gcode.respond_info("3. Run: RESUME (will auto-heat and continue)")
+            self.gcode.respond_info("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+            self._process_error("Tool pickup verification failed (stage1)")
+            self._pause_print()
+            self.gcode.run_script_from_command("RESTORE_GCODE_STATE NAME=_toolchange_state MOVE=0")
+            return False
+
+        # Double-check: correct tool?
+        self.note_detect_change(tool)
+        if self.detected_tool != tool:
+            self._flush_motion_and_freeze_position()
+
+            # CRITICAL SAFETY: Save temperature BEFORE error_gcode runs!
+            self._save_tool_temperature_for_resume(tool)
+
+            self._process_error(
+                "Tool mismatch: expected %s, detected %s" % (tool.name, self.detected_tool.name if self.detected_tool else 'None')
+            )
+            self._pause_print()
+            self.gcode.run_script_from_command("RESTORE_GCODE_STATE NAME=_toolchange_state MOVE=0")
+            return False
+        return True
+
+    def _drop_lookahead(self):
+        """Drops the moves still in the toolhead's lookahead queue, the only
+        ones the host can take back, and returns how many. The toolhead
+        position moves back to the end of the committed motion."""
+        toolhead = self.printer.lookup_object('toolhead')
+        lookahead = getattr(toolhead, 'lookahead', None) or getattr(toolhead, 'move_queue', None)
+        queue = getattr(lookahead, 'queue', None)
+        if not queue:
+            return 0
+        dropped = len(queue)
+        position = list(queue[0].start_pos)
+        lookahead.reset()
+        toolhead.set_position(position)
+        return dropped
+
     def _flush_motion_and_freeze_position(self):
         """Stops planned moves and freezes the current position (no shutdown)."""
         try:
+            self._drop_lookahead()
             self.gcode.run_script_from_command("M400")
             toolhead = self.printer.lookup_object('toolhead')
             self.gcode.run_script_from_command(
@@ -194,6 +422,363 @@ class Toolchanger:
         except Exception:
             pass
 
+    def stop_for_tool_loss(self, tool, eventtime):
+        """Fast path on loss of the active tool, runs before PAUSE and the loss macro.
+
+        Stops the SD feed and drops the moves still in the lookahead queue.
+        Moves the toolhead already committed still run, unless the MCU loss
+        trigger halted the steppers; then only the resync to the halted
+        position is waited for, so PAUSE sees it. Never waits for the motion
+        itself. Latencies are measured from the detection callback's eventtime."""
+        reactor = self.printer.get_reactor()
+        toolhead = self.printer.lookup_object('toolhead')
+        pause_resume = self.printer.lookup_object('pause_resume', None)
+        if pause_resume is not None:
+            pause_resume.send_pause_command()
+        feed_stopped = reactor.monotonic()
+        # The loss macros must not run the restore travel over the part
+        self._drop_deferred_restore()
+        halted = False
+        trigger = self.loss_trigger
+        if trigger is not None and trigger['state'] == 'pending':
+            self._disarm_loss_trigger()
+        elif trigger is not None and trigger['tool'] is tool and trigger['kind'] == 'loss':
+            # The MCU reports the halt within a few ms of the pin change
+            deadline = feed_stopped + LOSS_TRIGGER_REPORT_TIMEOUT
+            while self.loss_trigger is trigger and (trigger['state'] != 'armed'
+                                                    or reactor.monotonic() < deadline):
+                reactor.pause(reactor.monotonic() + 0.002)
+            halted = self.loss_trigger is not trigger
+        dropped = self._drop_lookahead()
+        if halted:
+            queued = 0.
+        else:
+            # The lookahead is empty, this commits nothing
+            queued = max(0., toolhead.get_last_move_time()
+                         - toolhead.mcu.estimated_print_time(reactor.monotonic()))
+        now = reactor.monotonic()
+        self.tool_loss_count += 1
+        if self.metrics is not None:
+            self.metrics.note_tool_loss()
+        self.last_tool_loss = {
+            'tool': tool.name,
+            'feed_stop_ms': round((feed_stopped - eventtime) * 1000.),
+            'motion_stop_ms': round((now + queued - eventtime) * 1000.),
+            'queued_motion_ms': round(queued * 1000.),
+            'dropped_moves': dropped,
+            'mcu_halted': halted,
+        }
+        logging.info("toolchanger: tool loss %s, latency %s" % (tool.name, self.last_tool_loss))
+        if halted:
+            self.gcode.respond_info(
+                "Tool loss %s: steppers halted by the MCU, SD feed stopped after %dms"
+                % (tool.name, self.last_tool_loss['feed_stop_ms']))
+        else:
+            self.gcode.respond_info(
+                "Tool loss %s: SD feed stopped after %dms, %d queued moves dropped,"
+                " motion stops after %dms (%dms of committed motion still runs)" % (
+                    tool.name, self.last_tool_loss['feed_stop_ms'], dropped,
+                    self.last_tool_loss['motion_stop_ms'],
+                    self.last_tool_loss['queued_motion_ms']))
+
+    # ==============================================================================
+    #                              Console Output
+    # ==============================================================================
+
+    def respond(self, msg, level=VERBOSITY_NORMAL, gcmd=None):
+        """Console output filtered by the verbosity option.
+
+        Routine per-change lines use the default level, details that are also
+        in the status use VERBOSITY_DEBUG. Errors keep using respond_info."""
+        if self.verbosity >= level:
+            (gcmd or self.gcode).respond_info(msg)
+
+    cmd_SET_TOOLCHANGER_VERBOSITY_help = "Set the toolchanger console verbosity"
+    def cmd_SET_TOOLCHANGER_VERBOSITY(self, gcmd):
+        level = gcmd.get('LEVEL', None)
+        if level is not None:
+            if level.lower() not in VERBOSITY_LEVELS:
+                raise gcmd.error("LEVEL must be one of %s" % (', '.join(VERBOSITY_LEVELS),))
+            self.verbosity = VERBOSITY_LEVELS[level.lower()]
+        name = next(k for k, v in VERBOSITY_LEVELS.items() if v == self.verbosity)
+        gcmd.respond_info("Toolchanger verbosity: %s" % (name,))
+
+    # ==============================================================================
+    #                               Event Log
+    # ==============================================================================
+
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, status):
+        self._status = status
+        self.log_event(tc_event_log.EV_STATUS, self.active_tool,
+                       tc_event_log.STATUS_NAMES.index(status))
+
+    def log_event(self, event, tool=None, a=0., b=0., eventtime=None):
+        """Records an event in the ring buffer, cheap enough for every call site."""
+        if self.event_log is None:
+            return
+        if eventtime is None:
+            eventtime = self.printer.get_reactor().monotonic()
+        self.event_log.record(eventtime, event, max(self.current_change_id, 0),
+                              tool.tool_number if tool is not None else -1, a, b)
+
+    def log_text(self, event, tool, text, b=0.):
+        if self.event_log is not None:
+            self.log_event(event, tool, self.event_log.intern(text), b)
+
+    cmd_TOOLCHANGER_DUMP_LOG_help = "Write the toolchanger event log to a file"
+    def cmd_TOOLCHANGER_DUMP_LOG(self, gcmd):
+        if self.event_log is None:
+            raise gcmd.error("Event log is disabled, set event_log_size")
+        path = gcmd.get('FILE', None)
+        if path is None:
+            log_file = self.printer.get_start_args().get('log_file')
+            log_dir = os.path.dirname(log_file) if log_file else '/tmp'
+            path = os.path.join(log_dir, 'toolchanger_events.bin')
+        path = os.path.expanduser(path)
+        try:
+            count = self.event_log.dump(path)
+        except (IOError, OSError) as e:
+            raise gcmd.error("Unable to write %s: %s" % (path, e))
+        gcmd.respond_info("Wrote %d toolchanger events to %s, decode with"
+                          " tc_event_log.py" % (count, path))
+
+    # ==============================================================================
+    #                             Change Journal
+    # ==============================================================================
+
+    def _journal(self, phase, sync=False, **fields):
+        if self.journal is not None and self.current_change_id != -1:
+            self.journal.append(self.current_change_id, phase, fields, sync)
+
+    def _journal_change_start(self, gcode_position, restore_axis, extra_z_offset):
+        """Records everything INITIALIZE_TOOLCHANGER RECOVER=1 needs after a restart."""
+        if self.journal is None:
+            return
+        sdcard = self.printer.lookup_object('virtual_sdcard', None)
+        print_file = None
+        file_position = None
+        if sdcard is not None and sdcard.file_path():
+            print_file = os.path.relpath(sdcard.file_path(), sdcard.sdcard_dirname)
+            # Resume after the T line, not on it. Outside of an SD command
+            # file_position already is the next line to read.
+            if sdcard.is_cmd_from_sd():
+                file_position = sdcard.next_file_position
+            else:
+                file_position = sdcard.file_position
+        pickup_tool = self.last_change_pickup_tool
+        self._journal('start',
+                      dropoff_tool=self.active_tool.name if self.active_tool else None,
+                      pickup_tool=pickup_tool.name if pickup_tool else None,
+                      gcode_position=list(gcode_position),
+                      restore_axis=restore_axis,
+                      extra_z_offset=extra_z_offset,
+                      gcode_state=self.gcode_move.saved_states.get('_toolchange_state'),
+                      print_file=print_file,
+                      file_position=file_position)
+
+    def _load_journal(self, records):
+        """Restores the state of a change that was interrupted by a restart."""
+        start = next((r for r in records if r.get('phase') == 'start'), None)
+        if start is None:
+            return
+        self.next_change_id = max(self.next_change_id, start['change'] + 1)
+        gcode_position = start['gcode_position']
+        restore_axis = start['restore_axis']
+        self.last_change_gcode_position = gcode_position
+        self.last_change_start_position = self._position_to_xyz(gcode_position, 'xyz')
+        self.last_change_restore_position = self._position_to_xyz(gcode_position, restore_axis)
+        self.last_change_restore_axis = restore_axis
+        self.last_change_extra_z_offset = start['extra_z_offset']
+        self.last_change_pickup_tool = None
+        if start.get('pickup_tool'):
+            self.last_change_pickup_tool = self.printer.lookup_object(start['pickup_tool'], None)
+        if start.get('gcode_state') and '_toolchange_state' not in self.gcode_move.saved_states:
+            self.gcode_move.saved_states['_toolchange_state'] = start['gcode_state']
+        self.journal_recovery = {
+            'change': start['change'],
+            'phase': records[-1].get('phase'),
+            'pickup_tool': start.get('pickup_tool'),
+            'print_file': start.get('print_file'),
+            'file_position': start.get('file_position'),
+        }
+        msg = ("Tool change %d to %s was interrupted in phase '%s', run"
+               " INITIALIZE_TOOLCHANGER RECOVER=1 after homing" % (
+                   start['change'], start.get('pickup_tool'), records[-1].get('phase')))
+        logging.info("toolchanger: %s" % (msg,))
+        self.gcode.respond_info(msg)
+
+    def _reload_print_file(self, journal_recovery):
+        """Positions the print file right after the interrupted change."""
+        print_file = journal_recovery.get('print_file')
+        sdcard = self.printer.lookup_object('virtual_sdcard', None)
+        if print_file is None or sdcard is None or sdcard.is_active():
+            self.gcode.respond_info("Recovery complete")
+            return
+        self.gcode.run_script_from_command("M23 %s" % (print_file,))
+        self.gcode.run_script_from_command("M26 S%d" % (journal_recovery['file_position'],))
+        self.gcode.respond_info(
+            "Recovery complete, %s is positioned after the tool change."
+            " Restore the temperatures, then run M24 to continue" % (print_file,))
+
+    # ==============================================================================
+    #                          MCU Tool Loss Trigger
+    # ==============================================================================
+
+    def _arm_loss_trigger(self, tool):
+        """Arms the tool's detection pin as a trsync trigger on all XYZ steppers.
+
+        While armed, the MCU halts the steppers itself when the pin reports the
+        tool gone, without waiting for the host. Only armed while a print runs,
+        and disarmed for changes, homing and probing moves, since a stepper can
+        only be in one trsync at a time.
+
+        A trsync also halts on a communication timeout. With the detection pin
+        on another MCU than the steppers (CAN toolhead board) every stall of the
+        link longer than the trsync timeout stops the print."""
+        if (tool is None or not tool.tool_loss_trigger or tool.detection_endstop is None
+                or self.loss_trigger is not None or tool.detect_state != DETECT_PRESENT
+                or not self._print_active()):
+            return
+        # Armed from the end of the queued moves once the lookahead gets there,
+        # asking the toolhead for that time now would flush the lookahead
+        trigger = {'tool': tool, 'completion': None, 'state': 'pending',
+                   'kind': 'loss', 'check': None}
+        self.loss_trigger = trigger
+        def lookahead_callback(print_time):
+            if self.loss_trigger is not trigger:
+                return  # Disarmed before the lookahead got there
+            if tool.detect_state != DETECT_PRESENT:
+                self.loss_trigger = None
+                return
+            self._start_trigger(tool, print_time, 'loss')
+        self.printer.lookup_object('toolhead').register_lookahead_callback(lookahead_callback)
+
+    def _start_trigger(self, tool, print_time, kind, check=None):
+        """Starts the trsync that halts the XYZ steppers once the tool's pin
+        reads absent from print_time on. kind 'loss' runs the tool loss
+        reaction, 'pickup' fails the speculative pickup check."""
+        completion = tool.detection_endstop.home_start(
+            print_time, LOSS_TRIGGER_SAMPLE_TIME,
+            LOSS_TRIGGER_SAMPLE_COUNT, LOSS_TRIGGER_REST_TIME, triggered=False)
+        trigger = {'tool': tool, 'completion': completion, 'state': 'armed',
+                   'kind': kind, 'check': check}
+        self.loss_trigger = trigger
+        self.printer.get_reactor().register_callback(
+            lambda e: self._watch_loss_trigger(trigger))
+
+    def _print_active(self):
+        # Same test as the tool loss detection in tool.py
+        virtual_sdcard = self.printer.lookup_object('virtual_sdcard', None)
+        pause_resume = self.printer.lookup_object('pause_resume', None)
+        return bool((virtual_sdcard and virtual_sdcard.is_active())
+                    or (pause_resume and pause_resume.is_paused))
+
+    def _watch_loss_trigger(self, trigger):
+        is_failure = trigger['completion'].wait()
+        if is_failure is None or trigger['state'] != 'armed':
+            return  # Disarmed
+        if trigger['kind'] == 'pickup':
+            # select_tool stops the trsync and runs the pickup failure path
+            trigger['state'] = 'triggered'
+            trigger['check']['ok'] = False
+            trigger['check']['done'] = True
+            if is_failure:
+                msg = "Pickup check on %s: steppers halted on communication timeout"
+            else:
+                msg = "Pickup check on %s: tool not detected, steppers halted by the MCU"
+            msg = msg % (trigger['tool'].name,)
+            logging.info("toolchanger: %s" % (msg,))
+            self.gcode.respond_info(msg)
+            return
+        self._halt_on_loss_trigger(trigger, is_failure)
+
+    def _disarm_loss_trigger(self):
+        trigger = self.loss_trigger
+        if trigger is not None and trigger['state'] == 'pending':
+            # No trsync started yet, nothing to wait for
+            trigger['state'] = 'cancelled'
+            self.loss_trigger = None
+            return
+        if trigger is None or trigger['state'] not in ('armed', 'triggered'):
+            return
+        # Stopping the trsync also stops the steppers, let queued motion finish
+        # first. Only paid while a trsync is running, i.e. a change during a
+        # print with tool_loss_trigger.
+        self._flush_rounded_path()
+        self.printer.lookup_object('toolhead').wait_moves()
+        if trigger['state'] in ('armed', 'triggered'):
+            self._stop_loss_trigger(trigger)
+
+    def _finish_pickup_trigger(self, tool, ok):
+        """Ends the speculative pickup trsync after stage 2; returns ok unless
+        the MCU halted the pickup."""
+        trigger = self.loss_trigger
+        if trigger is None or trigger['kind'] != 'pickup':
+            return ok
+        if (ok and trigger['state'] == 'armed' and tool.tool_loss_trigger
+                and self._print_active()):
+            # Keeps guarding the tool as the tool loss trigger
+            trigger['kind'] = 'loss'
+            return True
+        halted = trigger['state'] != 'armed'
+        self._disarm_loss_trigger()
+        return ok and not halted
+
+    def _halt_on_loss_trigger(self, trigger, is_failure):
+        """The MCU halted the steppers, drop the rest of the queue and resync."""
+        trigger['state'] = 'halting'
+        tool = trigger['tool']
+        pause_resume = self.printer.lookup_object('pause_resume', None)
+        if pause_resume is not None:
+            pause_resume.send_pause_command()
+        # The MCU discards the steps of a halted stepper until it is reset.
+        # Like at the end of a homing move, the rest of the queue is dropped or
+        # sent ahead of the reset instead of being waited for.
+        self._drop_lookahead()
+        error = self._stop_loss_trigger(trigger)
+        if is_failure or error:
+            msg = "Tool loss trigger on %s: steppers halted on communication timeout" % (tool.name,)
+        else:
+            msg = "Tool loss trigger on %s: steppers halted by the MCU" % (tool.name,)
+        logging.info("toolchanger: %s" % (msg,))
+        self.gcode.respond_info(msg)
+
+    def _stop_loss_trigger(self, trigger):
+        """Stops the trsync and moves the toolhead position to where the steppers halted."""
+        trigger['state'] = 'stopping'
+        toolhead = self.printer.lookup_object('toolhead')
+        # Every committed step goes out before the stepper reset
+        toolhead.flush_step_generation()
+        kin = toolhead.get_kinematics()
+        before = {s.get_name(): (s.get_commanded_position(), s.get_mcu_position())
+                  for s in kin.get_steppers()}
+        error = None
+        try:
+            trigger['tool'].detection_endstop.home_wait(toolhead.get_last_move_time())
+        except self.printer.command_error as e:
+            error = str(e)
+        if not trigger['completion'].test():
+            trigger['completion'].complete(None)
+        self.loss_trigger = None
+        # The trsync stop re-read the MCU step positions, same as after homing
+        toolhead.flush_step_generation()
+        kin_spos = {}
+        halted = False
+        for stepper in kin.get_steppers():
+            commanded, mcu_pos = before[stepper.get_name()]
+            steps = stepper.get_mcu_position() - mcu_pos
+            halted = halted or steps != 0
+            kin_spos[stepper.get_name()] = commanded + steps * stepper.get_step_dist()
+        if halted:
+            toolhead.set_position(list(kin.calc_position(kin_spos))[:3]
+                                  + toolhead.get_position()[3:])
+        return error
+
     # ==============================================================================
     #                          Graceful Error Handling & Safety
     # ==============================================================================
@@ -248,6 +833,116 @@ class Toolchanger:
             pass
         return False
 
+    # ==============================================================================
+    #                                Heat Barrier
+    # ==============================================================================
+
+    def _heater_at_target(self, heater, eventtime):
+        temp, target = heater.get_temp(eventtime)
+        return target > 0. and abs(temp - target) <= self.heat_barrier_tolerance
+
+    def _arm_heat_barrier(self, tool):
+        """Starts tracking the pickup tool's heater so heating overlaps the change motion."""
+        self._disarm_heat_barrier()
+        if not self.heat_barrier or tool is None or tool.extruder is None:
+            return
+        reactor = self.printer.get_reactor()
+        heater = tool.extruder.get_heater()
+        barrier = {'heater': heater, 'armed': reactor.monotonic(), 'reached': None}
+        def timer_handler(eventtime):
+            if self._heater_at_target(heater, eventtime):
+                barrier['reached'] = eventtime
+                return reactor.NEVER
+            return eventtime + 0.25
+        barrier['timer'] = reactor.register_timer(timer_handler, reactor.NOW)
+        self.heat_barrier_state = barrier
+
+    def _disarm_heat_barrier(self):
+        barrier = self.heat_barrier_state
+        self.heat_barrier_state = None
+        if barrier is not None:
+            self.printer.get_reactor().unregister_timer(barrier['timer'])
+        return barrier
+
+    def _enforce_heat_barrier(self):
+        """Blocks until the armed heater is at target and reports the hidden heating time."""
+        barrier = self._disarm_heat_barrier()
+        if barrier is None:
+            return
+        # Let the rest of the change path run while heating
+        self._flush_rounded_path()
+        reactor = self.printer.get_reactor()
+        heater = barrier['heater']
+        eventtime = reactor.monotonic()
+        if heater.get_temp(eventtime)[1] <= 0.:
+            return
+        if barrier['reached'] is not None:
+            hidden = barrier['reached'] - barrier['armed']
+            waited = 0.0
+        else:
+            hidden = eventtime - barrier['armed']
+            wait_start = eventtime
+            while not self.printer.is_shutdown():
+                if heater.get_temp(eventtime)[1] <= 0.:
+                    # Heater was turned off while waiting
+                    break
+                if self._heater_at_target(heater, eventtime):
+                    break
+                if (self.heat_barrier_timeout
+                        and eventtime - wait_start >= self.heat_barrier_timeout):
+                    self.gcode.respond_info(
+                        "Heat barrier: heater not at target after %.0fs, continuing"
+                        % (eventtime - wait_start,))
+                    break
+                eventtime = reactor.pause(eventtime + 0.25)
+            waited = eventtime - wait_start
+        self.heat_barrier_hidden += hidden
+        self.heat_barrier_waited += waited
+        if self.metrics is not None:
+            self.metrics.note_heat_barrier(hidden, waited)
+        self.respond("Heat barrier: %.1fs of heating overlapped with motion, %.1fs waited"
+                     % (hidden, waited), VERBOSITY_DEBUG)
+
+    cmd_WAIT_TOOL_HEAT_BARRIER_help = "Wait for the tool heated during this change to reach its target"
+    def cmd_WAIT_TOOL_HEAT_BARRIER(self, gcmd):
+        self._enforce_heat_barrier()
+
+    # ==============================================================================
+    #                              Change Envelope
+    # ==============================================================================
+
+    def _set_velocity_limits(self, limits):
+        """Sets SET_VELOCITY_LIMIT values that differ from the toolhead's;
+        returns the previous values of the ones that were changed.
+
+        Sets the toolhead attributes like SET_VELOCITY_LIMIT does, without its
+        console report."""
+        toolhead = self.printer.lookup_object('toolhead')
+        status = toolhead.get_status(self.printer.get_reactor().monotonic())
+        changed, previous = {}, {}
+        for key, value in limits.items():
+            current = status.get(VELOCITY_LIMIT_STATUS[key])
+            if current is None:
+                # Not supported by this Klipper version (minimum_cruise_ratio)
+                continue
+            if not _profile_value_matches(current, value):
+                changed[key] = value
+                previous[key] = current
+        if changed:
+            for key, value in changed.items():
+                setattr(toolhead, VELOCITY_LIMIT_ATTRIBUTE[key], float(value))
+            toolhead._calc_junction_deviation()
+        return previous
+
+    def _enter_change_envelope(self):
+        if self.change_envelope and self.change_envelope_saved is None:
+            self.change_envelope_saved = self._set_velocity_limits(self.change_envelope)
+
+    def _exit_change_envelope(self):
+        saved, self.change_envelope_saved = self.change_envelope_saved, None
+        if saved:
+            self._set_velocity_limits(saved)
+
     # ==============================================================================
     #                                Lifecycle Hooks
     # ==============================================================================
@@ -259,7 +954,7 @@ class Toolchanger:
             current_offset = globals_macro.variables.get('global_z_offset', 0.06)
             new_offset = current_offset + z_adjust
             globals_macro.variables['global_z_offset'] = new_offset
-            self.gcode.respond_info(
+            self.respond(
                 "Updated global Z-offset to: %.3f (adjusted by %.3f)" %
                 (new_offset, z_adjust))
 
@@ -270,19 +965,62 @@ class Toolchanger:
                         if tool.tool_number in self.initial_tool.z_offsets:
                             tool_rel_offset = self.initial_tool.z_offsets[tool.tool_number]
                             new_total_offset = tool_rel_offset + new_offset
-                            self.gcode.respond_info(
+                            self.respond(
                                 "Updated T%d offset to: %.3f" %
-                                (tool_num, new_total_offset))
+                                (tool_num, new_total_offset), VERBOSITY_DEBUG)
         except Exception as e:
             self.gcode.respond_info("Error updating global Z-offset: %s" % str(e))
 
     def _handle_home_rails_begin(self, homing_state, rails):
+        self.homing_rails = True
+        self._disarm_loss_trigger()
+        # Homing resets the position, a pending restore is stale
+        self.deferred_restore = None
+        self.paused_restore = None
         if self.initialize_on == INIT_ON_HOME and self.status == STATUS_UNINITALIZED:
             self.initialize(self.detected_tool)
 
+    def _handle_home_rails_end(self, homing_state, rails):
+        self.homing_rails = False
+        if self.status == STATUS_READY:
+            self._arm_loss_trigger(self.active_tool)
+
+    def _handle_homing_move_begin(self, hmove):
+        # Probing moves (PROBE, BED_MESH_CALIBRATE, TOOL_DETECT_MOVE, ...) add
+        # their own trsync signal to the same steppers
+        self._disarm_loss_trigger()
+
+    def _handle_homing_move_end(self, hmove):
+        if not self.homing_rails and self.status == STATUS_READY:
+            self._arm_loss_trigger(self.active_tool)
+
+    def _handle_idle_ready(self, print_time):
+        # The print finished or was cancelled
+        if self.loss_trigger is None or self._print_active():
+            return
+        with self.gcode.get_mutex():
+            if not self._print_active():
+                self._disarm_loss_trigger()
+
     def _handle_connect(self):
+        if self.lazy_restore:
+            # Wrap at connect, after all other modules registered their handlers
+            for cmd in LAZY_RESTORE_FLUSH_COMMANDS:
+                handler = self.gcode.register_command(cmd, None)
+                if handler is not None:
+                    self.gcode.register_command(cmd, self._wrap_flush(handler))
+            for cmd, wrap in (('PAUSE', self._wrap_pause),
+                              ('RESTORE_GCODE_STATE', self._wrap_restore_state)):
+                handler = self.gcode.register_command(cmd, None)
+                if handler is not None:
+                    self.gcode.register_command(cmd, wrap(handler))
         self.status = STATUS_UNINITALIZED
         self.active_tool = None
+        self.loss_trigger = None
+        if self.journal is not None:
+            self._load_journal(self.journal.load())
+        if self.metrics is not None:
+            self.metrics.start()
 
     def _handle_shutdown(self):
         self.status = STATUS_UNINITALIZED
@@ -295,6 +1033,12 @@ class Toolchanger:
 
         self.status = STATUS_ERROR
         self.error_message = message
+        self.log_text(tc_event_log.EV_ERROR, self.active_tool, message)
+        if self.metrics is not None:
+            self.metrics.note_failure(message)
+        self._journal('error', sync=True, message=message)
+        self._disarm_heat_barrier()
+        self.deferred_restore = None
         
         if not message.startswith("Script running error"):
             self.gcode.respond_info(f"⚠️ Toolchanger Error: {message}")
@@ -337,6 +1081,20 @@ class Toolchanger:
                 'available_extruders': available_extruders,
                 'last_change_restore_position': self.last_change_restore_position,
                 'last_change_start_position': self.last_change_start_position,
+                'last_detect_position': self.last_detect_position,
+                'heat_barrier': self.heat_barrier,
+                'heat_barrier_hidden': self.heat_barrier_hidden,
+                'heat_barrier_waited': self.heat_barrier_waited,
+                'deferred_restore_position': self.deferred_restore,
+                'coalesced_changes': self.change_coalescer.elided if self.change_coalescer else 0,
+                'last_tool_loss': self.last_tool_loss,
+                'tool_loss_count': self.tool_loss_count,
+                'tool_loss_trigger': (self.loss_trigger['tool'].name
+                                      if self.loss_trigger and self.loss_trigger['state'] != 'pending'
+                                      else None),
+                'journal_recovery': self.journal_recovery,
+                'verbosity': self.verbosity,
+                'last_applied_offsets': self.last_applied_offsets,
                 }
 
     def _update_toolhead_extruders(self):
@@ -350,9 +1108,9 @@ class Toolchanger:
                     available_extruders.append(tool.extruder_name)
             if available_extruders:
                 toolhead.all_extruders = available_extruders
-                self.gcode.respond_info(
+                self.respond(
                     "UI: Updated toolhead.all_extruders with %d extruders" %
-                    len(available_extruders))
+                    len(available_extruders), VERBOSITY_DEBUG)
         except Exception as e:
             self.gcode.respond_info("Warning: Could not update toolhead extruders: %s" % str(e))
 
@@ -363,10 +1121,15 @@ class Toolchanger:
     def assign_tool(self, tool, number, prev_number, replace=False):
         if number in self.tools and not replace:
             raise Exception('Duplicate tools with number %s' % (number,))
-        if prev_number in self.tools:
+        if self.tools.get(prev_number) is tool:
             del self.tools[prev_number]
             self.tool_numbers.remove(prev_number)
             self.tool_names.remove(tool.name)
+        if number in self.tools:
+            # Replaced tool stays unassigned until it gets a number of its own
+            index = self.tool_numbers.index(number)
+            del self.tool_numbers[index]
+            del self.tool_names[index]
         self.tools[number] = tool
         position = bisect.bisect_left(self.tool_numbers, number)
         self.tool_numbers.insert(position, number)
@@ -387,7 +1150,8 @@ class Toolchanger:
     cmd_INITIALIZE_TOOLCHANGER_help = "Initialize the toolchanger"
     def cmd_INITIALIZE_TOOLCHANGER(self, gcmd):
         tool = self._gcmd_tool(gcmd, self.detected_tool)
-        was_error  = self.status == STATUS_ERROR
+        # After a restart the journal stands in for the lost error state
+        was_error  = self.status == STATUS_ERROR or self.journal_recovery is not None
         self.initialize(tool)
         if was_error and gcmd.get_int("RECOVER", default=0) == 1:
             if not tool:
@@ -623,9 +1387,10 @@ class Toolchanger:
             if should_run_initialize:
                 if self.status == STATUS_INITIALIZING:
                     self.status = STATUS_READY
-                    self.gcode.respond_info('%s initialized, active %s' %
-                                            (self.name,
-                                             self.active_tool.name if self.active_tool else None))
+                    self._arm_loss_trigger(self.active_tool)
+                    self.respond('%s initialized, active %s' %
+                                 (self.name,
+                                  self.active_tool.name if self.active_tool else None))
                 else:
                     self.gcode.respond_info('%s failed to initialize, error: %s' %
                                             (self.name, self.error_message))
@@ -641,23 +1406,51 @@ class Toolchanger:
             self._pause_print()
             return
 
+        if self.change_coalescer is not None and tool is not None:
+            next_tool = self.change_coalescer.next_change()
+            if next_tool is not None:
+                self.respond('Coalesced change to %s, T%d follows without extrusion'
+                             % (tool.name, next_tool), gcmd=gcmd)
+                return
+
         if self.active_tool == tool:
-            gcmd.respond_info('Tool %s already selected' % (tool.name if tool else None))
+            self.respond('Tool %s already selected' % (tool.name if tool else None), gcmd=gcmd)
             return
 
         if not self.ensure_homed(gcmd):
             return
+        self._disarm_loss_trigger()
 
         this_change_id = self.next_change_id
         self.next_change_id += 1
         self.current_change_id = this_change_id
+        transition = (self.active_tool.tool_number if self.active_tool else None,
+                      tool.tool_number if tool else None)
+        change_start = self.printer.get_reactor().monotonic()
+        dropoff_tool = self.active_tool
+        self.log_event(tc_event_log.EV_CHANGE_START, tool,
+                       -1 if transition[0] is None else transition[0], eventtime=change_start)
 
         try:
             self.status = STATUS_CHANGING
+            self._arm_heat_barrier(tool)
+            self._enter_change_envelope()
 
             gcode_status = self.gcode_move.get_status()
-            gcode_position = gcode_status['gcode_position']
+            gcode_position = list(gcode_status['gcode_position'])
             current_z_offset = gcode_status['homing_origin'][2]
+            if self.deferred_restore is not None:
+                # Back-to-back change: the previous XY restore never happened
+                for axis, value in self.deferred_restore.items():
+                    gcode_position[XYZ_TO_INDEX[axis]] = value
+                self.deferred_restore = None
+
+            # Lazy restore: templates only restore Z, XY goes into the next move
+            template_restore_axis = restore_axis
+            deferred_axis = ''
+            if self.lazy_restore and tool is not None:
+                template_restore_axis = ''.join(a for a in restore_axis if a in 'zZ')
+                deferred_axis = ''.join(a for a in restore_axis if a in 'xyXY')
 
             # Calculate extra_z_offset (baby-stepping, Z-tuning, etc.)
             # We must account for BOTH tool offset AND global offset!
@@ -691,16 +1484,18 @@ class Toolchanger:
                 'dropoff_tool': self.active_tool.name if self.active_tool else None,
                 'pickup_tool': tool.name if tool else None,
                 'start_position': self._position_with_tool_offset(gcode_position, 'xyz', tool, extra_z_offset),
-                'restore_position': self._position_with_tool_offset(gcode_position, restore_axis, tool, extra_z_offset),
+                'restore_position': self._position_with_tool_offset(gcode_position, template_restore_axis, tool, extra_z_offset),
             }
 
             self.gcode.run_script_from_command("SAVE_GCODE_STATE NAME=_toolchange_state")
+            self._journal_change_start(gcode_position, restore_axis, extra_z_offset)
 
             before_change_gcode = self.active_tool.before_change_gcode if self.active_tool else self.default_before_change_gcode
             self.run_gcode('before_change_gcode', before_change_gcode, extra_context)
             self.gcode.run_script_from_command("SET_GCODE_OFFSET X=0.0 Y=0.0 Z=0.0")
 
             if self.active_tool:
+                self._journal('dropoff')
                 self.run_gcode('tool.dropoff_gcode',
                                self.active_tool.dropoff_gcode, extra_context)
 
@@ -708,12 +1503,14 @@ class Toolchanger:
 
             # --- PICKUP (STAGE-AWARE) ---
             if tool is not None:
+                self._journal('pickup')
                 # Check if tool has stage-based templates
                 has_stage1 = hasattr(tool, 'pickup_gcode_stage1') and tool.pickup_gcode_stage1 is not None
                 has_stage2 = hasattr(tool, 'pickup_gcode_stage2') and tool.pickup_gcode_stage2 is not None
 
                 if has_stage1:
                     # Stage 1: Move to detection point
+                    self.detect_move_tool = None
                     self.run_gcode('pickup_gcode_stage1', tool.pickup_gcode_stage1, extra_context)
                     if self.status == STATUS_ERROR:
                         self._pause_print()
@@ -721,40 +1518,25 @@ class Toolchanger:
                         return
 
                     # Verify tool detected
+                    detection_check = None
                     if self.has_detection and self.verify_tool_pickup:
-                        ok = self._wait_for_detection_state(tool, expect_present=True, retries=10, delay=0.1)
-                        if not ok:
-                            self._flush_motion_and_freeze_position()
-                            safe_y = self.params.get('params_safe_y', 105)
-
-                            # CRITICAL SAFETY: Save temperature BEFORE error_gcode runs!
-                            # This is part of the safety system - error_gcode might turn off heaters
-                            self._save_tool_temperature_for_resume(tool)
-
-                            self.gcode.respond_info("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-                            self.gcode.respond_info("📋 RECOVERY STEPS:")
-                            self.gcode.respond_info("1. Manually attach T%d to the shuttle" % tool.tool_number)
-                            self.gcode.respond_info("2. Run: G0 Y%d F6000" % safe_y)
-                            self.gcode.respond_info("3. Run: RESUME (will auto-heat and continue)")
-                            self.gcode.respond_info("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-                            self._process_error("Tool pickup verification failed (stage1)")
-                            self._pause_print()
-                            self.gcode.run_script_from_command("RESTORE_GCODE_STATE NAME=_toolchange_state MOVE=0")
-                            return
-
-                        # Double-check: correct tool?
-                        self.note_detect_change(tool)
-                        if self.detected_tool != tool:
-                            self._flush_motion_and_freeze_position()
-
-                            # CRITICAL SAFETY: Save temperature BEFORE error_gcode runs!
-                            self._save_tool_temperature_for_resume(tool)
-
-                            self._process_error(
-                                "Tool mismatch: expected %s, detected %s" % (tool.name, self.detected_tool.name if self.detected_tool else 'None')
-                            )
-                            self._pause_print()
-                            self.gcode.run_script_from_command("RESTORE_GCODE_STATE NAME=_toolchange_state MOVE=0")
+                        if self.detect_move_tool is False:
+                            # TOOL_DETECT_MOVE finished its move without a trigger
+                            ok = False
+                        elif self.detect_move_tool is tool:
+                            # TOOL_DETECT_MOVE already saw the tool trigger
+                            ok = True
+                        elif (self.speculative_pickup and has_stage2
+                              and self.detect_move_tool is None
+                              and tool.detection_endstop is not None):
+                            # Queue stage 2 right away, the check runs when stage 1
+                            # ends and the MCU halts stage 2 if the tool is missing
+                            detection_check = self._start_detection_check(
+                                tool, pickup_trigger=True)
+                            self.speculative_check = detection_check
+                        else:
+                            ok = self._wait_for_detection_state(tool, expect_present=True, retries=10, delay=0.1)
+                        if detection_check is None and not self._verify_pickup_detection(tool, ok):
                             return
 
                     # Stage 2: Complete pickup (only if stage1 succeeded)
@@ -764,6 +1546,14 @@ class Toolchanger:
                             self._pause_print()
                             self.gcode.run_script_from_command("RESTORE_GCODE_STATE NAME=_toolchange_state MOVE=0")
                             return
+
+                    # Speculative stage 2: printing must not resume before the check ran
+                    if detection_check is not None:
+                        ok = self._wait_detection_check(detection_check)
+                        self.speculative_check = None
+                        ok = self._finish_pickup_trigger(tool, ok)
+                        if not self._verify_pickup_detection(tool, ok):
+                            return
                 else:
                     # Legacy single-stage pickup
                     self.run_gcode('pickup_gcode', tool.pickup_gcode, extra_context)
@@ -774,7 +1564,11 @@ class Toolchanger:
                     if self.has_detection and self.verify_tool_pickup:
                         self.validate_detected_tool(tool, respond_info=gcmd.respond_info, raise_error=gcmd.error)
 
+            # Printing resumes after this point, the new tool must be at temperature
+            self._enforce_heat_barrier()
+
             # Restore state (this will restore old offsets - which were 0)
+            self._journal('restore')
             self.gcode.run_script_from_command("RESTORE_GCODE_STATE NAME=_toolchange_state MOVE=0")
 
             # NOW set the correct Z / XY offsets AFTER RESTORE_GCODE_STATE
@@ -790,18 +1584,38 @@ class Toolchanger:
                     return
 
             self.status = STATUS_READY
+            self._journal('done', sync=True)
+            change_duration = self.printer.get_reactor().monotonic() - change_start
+            self.log_event(tc_event_log.EV_CHANGE_END, tool, change_duration)
+            if self.metrics is not None:
+                self.metrics.note_change(dropoff_tool.name if dropoff_tool else None,
+                                         tool.name if tool else None, change_duration)
+            self.change_history[transition] = self.change_history.get(transition, 0) + 1
+            self._arm_loss_trigger(tool)
+            if deferred_axis:
+                self.deferred_restore = self._position_to_xyz(gcode_position, deferred_axis)
+                self.deferred_restore_z = gcode_position[2]
             if tool:
-                gcmd.respond_info(
-                    'Selected tool %s (%s)' % (str(tool.tool_number), tool.name))
+                self.respond(
+                    'Selected tool %s (%s)' % (str(tool.tool_number), tool.name), gcmd=gcmd)
             else:
-                gcmd.respond_info('Tool unselected')
+                self.respond('Tool unselected', gcmd=gcmd)
             self.current_change_id = -1
         except gcmd.error:
             if self.status == STATUS_ERROR:
                 pass
             else:
+                self._journal('aborted', sync=True)
                 self.current_change_id = -1
                 raise
+        finally:
+            self.speculative_check = None
+            if self.loss_trigger is not None and self.loss_trigger['kind'] == 'pickup':
+                self._disarm_loss_trigger()
+            # No-op after a successful change, drops the timer of an aborted one
+            self._disarm_heat_barrier()
+            # Moves queued from here on belong to the print again
+            self._exit_change_envelope()
 
     def _recover_position(self, gcmd, tool):
         """
@@ -815,6 +1629,8 @@ class Toolchanger:
 
         Called by: INITIALIZE_TOOLCHANGER RECOVER=1
         """
+        journal_recovery = self.journal_recovery
+        self.journal_recovery = None
         extra_context = {
             'pickup_tool': tool.name if tool else None,
             'start_position': self.last_change_start_position,
@@ -829,6 +1645,12 @@ class Toolchanger:
         self.gcode.run_script_from_command(
             "RESTORE_GCODE_STATE NAME=_toolchange_state MOVE=0")
         self._set_tool_gcode_offset(tool, self.last_change_extra_z_offset)
+        if journal_recovery is not None:
+            self.journal.append(journal_recovery['change'], 'recovered', {}, sync=True)
+            # Klipper restarted, there is no paused print to resume
+            self._reload_print_file(journal_recovery)
+            return
+        self._journal('recovered', sync=True)
 
         # CRITICAL: Properly resume after successful recovery!
         # We already restored position via _restore_axis(), so we must NOT call RESUME_BASE
@@ -861,6 +1683,7 @@ class Toolchanger:
         if not tool:
             self._report_nonfatal(gcmd, "Cannot test tool, no active tool")
             return
+        self._disarm_loss_trigger()
 
         self.status = STATUS_CHANGING
         gcode_position = self.gcode_move.get_status()['gcode_position']
@@ -889,6 +1712,7 @@ class Toolchanger:
         toolhead.wait_moves()
         self._restore_axis(gcode_position, restore_axis, None)
         self.status = STATUS_READY
+        self._arm_loss_trigger(tool)
         gcmd.respond_info('Tool testing done')
 
     # ==============================================================================
@@ -951,6 +1775,7 @@ class Toolchanger:
         toolhead = self.printer.lookup_object('toolhead')
         reactor = self.printer.get_reactor()
         
+        self._flush_rounded_path()
         if gcmd.get_int("ASYNC", 0) == 1:
             if self.error_gcode is None:
                 raise gcmd.error("VERIFY_TOOL_DETECTED ASYNC=1 needs error_gcode to be defined")
@@ -966,6 +1791,134 @@ class Toolchanger:
             reactor.pause(reactor.monotonic() + 0.2)
             self.validate_detected_tool(expected, respond_info=gcmd.respond_info, raise_error=gcmd.error)
 
+    cmd_TOOL_DETECT_MOVE_help = "Move towards a position, stopping as soon as the tool is detected"
+    def cmd_TOOL_DETECT_MOVE(self, gcmd):
+        """Probing-style approach on the detection pin (needs detection_approach)."""
+        tool = self._gcmd_tool(gcmd, self.active_tool)
+        if not tool:
+            return
+        if tool.detection_endstop is None:
+            raise gcmd.error("TOOL_DETECT_MOVE: %s has no detection endstop, "
+                             "set detection_approach: True" % (tool.name,))
+
+        toolhead = self.printer.lookup_object('toolhead')
+        self._flush_rounded_path()
+        gcode_status = self.gcode_move.get_status()
+        # Same conversion as G1: base_position holds the G92 and G-code offsets
+        base_position = self.gcode_move.base_position
+        # Keep whatever transform (bed mesh) is active at the current point,
+        # the approach is short enough for it to stay constant.
+        start = toolhead.get_position()
+        last_position = gcode_status['position']
+        transform = [start[i] - last_position[i] for i in range(3)]
+        target = list(start)
+        for i, axis in enumerate(INDEX_TO_XYZ):
+            value = gcmd.get_float(axis, None)
+            if value is None:
+                continue
+            if self.gcode_move.absolute_coord:
+                target[i] = value + base_position[i] + transform[i]
+            else:
+                target[i] = value + last_position[i] + transform[i]
+        speed = gcmd.get_float('F', gcode_status['speed'], above=0.) / 60.
+
+        if tool.detect_state == DETECT_PRESENT:
+            # Already engaged, nothing to trigger on - finish the move normally.
+            toolhead.move(target, speed)
+            epos = start
+        else:
+            phoming = self.printer.lookup_object('homing')
+            try:
+                epos = phoming.probing_move(tool.detection_endstop, target, speed)
+            except self.printer.command_error as e:
+                if self.status != STATUS_CHANGING:
+                    raise gcmd.error("TOOL_DETECT_MOVE: %s" % (str(e),))
+                self.detect_move_tool = False
+                self.gcode.respond_info("TOOL_DETECT_MOVE: %s not detected: %s" % (tool.name, str(e)))
+                return
+
+        self.detect_move_tool = tool
+        self.last_detect_position = {
+            INDEX_TO_XYZ[i]: epos[i] - base_position[i] - transform[i] for i in range(3)}
+        self.respond("%s detected at X=%.3f Y=%.3f Z=%.3f" % (
+            tool.name, self.last_detect_position['X'],
+            self.last_detect_position['Y'], self.last_detect_position['Z']),
+            VERBOSITY_DEBUG, gcmd)
+
+    cmd_TOOL_ASSIGN_OPTIMIZE_help = "Suggest the ASSIGN_TOOL mapping with the least dock travel"
+    def cmd_TOOL_ASSIGN_OPTIMIZE(self, gcmd):
+        """Uses the changes of FILE, or the changes made since startup."""
+        filename = gcmd.get('FILE', None)
+        if filename is not None:
+            sdcard = self.printer.lookup_object('virtual_sdcard', None)
+            path = os.path.expanduser(filename)
+            if sdcard is not None and not os.path.isabs(path):
+                path = os.path.join(sdcard.sdcard_dirname, path)
+            if not os.path.isfile(path):
+                raise gcmd.error("TOOL_ASSIGN_OPTIMIZE: file '%s' not found" % (filename,))
+            transitions = self._background_exec(tc_gcode_analyzer.scan_transitions, (path,))
+            source = filename
+        else:
+            transitions = self.change_history
+            source = "%d changes since startup" % (sum(transitions.values()),)
+        if not transitions:
+            raise gcmd.error("TOOL_ASSIGN_OPTIMIZE: no tool changes in %s" % (source,))
+
+        # Raw config with the live tool parameters on top
+        configfile = self.printer.lookup_object('configfile')
+        sections = {name: dict(options) for name, options in
+                    configfile.get_status(None)['config'].items()}
+        for tool in self.tools.values():
+            sections.setdefault(tool.name, {}).update(tool.params)
+            sections[tool.name]['tool_number'] = tool.tool_number
+        try:
+            model = tc_gcode_analyzer.ChangeModel.from_sections(sections)
+        except (ValueError, TypeError, KeyError) as e:
+            raise gcmd.error("TOOL_ASSIGN_OPTIMIZE: %s" % (str(e),))
+        current = {number: tool.name for number, tool in self.tools.items()
+                   if tool.name in model.docks}
+        best, cost, current_cost = tc_gcode_analyzer.optimize_assignment(
+            model, transitions, current)
+        commands = tc_gcode_analyzer.assignment_commands(current, best)
+        if not commands:
+            gcmd.respond_info("Dock assignment for %s: current assignment is optimal"
+                              " (estimated %.0fs of changes)" % (source, current_cost))
+            return
+        gcmd.respond_info(
+            "Dock assignment for %s: estimated %.0fs -> %.0fs of changes, saving %.0fs (%.0f%%)\n%s"
+            % (source, current_cost, cost, current_cost - cost,
+               100. * (current_cost - cost) / current_cost, '\n'.join(commands)))
+
+    def _background_exec(self, method, args):
+        """Runs method in a separate process while the reactor keeps running."""
+        import queuelogger
+        parent_conn, child_conn = multiprocessing.Pipe()
+        def wrapper():
+            queuelogger.clear_bg_logging()
+            try:
+                res = method(*args)
+            except:
+                child_conn.send((True, traceback.format_exc()))
+                child_conn.close()
+                return
+            child_conn.send((False, res))
+            child_conn.close()
+        proc = multiprocessing.Process(target=wrapper)
+        proc.daemon = True
+        proc.start()
+        reactor = self.printer.get_reactor()
+        eventtime = reactor.monotonic()
+        while proc.is_alive() and not parent_conn.poll():
+            eventtime = reactor.pause(eventtime + .1)
+        if not parent_conn.poll():
+            raise self.printer.command_error("Background task exited without a result")
+        is_err, res = parent_conn.recv()
+        proc.join()
+        parent_conn.close()
+        if is_err:
+            raise self.printer.command_error("Error in background task: %s" % (res,))
+        return res
+
     # ==============================================================================
     #                          Kinematics & Offsets
     # ==============================================================================
@@ -976,6 +1929,66 @@ class Toolchanger:
         self.active_tool = tool
         if self.active_tool:
             self.active_tool.activate()
+            self._apply_motion_profile(self.active_tool)
+
+    def _silent_gcmd(self, command, params):
+        """A command object for calling another module's handler directly,
+        with the handler's console responses discarded."""
+        gcmd = self.gcode.create_gcode_command(
+            command, command, {key: str(value) for key, value in params.items()})
+        gcmd.respond_info = lambda msg, log=True: None
+        gcmd.respond_raw = lambda msg: None
+        return gcmd
+
+    def _apply_motion_profile(self, tool):
+        """Applies the tool's motion profile, touching only values that differ."""
+        profile = tool.motion_profile
+        if not profile:
+            return
+        eventtime = self.printer.get_reactor().monotonic()
+
+        shaper = profile.get('input_shaper')
+        input_shaper = self.printer.lookup_object('input_shaper', None)
+        if shaper and input_shaper is not None:
+            # Older input_shaper modules have no status, then all values are set
+            get_status = getattr(input_shaper, 'get_status', None)
+            status = get_status(eventtime) if get_status is not None else {}
+            changed = {key: value for key, value in shaper.items()
+                       if not _profile_value_matches(status.get(key.lower()), value)}
+            if changed:
+                try:
+                    input_shaper.cmd_SET_INPUT_SHAPER(
+                        self._silent_gcmd("SET_INPUT_SHAPER", changed))
+                except Exception as e:
+                    # A profile the shaper rejects must not break the change
+                    logging.exception("toolchanger: input shaper of %s not applied" % (tool.name,))
+                    self.gcode.respond_info("Input shaper of %s not applied: %s" % (tool.name, str(e)))
+
+        stepper_owner = tool.extruder_stepper or tool.extruder
+        extruder_stepper = getattr(stepper_owner, 'extruder_stepper', None)
+        if extruder_stepper is not None:
+            status = stepper_owner.get_status(eventtime)
+            changed = {}
+            for option, key, status_key in (
+                    ('pressure_advance', 'ADVANCE', 'pressure_advance'),
+                    ('pressure_advance_smooth_time', 'SMOOTH_TIME', 'smooth_time')):
+                value = profile.get(option)
+                if value is not None and not _profile_value_matches(status.get(status_key), value):
+                    changed[key] = value
+            if changed:
+                extruder_stepper.cmd_SET_PRESSURE_ADVANCE(
+                    self._silent_gcmd("SET_PRESSURE_ADVANCE", changed))
+
+        limits = {key: profile[option] for option, key in
+                  (('max_accel', 'ACCEL'), ('square_corner_velocity', 'SQUARE_CORNER_VELOCITY'))
+                  if option in profile}
+        if limits and self.change_envelope_saved is not None:
+            # Inside the change envelope these become the limits restored afterwards
+            self.change_envelope_saved.update(limits)
+            limits = {key: value for key, value in limits.items()
+                      if key not in self.change_envelope}
+        if limits:
+            self._set_velocity_limits(limits)
 
     def _set_tool_gcode_offset(self, tool, extra_z_offset):
         if tool is None:
@@ -984,42 +1997,59 @@ class Toolchanger:
         try:
             globals_macro = self.printer.lookup_object('gcode_macro globals')
             global_offset = globals_macro.variables.get('global_z_offset', 0.06)
+            offsets = self.last_applied_offsets = {
+                'tool': tool.name, 'z_offset': 0.0, 'global_z_offset': global_offset,
+                'extra_z_offset': extra_z_offset, 'total_z_offset': 0.0,
+                'x_offset': 0.0, 'y_offset': 0.0}
 
             # --- Z-Offset Logic ---
             # During calibration mode, do NOT apply Z-offsets (they are being measured)
             if self.calibration_mode:
                 self.gcode.run_script_from_command('SET_GCODE_OFFSET Z=0 ABSOLUTE=1')
-                self.gcode.respond_info("⚙️ Calibration mode: Z-offset set to 0 for T%d" % tool.tool_number)
+                self.log_event(tc_event_log.EV_OFFSET_Z, tool, 0., extra_z_offset)
+                self.respond("⚙️ Calibration mode: Z-offset set to 0 for T%d" % tool.tool_number)
             elif tool == self.initial_tool:
                 # Initial tool: only global offset
                 total_offset = global_offset + extra_z_offset
-                self.gcode.respond_info("Restored initial tool (T%d) with global offset: %.3f" %
-                                        (tool.tool_number, total_offset))
+                offsets['total_z_offset'] = total_offset
+                self.respond("Restored initial tool (T%d) with global offset: %.3f" %
+                             (tool.tool_number, total_offset), VERBOSITY_DEBUG)
                 self.gcode.run_script_from_command('SET_GCODE_OFFSET Z=%.3f ABSOLUTE=1' % (total_offset,))
+                self.log_event(tc_event_log.EV_OFFSET_Z, tool, total_offset, extra_z_offset)
             else:
                 # Other tools: tool offset + global offset
                 z_offset = self.initial_tool.z_offsets.get(tool.tool_number, 0.0) if self.initial_tool else 0.0
                 total_offset = z_offset + global_offset + extra_z_offset
-                self.gcode.respond_info("Setting Z-offset for T%d: tool=%.3f, global=%.3f, extra=%.3f, total=%.3f" %
-                                        (tool.tool_number, z_offset, global_offset, extra_z_offset, total_offset))
+                offsets['z_offset'] = z_offset
+                offsets['total_z_offset'] = total_offset
+                self.respond("Setting Z-offset for T%d: tool=%.3f, global=%.3f, extra=%.3f, total=%.3f" %
+                             (tool.tool_number, z_offset, global_offset, extra_z_offset, total_offset),
+                             VERBOSITY_DEBUG)
                 self.gcode.run_script_from_command('SET_GCODE_OFFSET Z=%.3f ABSOLUTE=1' % (total_offset,))
+                self.log_event(tc_event_log.EV_OFFSET_Z, tool, total_offset, extra_z_offset)
 
             # --- XY-Offset Logic ---
             if tool == self.initial_tool:
                 # Initial tool: XY offset = 0
                 self.gcode.run_script_from_command("SET_GCODE_OFFSET X=0 Y=0 ABSOLUTE=1")
-                self.gcode.respond_info("Initial tool T%d: setting reference XY-offset to 0" % tool.tool_number)
+                self.log_event(tc_event_log.EV_OFFSET_XY, tool, 0., 0.)
+                self.respond("Initial tool T%d: setting reference XY-offset to 0" % tool.tool_number,
+                             VERBOSITY_DEBUG)
             elif (self.initial_tool and hasattr(self.initial_tool, 'xy_offsets') and
                   tool.tool_number in self.initial_tool.xy_offsets):
                 # Other tools: use calibrated XY offsets relative to initial tool
                 x_offset, y_offset = self.initial_tool.xy_offsets[tool.tool_number]
                 self.gcode.run_script_from_command(
                     "SET_GCODE_OFFSET X=%.6f Y=%.6f ABSOLUTE=1" % (x_offset, y_offset))
-                self.gcode.respond_info(
-                    "Setting XY-offset for T%d: X=%.6f, Y=%.6f" % (tool.tool_number, x_offset, y_offset))
+                self.log_event(tc_event_log.EV_OFFSET_XY, tool, x_offset, y_offset)
+                offsets['x_offset'] = x_offset
+                offsets['y_offset'] = y_offset
+                self.respond("Setting XY-offset for T%d: X=%.6f, Y=%.6f"
+                             % (tool.tool_number, x_offset, y_offset), VERBOSITY_DEBUG)
             else:
                 # No XY offsets available
                 self.gcode.run_script_from_command("SET_GCODE_OFFSET X=0 Y=0 ABSOLUTE=1")
+                self.log_event(tc_event_log.EV_OFFSET_XY, tool, 0., 0.)
 
         except Exception as e:
             self.gcode.respond_info("Error setting offset: %s" % str(e))
@@ -1058,9 +2088,113 @@ class Toolchanger:
         pos = self._position_with_tool_offset(position, axis, tool)
         self.gcode_move.cmd_G1(self.gcode.create_gcode_command("G0", "G0", pos))
 
+    def _wrap_move(self, move_handler):
+        def cmd_move(gcmd):
+            if self._speculative_check_failed():
+                raise gcmd.error("Tool not detected after pickup, stage 2 stopped")
+            if self.deferred_restore is None:
+                move_handler(gcmd)
+                return
+            self._lazy_restore_move(gcmd, move_handler)
+        return cmd_move
+
+    def _wrap_flush(self, handler):
+        def cmd_flush(gcmd):
+            self._flush_deferred_restore()
+            handler(gcmd)
+        return cmd_flush
+
+    def _wrap_pause(self, handler):
+        def cmd_pause(gcmd):
+            # Pausing (and parking) must not travel back over the part first
+            self._drop_deferred_restore()
+            handler(gcmd)
+            self._resume_at_paused_restore()
+        return cmd_pause
+
+    def _wrap_restore_state(self, handler):
+        def cmd_restore_state(gcmd):
+            if gcmd.get_int('MOVE', 0):
+                # The state's own move replaces the pending restore
+                self.deferred_restore = None
+            handler(gcmd)
+        return cmd_restore_state
+
+    def _drop_deferred_restore(self):
+        """Drops a pending XY restore without moving, for PAUSE and tool loss."""
+        if self.deferred_restore is not None:
+            self.paused_restore = (self.deferred_restore, self.deferred_restore_z)
+            self.deferred_restore = None
+
+    def _resume_at_paused_restore(self):
+        """Points the position PAUSE saved at the dropped restore target, so
+        RESUME goes back to the print instead of to where the change ended."""
+        paused, self.paused_restore = self.paused_restore, None
+        state = self.gcode_move.saved_states.get('PAUSE_state')
+        if paused is None or state is None:
+            return
+        restore, restore_z = paused
+        base_position = state['base_position']
+        last_position = state['last_position']
+        for axis, value in restore.items():
+            index = XYZ_TO_INDEX[axis]
+            last_position[index] = value + base_position[index]
+        last_position[2] = max(last_position[2], restore_z + base_position[2])
+
+    def _restore_travel(self, pos):
+        """G0 to pos at lazy_restore_speed, keeping the modal feedrate of the print."""
+        speed = self.gcode_move.speed
+        try:
+            self.gcode_move.cmd_G1(self.gcode.create_gcode_command(
+                "G0", "G0", dict(pos, F=self.lazy_restore_speed * 60.)))
+        finally:
+            self.gcode_move.speed = speed
+
+    def _restore_deferred_z(self):
+        """Raises Z back to the change start height and returns the current Z."""
+        current_z = self.gcode_move.get_status()['gcode_position'][2]
+        if current_z < self.deferred_restore_z:
+            self._restore_travel({'Z': self.deferred_restore_z})
+            current_z = self.deferred_restore_z
+        return current_z
+
+    def _flush_deferred_restore(self):
+        """Completes a pending XY restore, e.g. before an arc or a position query."""
+        restore = self.deferred_restore
+        if restore is None:
+            return
+        self.deferred_restore = None
+        self._restore_deferred_z()
+        self._restore_travel(restore)
+
+    def _lazy_restore_move(self, gcmd, move_handler):
+        """Runs the first move after a change, merged with the deferred XY restore.
+
+        Z is restored first whenever the nozzle is still below the print height,
+        then the XY travel goes straight to the target of a travel move. A move
+        that also descends travels at the current height first and then goes down.
+        Extruding and relative moves must start at the restored position and
+        get the full restore first.
+        """
+        params = gcmd.get_command_parameters()
+        if 'E' in params or not self.gcode_move.get_status()['absolute_coordinates']:
+            self._flush_deferred_restore()
+            move_handler(gcmd)
+            return
+        restore = self.deferred_restore
+        self.deferred_restore = None
+        current_z = self._restore_deferred_z()
+        merged = {**restore, **params}
+        target_z = gcmd.get_float('Z', None)
+        if target_z is not None and target_z < current_z:
+            self._restore_travel({a: merged[a] for a in 'XY' if a in merged})
+        move_handler(self.gcode.create_gcode_command(
+            gcmd.get_command(), gcmd.get_commandline(), merged))
+
     def run_gcode(self, name, template, extra_context):
         """Run a GCode template; never raise fatal errors."""
         curtime = self.printer.get_reactor().monotonic()
+        self.log_text(tc_event_log.EV_TEMPLATE_START, self.active_tool, name)
         try:
             context = {
                 **template.create_template_context(),
@@ -1070,9 +2204,16 @@ class Toolchanger:
             }
             template.run_gcode_from_command(context)
         except Exception as e:
+            if self._speculative_check_failed():
+                # Stage 2 stopped by the failed pickup check, select_tool
+                # runs the pickup failure path
+                return
             self._process_error(f"Script running error in {name}: {e}")
             self._pause_print()
             return
+        finally:
+            self.log_text(tc_event_log.EV_TEMPLATE_END, self.active_tool, name,
+                          self.printer.get_reactor().monotonic() - curtime)
 
     # ==============================================================================
     #                                 Parameters
@@ -1138,7 +2279,7 @@ class Toolchanger:
             return False
 
         axis_str = " ".join(axis_to_home).upper()
-        gcmd.respond_info('Homing %s before toolchange' % (axis_str,))
+        self.respond('Homing %s before toolchange' % (axis_str,), gcmd=gcmd)
         self.gcode.run_script_from_command("G28 %s" % (axis_str,))
 
         toolhead.wait_moves()
@@ -1238,10 +2379,205 @@ class FanSwitcher:
         else:
             self.pending_speed = speed
 
+# ==============================================================================
+#                               Change Coalescer
+# ==============================================================================
+
+# Commands that can sit between two tool changes without needing the tool.
+# Anything else stops the look-ahead, since a macro might extrude. G10/G11
+# (firmware retraction) are not safe, an unretract extrudes.
+COALESCE_SAFE_COMMANDS = {
+    'G0', 'G1', 'G2', 'G3', 'G4', 'G90', 'G91', 'G92',
+    'M73', 'M82', 'M83', 'M104', 'M106', 'M107', 'M117', 'M204', 'M220', 'M221',
+    'SET_VELOCITY_LIMIT', 'SET_PRESSURE_ADVANCE', 'SET_PRINT_STATS_INFO',
+    'EXCLUDE_OBJECT_DEFINE', 'EXCLUDE_OBJECT_START', 'EXCLUDE_OBJECT_END',
+}
+TOOL_CHANGE_RE = re.compile(r'^T(\d+)$')
+E_WORD_RE = re.compile(r'E\s*([-+]?[0-9.]+)')
+NAME_WORD_RE = re.compile(r'NAME=(\S+)')
+
+class ChangeCoalescer:
+    """Looks ahead in the virtual_sdcard file for back-to-back tool changes.
+
+    A change is skipped when the print file selects another tool before the
+    next extruding move, so only the final tool of such a chain is picked up.
+    """
+    def __init__(self, toolchanger, config):
+        self.toolchanger = toolchanger
+        self.printer = config.get_printer()
+        self.lookahead_lines = config.getint('coalesce_lookahead', 500, minval=1)
+        self.elided = 0
+
+    def next_change(self):
+        """Returns the tool number of a change that follows the current SD
+        change without extrusion in between, or None."""
+        sdcard = self.printer.lookup_object('virtual_sdcard', None)
+        if sdcard is None or not sdcard.is_cmd_from_sd():
+            return None
+        path = sdcard.file_path()
+        if not path:
+            return None
+        try:
+            # Separate handle, virtual_sdcard keeps reading from its own
+            with open(path, 'rb') as f:
+                # Only a T<n> line of the file itself, not a T issued by a
+                # macro the file called (PRINT_START, T wrappers, ...)
+                f.seek(sdcard.file_position)
+                if not TOOL_CHANGE_RE.match(self._read_line(f)):
+                    return None
+                f.seek(sdcard.next_file_position)
+                next_tool = self._scan(f)
+        except (IOError, OSError):
+            return None
+        if next_tool is not None:
+            self.elided += 1
+            logging.info("toolchanger: coalesced tool change at offset %d, T%d follows"
+                         " without extrusion" % (sdcard.next_file_position, next_tool))
+        return next_tool
+
+    def _read_line(self, f, raw=None):
+        if raw is None:
+            raw = f.readline()
+        return raw.decode('utf-8', 'ignore').split(';', 1)[0].strip().upper()
+
+    def _scan(self, f):
+        gcode_status = self.toolchanger.gcode_move.get_status()
+        absolute_extrude = gcode_status['absolute_extrude']
+        last_e = gcode_status['gcode_position'][3]
+        exclude_object = self.printer.lookup_object('exclude_object', None)
+        excluded = []
+        if exclude_object is not None:
+            excluded = [name.upper() for name in exclude_object.get_status()['excluded_objects']]
+        in_excluded = False
+        for _ in range(self.lookahead_lines):
+            raw = f.readline()
+            if not raw:
+                return None
+            line = self._read_line(f, raw)
+            if not line:
+                continue
+            match = TOOL_CHANGE_RE.match(line)
+            if match:
+                return int(match.group(1))
+            cmd = line.split(None, 1)[0]
+            if cmd not in COALESCE_SAFE_COMMANDS:
+                return None
+            if cmd == 'EXCLUDE_OBJECT_START':
+                name = NAME_WORD_RE.search(line)
+                in_excluded = name is not None and name.group(1) in excluded
+                continue
+            if cmd == 'EXCLUDE_OBJECT_END':
+                in_excluded = False
+                continue
+            if cmd == 'M82':
+                absolute_extrude = True
+                continue
+            if cmd == 'M83':
+                absolute_extrude = False
+                continue
+            if cmd not in ('G0', 'G1', 'G2', 'G3', 'G92'):
+                continue
+            e_word = E_WORD_RE.search(line)
+            if e_word is None:
+                continue
+            try:
+                e = float(e_word.group(1))
+            except ValueError:
+                return None
+            if cmd == 'G92':
+                last_e = e
+                continue
+            if in_excluded:
+                continue
+            extruding = e > last_e if absolute_extrude else e > 0.
+            if absolute_extrude:
+                last_e = e
+            if extruding:
+                return None
+        return None
+
+# ==============================================================================
+#                               Change Journal
+# ==============================================================================
+
+# 'aborted' is a command error raised to the caller with Klipper still
+# running, there is nothing left to recover after a restart
+JOURNAL_FINAL_PHASES = ('done', 'aborted', 'recovered')
+
+class ChangeJournal:
+    """Append-only JSON lines journal of tool change phases.
+
+    Each record is written with a single os.write as the phase starts, so it
+    survives a Klipper restart. fsync runs once per change, when it ends.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def load(self):
+        """Returns the records of the last change if it did not finish, and
+        compacts the file down to them."""
+        records = []
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue  # Torn write from a power loss
+        except (IOError, OSError):
+            pass
+        last = []
+        if records and records[-1].get('phase') not in JOURNAL_FINAL_PHASES:
+            last = [r for r in records if r.get('change') == records[-1].get('change')]
+        self._rewrite(last)
+        return last
+
+    def append(self, change_id, phase, fields, sync=False):
+        record = dict(fields, change=change_id, phase=phase, time=round(time.time(), 3))
+        try:
+            if self.fd is None:
+                self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            os.write(self.fd, (json.dumps(record, separators=(',', ':')) + '\n').encode())
+            if sync:
+                os.fsync(self.fd)
+        except (IOError, OSError, TypeError, ValueError):
+            logging.exception("toolchanger: journal write to %s failed" % (self.path,))
+
+    def _rewrite(self, records):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                for record in records:
+                    f.write(json.dumps(record, separators=(',', ':')) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except (IOError, OSError):
+            logging.exception("toolchanger: journal compaction of %s failed" % (self.path,))
+
 # ==============================================================================
 #                                 Module Hooks
 # ==============================================================================
 
+def _profile_value_matches(current, value):
+    """Compares a status value (possibly a formatted string) to a profile value."""
+    if current is None:
+        return False
+    if isinstance(value, str):
+        return str(current).lower() == value
+    try:
+        if isinstance(current, str):
+            # Status reports some values pre-formatted, compare at that precision
+            decimals = len(current.partition('.')[2])
+            return float(current) == float('%.*f' % (decimals, value))
+        return abs(float(current) - value) < 1e-9
+    except (TypeError, ValueError):
+        return False
+
 def get_params_dict(config):
     result = {}
     for option in config.get_prefix_options('params_'):
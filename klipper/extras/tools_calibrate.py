@@ -20,6 +20,7 @@
 # This file may be distributed under the terms of the GNU GPLv3 license.
 
 import logging
+from . import toolchanger
 
 # ==============================================================================
 #                         Constants & Helpers
@@ -380,8 +381,12 @@ class PrinterProbeMultiAxis:
                 reason += HINT_TIMEOUT
             raise self.printer.command_error(reason)
         # self.gcode.respond_info("probe at %.3f,%.3f is z=%.6f"
-        self.gcode.respond_info("Probe made contact at %.6f,%.6f,%.6f"
-                                % (epos[0], epos[1], epos[2]))
+        msg = "Probe made contact at %.6f,%.6f,%.6f" % (epos[0], epos[1], epos[2])
+        tc = self.printer.lookup_object('toolchanger', None)
+        if tc is not None:
+            tc.respond(msg, toolchanger.VERBOSITY_DEBUG)
+        else:
+            self.gcode.respond_info(msg)
         return epos[:3]
 
     def _get_target_position(self, axis, sense, max_distance):
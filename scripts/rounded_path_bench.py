@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# Micro-benchmarks for rounded_path
+#
+# Runs the rounded_path planner outside of Klipper on synthetic dock
+# approach paths and reports generated segments per second for each way of
+# submitting them, with the pure Python and (when installed) NumPy geometry.
+# The numbers cover planning and the submission code of rounded_path only:
+# segments go to a stand-in for gcode_move, not through Klipper's
+# GCodeCommand, gcode_move.cmd_G1 or the toolhead, whose per-segment cost
+# comes on top on a printer.
+# --suite runs a fixed set of cases, --crossover times one flush with both
+# geometry engines to find where NumPy starts to pay off (NUMPY_MIN_POINTS).
+# The geometry invariants are checked on random polylines by
+# tests/test_rounded_path_fuzz.py.
+#
+# Usage:
+#   rounded_path_bench.py
+#   rounded_path_bench.py --corners 2000 --d 1000 --resolution 1
+#   rounded_path_bench.py --chord-error 0.01 --min-segment-time 0.002
+#   rounded_path_bench.py --engine numpy
+#   rounded_path_bench.py --d 5 --rounded-path
+#   rounded_path_bench.py --corners 10000 --plan-only
+#   rounded_path_bench.py --suite --engine python
+#   rounded_path_bench.py --crossover
+#
+# Copyright (C) 2025 PrintStructor
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import argparse, os, random, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'klipper', 'extras'))
+import rounded_path
+
+
+class MoveSink:
+    """Stands in for gcode_move/toolhead: keeps the G-code state that the
+    submission code reads and counts the queued moves. The G0 parameters
+    arrive as the plain dict rounded_path fills, without a GCodeCommand."""
+    def __init__(self):
+        self.base_position = [1.0, 2.0, 0.2, 0.]
+        self.last_position = [0., 0., 0., 0.]
+        self.speed_factor = 1. / 60.
+        self.speed = 25.
+        self.absolute_coord = True
+        self.count = 0
+
+    def move_with_transform(self, newpos, speed):
+        self.count += 1
+
+    def cmd_G1(self, gcmd):
+        # Only the coordinate part of gcode_move.cmd_G1 for a G0 with X/Y/Z/F:
+        # one float conversion and offset add per axis. Parameter lookup
+        # through GCodeCommand, the transform chain and toolhead.move() are
+        # not included.
+        params = gcmd
+        for pos, axis in enumerate('XYZ'):
+            if axis in params:
+                self.last_position[pos] = float(params[axis]) + self.base_position[pos]
+        if 'F' in params:
+            self.speed = float(params['F']) * self.speed_factor
+        self.move_with_transform(self.last_position, self.speed)
+
+
+class BenchPath(rounded_path.PathPlanner):
+    def __init__(self, resolution, direct_moves, max_chord_error=0., min_segment_time=0.,
+                 numpy_min_points=None, corner_mode='arc'):
+        rounded_path.PathPlanner.__init__(self, resolution, max_chord_error, min_segment_time,
+                                          numpy_min_points, corner_mode)
+        self.gcode_move = MoveSink()
+        self.direct_moves = direct_moves
+        self.G0_params = {}
+        self.G0_cmd = self.G0_params
+        self.real_G0 = self.gcode_move.cmd_G1
+
+    submit_moves = rounded_path.RoundedPath.submit_moves
+    _submit_direct = rounded_path.RoundedPath._submit_direct
+
+
+def dock_path(corners, d, seed=1):
+    """Zig-zag approach between dock rows with a long sweep at every corner."""
+    rnd = random.Random(seed)
+    points = [(0., 0., 10., 0.)]
+    for i in range(corners):
+        x = 300. * (i % 2) + rnd.uniform(-5., 5.)
+        y = 100. * (i + 1)
+        points.append((x, y, 10. + rnd.uniform(-1., 1.), d))
+    points.append((150., 100. * (corners + 2), 10., 0.))
+    return points
+
+
+def run(planner, points, feedrate=30000., one_pass=False):
+    """Plans the path per point like ROUNDED_G0, or in one pass like ROUNDED_PATH."""
+    start = points[0]
+    planner._lineto(rounded_path.ControlPoint(start[0], start[1], start[2], 0., feedrate))
+    begin = time.perf_counter()
+    if one_pass:
+        planner._plan_path([rounded_path.ControlPoint(x, y, z, d, feedrate)
+                            for x, y, z, d in points[1:]])
+    else:
+        for x, y, z, d in points[1:]:
+            planner._lineto(rounded_path.ControlPoint(x, y, z, d, feedrate))
+    return time.perf_counter() - begin
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark rounded_path segment throughput")
+    parser.add_argument('--corners', type=int, default=500, help="corners per path (default 500)")
+    parser.add_argument('--d', type=float, default=1000., help="corner deviation D (default 1000)")
+    parser.add_argument('--resolution', type=float, default=1., help="arc segment length (default 1)")
+    parser.add_argument('--chord-error', type=float, default=0.,
+                        help="max_chord_error, 0 for fixed resolution (default 0)")
+    parser.add_argument('--min-segment-time', type=float, default=0.,
+                        help="min_segment_time in seconds (default 0)")
+    parser.add_argument('--engine', choices=('python', 'numpy', 'auto', 'all'), default='all',
+                        help="geometry_engine to run (default all available)")
+    parser.add_argument('--corner-mode', choices=sorted(rounded_path.CORNER_MODES),
+                        default='arc', help="corner_mode (default arc)")
+    parser.add_argument('--rounded-path', action='store_true',
+                        help="plan the path in one pass like ROUNDED_PATH")
+    parser.add_argument('--plan-only', action='store_true',
+                        help="no arc segments, only corner planning and overlap resolution")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per mode, best is reported")
+    parser.add_argument('--suite', action='store_true',
+                        help="run the fixed benchmark cases of SUITE")
+    parser.add_argument('--crossover', action='store_true',
+                        help="NumPy/Python time of one flush by corners and arc points")
+    args = parser.parse_args(argv)
+
+    engines = ['python', 'numpy', 'auto'] if args.engine == 'all' else [args.engine]
+    if rounded_path.numpy is None:
+        if args.engine in ('numpy', 'auto'):
+            parser.error("NumPy is not installed")
+        engines = ['python']
+
+    if args.crossover:
+        if rounded_path.numpy is None:
+            parser.error("NumPy is not installed")
+        crossover(args.repeat * 40)
+        return 0
+    if args.suite:
+        for name, options in SUITE:
+            case = argparse.Namespace(**vars(args))
+            for option, value in options.items():
+                setattr(case, option, value)
+            print("%s:" % (name,))
+            bench(case, engines)
+        return 0
+    bench(args, engines)
+    return 0
+
+
+def bench(args, engines):
+    if args.plan_only:
+        args.resolution = float('inf')
+        args.chord_error = 0.
+    points = dock_path(args.corners, args.d)
+    for engine in engines:
+        for name, direct in (('G0 per segment', False), ('direct_moves', True)):
+            best = None
+            segments = 0
+            for _ in range(args.repeat):
+                planner = BenchPath(args.resolution, direct, args.chord_error,
+                                    args.min_segment_time, ENGINE_MIN_POINTS[engine],
+                                    args.corner_mode)
+                elapsed = run(planner, points, one_pass=args.rounded_path)
+                segments = planner.gcode_move.count
+                best = elapsed if best is None else min(best, elapsed)
+            print("%-6s %-16s %8d segments  %8.1f ms  %10.0f segments/s"
+                  % (engine, name, segments, best * 1000., segments / best))
+    if len(engines) > 1:
+        print("max deviation between engines: %.3g mm" % (compare_engines(args, points),))
+    if not args.rounded_path:
+        print("max buffered points: %d, first move after %d points"
+              % buffering(args, points))
+
+
+class CountingPath(rounded_path.PathPlanner):
+    def submit_moves(self, moves):
+        self.count += len(moves)
+
+
+def flush_time(numpy_min_points, points, resolution, repeat):
+    """Best time of the final flush of points, all corners in one batch."""
+    best = None
+    for _ in range(repeat):
+        planner = CountingPath(resolution, numpy_min_points=numpy_min_points)
+        planner.count = 0
+        start = points[0]
+        planner._lineto(rounded_path.ControlPoint(start[0], start[1], start[2], 0., 30000.))
+        for x, y, z, d in points[1:]:
+            planner._add_point(rounded_path.ControlPoint(x, y, z, d, 30000.))
+        begin = time.perf_counter()
+        planner._finish_path()
+        elapsed = time.perf_counter() - begin
+        best = elapsed if best is None else min(best, elapsed)
+    return best, planner.count
+
+
+def crossover(repeat):
+    """NumPy time relative to Python for flushes of 1 to 64 corners with
+    about 10 to 130 arc points each. Below 1 NumPy is faster."""
+    resolutions = (20., 10., 5., 2., 1.)
+    print("corners  " + "  ".join("%14s" % ("resolution %g" % (r,)) for r in resolutions))
+    for corners in (1, 2, 4, 8, 16, 32, 64):
+        points = dock_path(corners, 1000.)
+        row = []
+        for resolution in resolutions:
+            python_time, count = flush_time(None, points, resolution, repeat)
+            numpy_time, _ = flush_time(0, points, resolution, repeat)
+            row.append("%5d pts %4.2f" % (count, numpy_time / python_time))
+        print("%7d  %s" % (corners, "  ".join(row)))
+
+
+# Fixed benchmark cases, options override the command line ones
+SUITE = (
+    ("small D", {'d': 5.}),
+    ("overlapping D", {'d': 1000.}),
+    ("adaptive segments", {'d': 1000., 'chord_error': 0.01}),
+    ("min_segment_time", {'d': 1000., 'min_segment_time': 0.01}),
+    ("g2 corners", {'d': 1000., 'corner_mode': 'g2'}),
+    ("ROUNDED_PATH", {'d': 5., 'rounded_path': True}),
+    ("planning only", {'d': 1000., 'plan_only': True}),
+)
+
+
+class BufferStatsPath(rounded_path.PathPlanner):
+    def submit_moves(self, moves):
+        if self.first_move is None:
+            self.first_move = self.points
+    def _add_point(self, pos):
+        rounded_path.PathPlanner._add_point(self, pos)
+        self.points += 1
+        self.max_buffered = max(self.max_buffered, len(self.buffer))
+
+
+def buffering(args, points):
+    """Largest number of points held by the planner and number of points
+    fed before the first move came out, when fed like ROUNDED_G0."""
+    planner = BufferStatsPath(args.resolution, args.chord_error, args.min_segment_time,
+                              None, args.corner_mode)
+    planner.points = planner.max_buffered = 0
+    planner.first_move = None
+    run(planner, points)
+    return planner.max_buffered, planner.first_move
+
+
+ENGINE_MIN_POINTS = {'python': None, 'numpy': 0, 'auto': rounded_path.NUMPY_MIN_POINTS}
+
+
+class RecordingPath(rounded_path.PathPlanner):
+    def submit_moves(self, moves):
+        self.recorded.extend(moves)
+
+
+def compare_engines(args, points):
+    """Largest distance between the points generated by both engines."""
+    results = []
+    for numpy_min_points in (None, 0):
+        planner = RecordingPath(args.resolution, args.chord_error, args.min_segment_time,
+                                numpy_min_points, args.corner_mode)
+        planner.recorded = []
+        run(planner, points)
+        results.append(planner.recorded)
+    if len(results[0]) != len(results[1]):
+        return float('inf')
+    return max(rounded_path._vdist(a[0], b[0]) for a, b in zip(*results))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# Decoder for toolchanger event logs written by TOOLCHANGER_DUMP_LOG
+#
+# The file format is defined in klipper/extras/tc_event_log.py.
+#
+# Usage:
+#   tc_event_log.py ~/printer_data/logs/toolchanger_events.bin
+#   tc_event_log.py toolchanger_events.bin --json
+#
+# Copyright (C) 2025 PrintStructor
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import argparse, json, os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'klipper', 'extras'))
+from tc_event_log import decode_record, read_dump
+
+
+def format_record(decoded):
+    fields = ' '.join('%s=%s' % (key, value) for key, value in decoded.items()
+                      if key not in ('eventtime', 'change', 'event', 'tool'))
+    return '%14.6f  #%-5d %-4s %-15s %s' % (
+        decoded['eventtime'], decoded['change'],
+        'T%d' % (decoded['tool'],) if 'tool' in decoded else '-',
+        decoded['event'], fields)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Decode a toolchanger event log written by TOOLCHANGER_DUMP_LOG")
+    parser.add_argument('log', help="event log file")
+    parser.add_argument('--json', action='store_true', help="print the events as JSON")
+    args = parser.parse_args(argv)
+    try:
+        total, strings, records = read_dump(args.log)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    decoded = [decode_record(r, strings) for r in records]
+    if args.json:
+        json.dump({'total': total, 'events': decoded}, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return 0
+    if total > len(records):
+        print("%d older events were overwritten" % (total - len(records),))
+    for event in decoded:
+        print(format_record(event))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
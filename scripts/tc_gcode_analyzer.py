@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# Offline tool change analyzer for G-code files
+#
+# Indexes every T<n> in a print file with its byte offset, layer and the
+# extrusion since the previous change, and estimates the change overhead
+# from the toolchanger configuration. The analysis itself is in
+# klipper/extras/tc_gcode_analyzer.py.
+#
+# Usage:
+#   tc_gcode_analyzer.py print.gcode --config ~/printer_data/config/printer.cfg
+#   tc_gcode_analyzer.py print.gcode --index changes.csv --json
+#
+# Copyright (C) 2025 PrintStructor
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import argparse, configparser, json, os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'klipper', 'extras'))
+from tc_gcode_analyzer import ChangeModel, GcodeScan, assignment_commands, optimize_assignment
+
+
+def _percentile(counts, fraction):
+    values = sorted(counts)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def build_report(scan, overhead=None, change_time=None, model=None):
+    tools = sorted(set(scan.tool_selects) | set(scan.tool_extruded))
+    per_layer = list(scan.layer_changes.values())
+    report = {
+        'file_size': scan.size,
+        'changes': scan.changes,
+        'redundant_selects': scan.redundant,
+        'layers': scan.layers,
+        'layers_with_changes': len(per_layer),
+        'changes_per_layer': {
+            'max': max(per_layer) if per_layer else 0,
+            'median': _percentile(per_layer, .5),
+            'p90': _percentile(per_layer, .9),
+        },
+        'tools': {},
+    }
+    for tool in tools:
+        layers = scan.tool_layers.get(tool, ())
+        report['tools'][tool] = {
+            'selects': scan.tool_selects.get(tool, 0),
+            'extruded_mm': round(scan.tool_extruded.get(tool, 0.), 1),
+            'first_layer': min(layers) if layers else None,
+            'last_layer': max(layers) if layers else None,
+            'layers': len(layers),
+        }
+    if overhead is not None:
+        report['overhead_s'] = round(overhead, 1)
+        report['overhead_per_change_s'] = round(
+            overhead / scan.changes, 2) if scan.changes else 0.
+    elif change_time is not None:
+        report['overhead_s'] = round(scan.changes * change_time, 1)
+        report['overhead_per_change_s'] = change_time
+    if model is not None:
+        best, cost, current_cost = optimize_assignment(model, scan.transitions, model.numbers)
+        report['assignment'] = {
+            'current_s': round(current_cost, 1),
+            'optimized_s': round(cost, 1),
+            'saving_s': round(current_cost - cost, 1),
+            'commands': assignment_commands(model.numbers, best),
+        }
+    return report
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+
+def print_report(report, out=sys.stdout):
+    out.write("File size:          %.1f MB\n" % (report['file_size'] / 1e6,))
+    out.write("Tool changes:       %d (%d redundant selects ignored)\n"
+              % (report['changes'], report['redundant_selects']))
+    out.write("Layers:             %d, %d with changes\n"
+              % (report['layers'], report['layers_with_changes']))
+    cpl = report['changes_per_layer']
+    out.write("Changes per layer:  median %d, p90 %d, max %d\n"
+              % (cpl['median'], cpl['p90'], cpl['max']))
+    if 'overhead_s' in report:
+        out.write("Change overhead:    %s (%.1fs per change)\n"
+                  % (_format_duration(report['overhead_s']),
+                     report['overhead_per_change_s']))
+    out.write("\n%-6s %8s %14s %8s %14s\n"
+              % ('Tool', 'Selects', 'Extruded (m)', 'Layers', 'Layer range'))
+    for tool, stats in report['tools'].items():
+        layer_range = '-'
+        if stats['first_layer'] is not None:
+            layer_range = '%d-%d' % (stats['first_layer'], stats['last_layer'])
+        out.write("%-6s %8d %14.2f %8d %14s\n"
+                  % ('T%d' % (tool,), stats['selects'], stats['extruded_mm'] / 1000.,
+                     stats['layers'], layer_range))
+    assignment = report.get('assignment')
+    if assignment is not None:
+        if not assignment['commands']:
+            out.write("\nThe current dock assignment is optimal\n")
+            return
+        out.write("\nDock assignment: %s -> %s, saves %s\n"
+                  % (_format_duration(assignment['current_s']),
+                     _format_duration(assignment['optimized_s']),
+                     _format_duration(assignment['saving_s'])))
+        for command in assignment['commands']:
+            out.write("  %s\n" % (command,))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Index the tool changes of a G-code file and estimate their overhead")
+    parser.add_argument('gcode', help="G-code file to analyze")
+    parser.add_argument('--config', help="printer.cfg with [toolchanger] and [tool] sections")
+    parser.add_argument('--change-time', type=float,
+                        help="fixed seconds per change instead of the config based estimate")
+    parser.add_argument('--settle-time', type=float, default=0.5,
+                        help="fixed seconds added to every estimated change (default 0.5)")
+    parser.add_argument('--index', help="write every change as CSV to this file ('-' for stdout)")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    parser.add_argument('--optimize', action='store_true',
+                        help="suggest the ASSIGN_TOOL mapping with the least dock travel"
+                        " (needs --config)")
+    parser.add_argument('--jobs', type=int,
+                        help="number of processes used for scanning (default: all CPUs)")
+    args = parser.parse_args(argv)
+    if args.optimize and not args.config:
+        parser.error("--optimize needs --config")
+
+    model = None
+    if args.config and (args.change_time is None or args.optimize):
+        try:
+            model = ChangeModel.from_config(args.config, args.settle_time)
+        except (OSError, ValueError, configparser.Error) as e:
+            parser.error("Unable to read config: %s" % (e,))
+
+    index_file = None
+    if args.index == '-':
+        index_file = sys.stdout
+    elif args.index:
+        index_file = open(args.index, 'w')
+    overhead = [0.]
+
+    def on_change(change):
+        if model is not None and args.change_time is None:
+            overhead[0] += model.change_time(model.numbers.get(change.previous),
+                                             model.numbers.get(change.tool), change.z)
+        if index_file is not None:
+            index_file.write('%d,%s,%d,%d,%.3f,%.2f\n' % (
+                change.offset, '' if change.previous is None else change.previous,
+                change.tool, change.layer, change.z, change.extruded))
+
+    if index_file is not None:
+        index_file.write('offset,from_tool,to_tool,layer,z,extruded_mm\n')
+    try:
+        scan = GcodeScan(on_change, args.jobs).scan(args.gcode)
+    except OSError as e:
+        parser.error(str(e))
+    finally:
+        if index_file is not None and index_file is not sys.stdout:
+            index_file.close()
+
+    report = build_report(scan, overhead[0] if args.change_time is None and model else None,
+                          args.change_time, model if args.optimize else None)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    elif index_file is not sys.stdout:
+        print_report(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
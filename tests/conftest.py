@@ -0,0 +1,8 @@
+# The modules under test are Klipper extras. The standalone ones are imported
+# by name like the offline tools do, the toolchanger as extras.toolchanger
+# so its relative imports resolve.
+import os, sys
+
+KLIPPER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'klipper')
+sys.path.insert(0, os.path.join(KLIPPER_DIR, 'extras'))
+sys.path.insert(0, KLIPPER_DIR)
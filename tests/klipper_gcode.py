@@ -0,0 +1,60 @@
+# Klipper's G-code line parsing, for checking command lines in tests
+#
+# Uses klippy/gcode.py from KLIPPER_PATH (default ~/klipper) when it is
+# there, otherwise a copy of its parsing rules.
+#
+# Copyright (C) 2025 PrintStructor
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import importlib.util, os, re, shlex
+
+
+def _load_klipper_gcode():
+    klipper_path = os.path.expanduser(os.environ.get('KLIPPER_PATH', '~/klipper'))
+    path = os.path.join(klipper_path, 'klippy', 'gcode.py')
+    if not os.path.exists(path):
+        return None
+    spec = importlib.util.spec_from_file_location('klippy_gcode', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.GCodeDispatch
+
+# klippy/gcode.py, GCodeDispatch.args_r and .extended_r
+ARGS_R = re.compile('([A-Z_]+|[A-Z*])')
+EXTENDED_R = re.compile(
+    r'^\s*(?:N[0-9]+\s*)?'
+    r'(?P<cmd>[a-zA-Z_][a-zA-Z0-9_]+)(?:\s+|$)'
+    r'(?P<args>[^#*;]*?)'
+    r'\s*(?:[#*;].*)?$')
+_dispatch = _load_klipper_gcode()
+if _dispatch is not None:
+    ARGS_R = getattr(_dispatch, 'args_r', ARGS_R)
+    EXTENDED_R = getattr(_dispatch, 'extended_r', EXTENDED_R)
+
+
+class MalformedCommand(Exception):
+    pass
+
+
+def parse_line(line):
+    """Returns (command, params) of an extended command line the way
+    GCodeDispatch dispatches it, from the console or from a macro."""
+    origline = line.strip()
+    cpos = origline.find(';')
+    parts = ARGS_R.split((origline if cpos < 0 else origline[:cpos]).upper())
+    if len(parts) < 3:
+        return '', {}
+    cmd = parts[1] + parts[2].strip()
+    # GCodeDispatch._get_extended_params()
+    m = EXTENDED_R.match(origline)
+    if m is None:
+        raise MalformedCommand("Malformed command '%s'" % (origline,))
+    try:
+        eparams = [earg.split('=', 1) for earg in shlex.split(m.group('args'))]
+        return cmd, {k.upper(): v for k, v in eparams}
+    except ValueError:
+        raise MalformedCommand("Malformed command '%s'" % (origline,))
+
+
+def render(line, value='1'):
+    """Replaces the {...} template expressions of a config line."""
+    return re.sub(r'\{[^{}]*\}', value, line)
@@ -0,0 +1,261 @@
+# Geometry invariants of rounded_path on random 3D polylines
+#
+# Every path is planned point by point like ROUNDED_G0 and in one pass like
+# ROUNDED_PATH, with the Python and (when installed) NumPy geometry. All of
+# them must keep the invariants of check_path() and produce the same moves.
+# ROUNDED_PATH_FUZZ_PATHS and ROUNDED_PATH_FUZZ_SEED run more or other paths.
+import math, os, random
+import pytest
+import rounded_path
+
+FUZZ_PATHS = int(os.environ.get('ROUNDED_PATH_FUZZ_PATHS', 300))
+FUZZ_SEED = int(os.environ.get('ROUNDED_PATH_FUZZ_SEED', 1))
+CHUNKS = 6
+
+
+class FuzzPath(rounded_path.PathPlanner):
+    """Records the moves, and for every emitted corner its final rounding
+    and number of arc segments, so the moves can be split per corner."""
+    def __init__(self, *args, **kwargs):
+        rounded_path.PathPlanner.__init__(self, *args, **kwargs)
+        self.recorded = []
+        self.corners = {}
+
+    def submit_moves(self, moves):
+        self.recorded.extend(moves)
+
+    def _emit_corners(self, num_corners):
+        if num_corners > 0:
+            for c in self.buffer.oldest(num_corners + 1)[1:]:
+                radius = c.lin_d * c.lin_d_to_r
+                self.corners[c] = (c.lin_d, c.lin_d_to_r > 0.,
+                                   self._arc_segments(c, radius, math.pi - c.angle),
+                                   self._corner_deviation(c))
+        rounded_path.PathPlanner._emit_corners(self, num_corners)
+
+
+def fuzz_path(rnd):
+    """Random 3D polyline of (x, y, z, d, f, v) with collinear, reversing and
+    near-duplicate points mixed in, at a random scale."""
+    scale = 10. ** rnd.uniform(-1., 3.)
+    planar = rnd.random() < 0.3
+    def random_point():
+        return [rnd.uniform(-scale, scale), rnd.uniform(-scale, scale),
+                0. if planar else rnd.uniform(-scale, scale)]
+    path = [random_point()]
+    for _ in range(rnd.randint(1, 30)):
+        prev = path[-1][:3]
+        kind = rnd.random()
+        if kind < 0.3 and len(path) >= 2:
+            # Straight on or back along the previous segment, slightly off
+            direction = [prev[i] - path[-2][i] for i in range(3)]
+            step = rnd.uniform(0.1, 2.) * (1. if kind < 0.15 else -1.)
+            wobble = rnd.choice((0., 1e-9, 1e-6, 1e-3)) * scale
+            point = [prev[i] + direction[i] * step + rnd.uniform(-wobble, wobble)
+                     for i in range(3)]
+        elif kind < 0.35:
+            size = rnd.choice((0., 1e-9, 1e-6)) * scale
+            point = [prev[i] + rnd.uniform(-size, size) for i in range(3)]
+        else:
+            point = random_point()
+        if planar:
+            point[2] = 0.
+        kind = rnd.random()
+        if kind < 0.1:
+            d = 0.
+        elif kind < 0.3:
+            d = rnd.uniform(0., 0.01) * scale
+        elif kind < 0.8:
+            d = rnd.uniform(0., 1.) * scale
+        else:
+            d = 1e4 * scale
+        f = rnd.choice((0., rnd.uniform(600., 30000.)))
+        v = rnd.choice((0., rnd.uniform(1., 500.)))
+        path.append(point + [d, f, v])
+    path[0] += [0., 0., 0.]
+    return scale, path
+
+
+def fuzz_moves(planner, path, one_pass):
+    """Feeds path[1:] like ROUNDED_PATH or point by point like ROUNDED_G0,
+    restarting the chain at the current position after a D=0 point.
+    Returns the ControlPoints in path order."""
+    planner.default_speed = 25.
+    planner.accel = 3000.
+    points = [rounded_path.ControlPoint(*p) for p in path]
+    planner.buffer.append(points[0])
+    if one_pass:
+        planner._plan_path(points[1:])
+        return points
+    for prev, point in zip(points, points[1:]):
+        if not len(planner.buffer):
+            planner.buffer.append(rounded_path.ControlPoint(*(prev.vec + [0., 0.])))
+        planner._lineto(point)
+    planner._finish_path()
+    return points
+
+
+def _sub(a, b):
+    return [a[0] - b[0], a[1] - b[1], a[2] - b[2]]
+
+
+def _dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+
+def _unit(vec):
+    length = math.hypot(*vec)
+    return [v / length for v in vec] if length > 1e-12 else None
+
+
+def _angle(a, b):
+    return math.atan2(math.hypot(*rounded_path._cross(a, b)), _dot(a, b))
+
+
+def _line_distance(point, origin, direction):
+    offset = _sub(point, origin)
+    along = _dot(offset, direction)
+    return math.sqrt(max(0., _dot(offset, offset) - along * along))
+
+
+def check_path(planner, points, path, scale):
+    """Yields a description of every invariant violated by the recorded moves.
+    The planner moves emitted points to the end of their rounding, the
+    positions are taken from path."""
+    tol = 1e-7 * scale
+    positions = [p[:3] for p in path]
+    moves = planner.recorded
+    for vec, f in moves:
+        if not all(math.isfinite(v) for v in vec) or not math.isfinite(f):
+            yield "non-finite move %r F%r" % (vec, f)
+            return
+    pos = 0
+    prev_lin_d = 0.
+    for i in range(1, len(points) - 1):
+        c = points[i]
+        corner = positions[i]
+        lin_d, rounded, segments, deviation = planner.corners.get(c, (0., False, 0, 0.))
+        where = "corner %d" % (i,)
+        # No rounding reaches past the roundings of its neighbours
+        if prev_lin_d + lin_d > c.len + tol:
+            yield "%s: roundings overlap by %.3g" % (where, prev_lin_d + lin_d - c.len)
+        prev_lin_d = lin_d
+        if deviation > c.maxd + tol:
+            yield "%s: deviation %.9g above D=%.9g" % (where, deviation, c.maxd)
+        if segments < 1:
+            if pos >= len(moves) or moves[pos][0] != corner:
+                yield "%s: sharp corner not at the corner point" % (where,)
+                return
+            pos += 1
+            continue
+        group = [vec for vec, f in moves[pos:pos + segments + 1]]
+        pos += segments + 1
+        if len(group) != segments + 1:
+            yield "%s: only %d of %d rounding points" % (where, len(group), segments + 1)
+            return
+        a = _unit(_sub(corner, positions[i - 1]))
+        b = _unit(_sub(positions[i + 1], corner))
+        if a is None or b is None or not rounded:
+            yield "%s: rounded although a leg has no direction" % (where,)
+            continue
+        # Rounding starts and ends on the legs, lin_d from the corner
+        start = [corner[k] - a[k] * lin_d for k in range(3)]
+        end = [corner[k] + b[k] * lin_d for k in range(3)]
+        if rounded_path._vdist(group[0], start) > tol or rounded_path._vdist(group[-1], end) > tol:
+            yield "%s: rounding does not start and end on the legs" % (where,)
+        # Deviation: no point further from the legs than the midpoint of a
+        # rounding with the requested D, chords may add max_chord_error
+        angle = _angle([-v for v in a], b)
+        limit = c.maxd * math.sin(angle / 2.) + tol
+        for vec in group:
+            distance = min(_line_distance(vec, corner, a), _line_distance(vec, corner, b))
+            if distance > limit:
+                yield "%s: point %.9g from the legs, D=%.9g allows %.9g" % (
+                    where, distance, c.maxd, limit)
+                break
+        if (planner.max_chord_error > 0. and planner.min_segment_time <= 0.
+                and planner.corner_mode == 'arc'):
+            for v0, v1 in zip(group, group[1:]):
+                mid = [(v0[k] + v1[k]) / 2. for k in range(3)]
+                distance = min(_line_distance(mid, corner, a), _line_distance(mid, corner, b))
+                if distance > limit + planner.max_chord_error:
+                    yield "%s: chord %.9g from the legs, above D + max_chord_error" % (
+                        where, distance)
+                    break
+        # Monotone progress along the corner
+        progress_dir = [a[k] + b[k] for k in range(3)]
+        progress = [_dot(_sub(vec, corner), progress_dir) for vec in group]
+        if any(p1 < p0 - tol for p0, p1 in zip(progress, progress[1:])):
+            yield "%s: rounding goes backwards" % (where,)
+        # Tangent continuity: the turns from the incoming leg over the chords
+        # to the outgoing leg add up to the corner turn, the first and last
+        # turn are at most half a segment's share of it
+        chords = [_sub(v1, v0) for v0, v1 in zip(group, group[1:])]
+        shortest = min(math.hypot(*chord) for chord in chords)
+        if shortest < 1e-12:
+            continue
+        directions = [a] + [_unit(chord) for chord in chords] + [b]
+        turns = [_angle(d0, d1) for d0, d1 in zip(directions, directions[1:])]
+        sweep = math.pi - angle
+        # Rounding errors of the coordinates are amplified on short chords
+        angle_tol = 1e-6 + 1e-12 * scale / shortest
+        if abs(sum(turns) - sweep) > angle_tol * len(turns):
+            yield "%s: turns add up to %.9g instead of %.9g" % (where, sum(turns), sweep)
+        if max(turns[0], turns[-1]) > sweep / (2. * segments) + angle_tol:
+            yield "%s: kink of %.9g rad where the rounding meets the legs" % (
+                where, max(turns[0], turns[-1]))
+    if prev_lin_d > points[-1].len + tol:
+        yield "last segment: rounding longer than the segment"
+    if pos != len(moves) - 1:
+        yield "%d moves, expected %d" % (len(moves), pos + 1)
+    elif moves[-1][0] != positions[-1]:
+        yield "ends at %r instead of %r" % (moves[-1][0], positions[-1])
+
+
+def fuzz_violations(index, seed):
+    """Plans path index of seed every way and returns the violations."""
+    engines = [None] if rounded_path.numpy is None else [None, 0]
+    rnd = random.Random("%d-%d" % (seed, index))
+    scale, path = fuzz_path(rnd)
+    options = dict(
+        mm_per_arc_segment=10. ** rnd.uniform(-2., 0.) * scale,
+        max_chord_error=rnd.choice((0., 10. ** rnd.uniform(-4., -1.) * scale)),
+        min_segment_time=rnd.choice((0., 0., rnd.uniform(0., 0.01))),
+        corner_mode=rnd.choice(sorted(rounded_path.CORNER_MODES)),
+        ring_size=rnd.choice((4, 5, 8, rounded_path.RING_SIZE)))
+    violations = []
+    results = []
+    for numpy_min_points in engines:
+        for one_pass in (False, True):
+            planner = FuzzPath(numpy_min_points=numpy_min_points, **options)
+            points = fuzz_moves(planner, path, one_pass)
+            for message in check_path(planner, points, path, scale):
+                violations.append("path %d (%s, %s): %s" % (
+                    index, 'numpy' if numpy_min_points is not None else 'python',
+                    'ROUNDED_PATH' if one_pass else 'ROUNDED_G0', message))
+            results.append(planner.recorded)
+    for other in results[1:]:
+        if len(other) != len(results[0]) or any(
+                rounded_path._vdist(m0[0], m1[0]) > 1e-9 * scale
+                for m0, m1 in zip(results[0], other)):
+            violations.append("path %d: engines or feeding disagree" % (index,))
+            break
+    return violations
+
+
+@pytest.mark.parametrize('chunk', range(CHUNKS))
+def test_invariants_on_random_paths(chunk):
+    violations = []
+    for index in range(chunk, FUZZ_PATHS, CHUNKS):
+        violations.extend(fuzz_violations(index, FUZZ_SEED))
+    assert not violations, "\n".join(violations[:20])
+
+
+def test_checker_reports_a_misplaced_rounding():
+    planner = FuzzPath(mm_per_arc_segment=1.)
+    path = [[0., 0., 0., 0., 0., 0.], [100., 0., 0., 10., 0., 0.], [100., 100., 0., 0., 0., 0.]]
+    points = fuzz_moves(planner, path, False)
+    assert list(check_path(planner, points, path, 100.)) == []
+    vec, f = planner.recorded[3]
+    planner.recorded[3] = ([vec[0] + 5., vec[1], vec[2]], f)
+    assert list(check_path(planner, points, path, 100.))
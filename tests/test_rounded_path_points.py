@@ -0,0 +1,37 @@
+# ROUNDED_PATH command lines through Klipper's G-code parsing
+import os, re
+
+import pytest
+
+import rounded_path
+from klipper_gcode import MalformedCommand, parse_line, render
+
+DOCS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                    'docs', 'rounded_path.md')
+
+
+def doc_lines(command):
+    with open(DOCS) as f:
+        return [line.strip() for line in f if line.startswith(command + ' ')]
+
+
+def test_points_survive_klipper_parsing():
+    cmd, params = parse_line(
+        'ROUNDED_PATH POINTS="100,60,,5,30000|100,95,,2|100,100,,,3000"  ; dock')
+    assert cmd == 'ROUNDED_PATH'
+    assert rounded_path.parse_points(params['POINTS']) == [
+        (100., 60., None, 5., 30000.), (100., 95., None, 2., None),
+        (100., 100., None, None, 3000.)]
+
+
+def test_semicolon_starts_a_comment():
+    with pytest.raises(MalformedCommand):
+        parse_line('ROUNDED_PATH POINTS="100,60|100,95;100,100"')
+
+
+@pytest.mark.parametrize('line', doc_lines('ROUNDED_PATH') + doc_lines('ROUNDED_PATH_PREVIEW'))
+def test_documented_lines_parse(line):
+    cmd, params = parse_line(render(line))
+    assert cmd == line.split()[0]
+    if not re.search('[a-z]', params['POINTS']):
+        assert len(rounded_path.parse_points(params['POINTS'])) > 1
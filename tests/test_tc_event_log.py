@@ -0,0 +1,31 @@
+# Event log: recorded by the extra, decoded by scripts/tc_event_log.py
+import importlib.util, os
+import tc_event_log
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      'scripts', 'tc_event_log.py')
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location('tc_event_log_cli', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_extras_module_has_no_command_line():
+    assert not hasattr(tc_event_log, 'main')
+
+
+def test_dump_decodes_oldest_first(tmp_path, capsys):
+    log = tc_event_log.EventLog(2)
+    log.record(1., tc_event_log.EV_STATUS, 1, 0, 3.)
+    log.record(2., tc_event_log.EV_DETECT, 1, 0, 1.)
+    log.record(3., tc_event_log.EV_ERROR, 1, 0, log.intern("Tool not detected"))
+    path = str(tmp_path / 'events.bin')
+    assert log.dump(path) == 2
+    assert load_script().main([path]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "1 older events were overwritten"
+    assert lines[1].split()[-2:] == ['detect', 'state=present']
+    assert lines[2].endswith('text=Tool not detected')
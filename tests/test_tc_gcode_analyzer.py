@@ -0,0 +1,27 @@
+# scripts/tc_gcode_analyzer.py runs on top of the analysis kept in extras
+import importlib.util, json, os
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      'scripts', 'tc_gcode_analyzer.py')
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location('tc_gcode_analyzer_cli', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_extras_module_has_no_command_line():
+    import tc_gcode_analyzer
+    assert not hasattr(tc_gcode_analyzer, 'main')
+    assert tc_gcode_analyzer.scan_transitions
+
+
+def test_cli_report(tmp_path, capsys):
+    gcode = tmp_path / 'print.gcode'
+    gcode.write_text('T0\nG1 X1 E1\n;LAYER_CHANGE\nT1\nG1 X2 E2\nT0\nG1 E3\n')
+    assert load_script().main([str(gcode), '--json', '--jobs', '2']) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report['changes'] == 3
+    assert sorted(report['tools']) == ['0', '1']
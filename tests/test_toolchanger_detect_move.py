@@ -0,0 +1,69 @@
+# TOOL_DETECT_MOVE converts its coordinates like G1
+from extras import toolchanger
+from toolchanger_sim import Tool, make_toolchanger
+
+
+class GCodeMove:
+    def __init__(self, base_position, last_position, absolute_coord=True):
+        self.base_position = base_position
+        self.last_position = last_position
+        self.absolute_coord = absolute_coord
+
+    def get_status(self, eventtime=None):
+        return {'position': list(self.last_position), 'speed': 100.,
+                'homing_origin': [0., 0., 0., 0.]}
+
+
+class Homing:
+    def __init__(self):
+        self.targets = []
+
+    def probing_move(self, endstop, target, speed):
+        self.targets.append(list(target))
+        return list(target)
+
+
+class GCmd:
+    def __init__(self, **params):
+        self.params = params
+
+    def get(self, name, default=None):
+        return self.params.get(name, default)
+
+    def get_int(self, name, default=None):
+        return self.params.get(name, default)
+
+    def get_float(self, name, default=None, above=None):
+        return self.params.get(name, default)
+
+    def respond_info(self, msg, log=True):
+        pass
+
+
+def detect_move(gcode_move, toolhead_position, **params):
+    tc = make_toolchanger()
+    tc.verbosity = toolchanger.VERBOSITY_NORMAL
+    tc.gcode_move = gcode_move
+    tc.printer.toolhead.position = toolhead_position
+    homing = Homing()
+    tc.printer.objects['homing'] = homing
+    tool = Tool('tool T1', tc.printer.toolhead)
+    tool.detect_state = toolchanger.DETECT_ABSENT
+    tc.active_tool = tool
+    tc.cmd_TOOL_DETECT_MOVE(GCmd(**params))
+    return tc, homing.targets[0]
+
+
+def test_g92_and_gcode_offset_apply():
+    # G92 shifted X by 5, a tool offset moves Y by -2
+    gcode_move = GCodeMove([5., -2., 0., 0.], [50., 50., 10., 0.])
+    tc, target = detect_move(gcode_move, [50., 50., 10., 0.], Y=30., Z=2.)
+    assert target[:3] == [50., 28., 2.]
+    assert tc.last_detect_position == {'X': 45., 'Y': 30., 'Z': 2.}
+
+
+def test_relative_coordinates():
+    gcode_move = GCodeMove([5., -2., 0., 0.], [50., 50., 10., 0.], absolute_coord=False)
+    tc, target = detect_move(gcode_move, [50., 50., 10.1, 0.], Y=-10.)
+    # The 0.1 transform (bed mesh) at the start point is kept
+    assert target[:3] == [50., 40., 10.1]
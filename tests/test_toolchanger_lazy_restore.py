@@ -0,0 +1,58 @@
+# Lazy restore: PAUSE and RESTORE_GCODE_STATE MOVE=1 do not run the pending restore
+from toolchanger_sim import Tool, make_toolchanger
+
+
+class GCodeMove:
+    def __init__(self):
+        self.saved_states = {}
+        self.moves = []
+
+    def cmd_G1(self, gcmd):
+        self.moves.append(gcmd.get_command_parameters())
+
+
+class GCmd:
+    def __init__(self, **params):
+        self.params = params
+
+    def get_int(self, name, default=None):
+        return self.params.get(name, default)
+
+
+def pending_restore():
+    tc = make_toolchanger()
+    tc.gcode_move = GCodeMove()
+    tc.deferred_restore = {'X': 120., 'Y': 80.}
+    tc.deferred_restore_z = 1.2
+    return tc
+
+
+def test_pause_drops_restore_and_resumes_at_it():
+    tc = pending_restore()
+
+    def pause(gcmd):
+        # SAVE_GCODE_STATE NAME=PAUSE_state at the end of the change, then parking
+        tc.gcode_move.saved_states['PAUSE_state'] = {
+            'base_position': [1., 2., 0.5, 0.], 'last_position': [300., 300., 5.5, 10.]}
+        assert tc.deferred_restore is None
+    tc._wrap_pause(pause)(GCmd())
+    assert tc.gcode_move.moves == []
+    assert tc.paused_restore is None
+    # RESUME goes back to the restore target; Z stays above the print height
+    assert tc.gcode_move.saved_states['PAUSE_state']['last_position'] == [121., 82., 5.5, 10.]
+
+
+def test_tool_loss_drops_restore():
+    tc = pending_restore()
+    tc.stop_for_tool_loss(Tool('tool T1', tc.printer.toolhead), tc.printer.reactor.monotonic())
+    assert tc.deferred_restore is None
+    assert tc.paused_restore == ({'X': 120., 'Y': 80.}, 1.2)
+
+
+def test_restore_state_with_move_replaces_restore():
+    tc = pending_restore()
+    tc._wrap_restore_state(lambda gcmd: None)(GCmd(MOVE=0))
+    assert tc.deferred_restore == {'X': 120., 'Y': 80.}
+    tc._wrap_restore_state(lambda gcmd: None)(GCmd(MOVE=1))
+    assert tc.deferred_restore is None
+    assert tc.gcode_move.moves == []
@@ -0,0 +1,113 @@
+# Tool loss trigger: the detection pin armed as a trsync on the XYZ steppers
+from extras import toolchanger
+from toolchanger_sim import Tool, make_toolchanger
+
+
+def loss_tool(tc):
+    tool = Tool('tool T1', tc.printer.toolhead)
+    tool.tool_loss_trigger = True
+    tc.active_tool = tool
+    return tool
+
+
+def test_armed_from_the_lookahead_without_flushing():
+    tc = make_toolchanger()
+    toolhead = tc.printer.toolhead
+    tool = loss_tool(tc)
+    tc._arm_loss_trigger(tool)
+    # Nothing starts before the lookahead reaches the end of the queued moves
+    assert tool.detection_endstop.starts == []
+    assert tc.loss_trigger['state'] == 'pending'
+    toolhead.flush_lookahead()
+    assert tool.detection_endstop.starts == [(10., False)]
+    assert tc.loss_trigger['state'] == 'armed'
+    assert toolhead.calls == []
+
+
+def test_not_armed_twice():
+    tc = make_toolchanger()
+    tool = loss_tool(tc)
+    tc._arm_loss_trigger(tool)
+    tc._arm_loss_trigger(tool)
+    tc.printer.toolhead.flush_lookahead()
+    tc._arm_loss_trigger(tool)
+    tc.printer.toolhead.flush_lookahead()
+    assert len(tool.detection_endstop.starts) == 1
+
+
+def test_only_armed_while_printing():
+    tc = make_toolchanger()
+    tc.printer.objects['virtual_sdcard'].active = False
+    tool = loss_tool(tc)
+    tc._arm_loss_trigger(tool)
+    tc.printer.toolhead.flush_lookahead()
+    assert tc.loss_trigger is None
+    assert tool.detection_endstop.starts == []
+
+
+def test_pending_trigger_disarms_without_waiting():
+    tc = make_toolchanger()
+    toolhead = tc.printer.toolhead
+    tool = loss_tool(tc)
+    tc._arm_loss_trigger(tool)
+    tc._handle_homing_move_begin(None)
+    toolhead.flush_lookahead()
+    assert tc.loss_trigger is None
+    assert tool.detection_endstop.starts == []
+    assert toolhead.calls == []
+
+
+def test_tool_gone_before_the_lookahead_got_there():
+    tc = make_toolchanger()
+    tool = loss_tool(tc)
+    tc._arm_loss_trigger(tool)
+    tool.detect_state = toolchanger.DETECT_ABSENT
+    tc.printer.toolhead.flush_lookahead()
+    assert tc.loss_trigger is None
+    assert tool.detection_endstop.starts == []
+
+
+def test_probing_move_disarms_and_rearms():
+    tc = make_toolchanger()
+    toolhead = tc.printer.toolhead
+    tool = loss_tool(tc)
+    tc._arm_loss_trigger(tool)
+    toolhead.flush_lookahead()
+    tc._handle_homing_move_begin(None)
+    # Stopping the running trsync halts its steppers, the queue drains first
+    assert tool.detection_endstop.waits == 1
+    assert tc.loss_trigger is None
+    assert toolhead.calls[0] == 'wait_moves'
+    del toolhead.calls[:]
+    tc._handle_homing_move_end(None)
+    toolhead.last_move_time = 12.
+    toolhead.flush_lookahead()
+    assert tool.detection_endstop.starts == [(10., False), (12., False)]
+    assert toolhead.calls == []
+
+
+def test_trigger_halts_and_resyncs():
+    tc = make_toolchanger()
+    toolhead = tc.printer.toolhead
+    tool = loss_tool(tc)
+    tc._arm_loss_trigger(tool)
+    toolhead.flush_lookahead()
+    tool.detection_endstop.fire(halt_steps=300)
+    tc.printer.reactor.run_callbacks()
+    assert tc.loss_trigger is None
+    assert toolhead.position[:3] == [-3., -3., -3.]
+    assert 'wait_moves' not in toolhead.calls
+    assert any('steppers halted by the MCU' in r for r in tc.gcode.responses)
+
+
+def test_disarmed_once_the_print_ends():
+    tc = make_toolchanger()
+    tool = loss_tool(tc)
+    tc._arm_loss_trigger(tool)
+    tc.printer.toolhead.flush_lookahead()
+    tc._handle_idle_ready(10.)
+    assert tc.loss_trigger is not None
+    tc.printer.objects['virtual_sdcard'].active = False
+    tc._handle_idle_ready(10.)
+    assert tc.loss_trigger is None
+    assert tool.detection_endstop.waits == 1
@@ -0,0 +1,61 @@
+# Tool motion profile: applied through the objects, without console output
+from toolchanger_sim import CommandError, Tool, make_toolchanger
+
+
+class InputShaper:
+    """An input_shaper module from before get_status() existed."""
+    def __init__(self, error=None):
+        self.applied = []
+        self.error = error
+
+    def cmd_SET_INPUT_SHAPER(self, gcmd):
+        if self.error:
+            raise CommandError(self.error)
+        self.applied.append(gcmd.get_command_parameters())
+        gcmd.respond_info("shaper_type_x:ei shaper_freq_x:79.800")
+
+
+class ExtruderStepper:
+    def __init__(self):
+        self.applied = []
+
+    def cmd_SET_PRESSURE_ADVANCE(self, gcmd):
+        self.applied.append(gcmd.get_command_parameters())
+        gcmd.respond_info("pressure_advance: 0.035000")
+
+
+class Extruder:
+    def __init__(self):
+        self.extruder_stepper = ExtruderStepper()
+
+    def get_status(self, eventtime):
+        return {'pressure_advance': 0., 'smooth_time': 0.04}
+
+
+def apply_profile(input_shaper):
+    tc = make_toolchanger()
+    tc.change_envelope_saved = None
+    tc.printer.objects['input_shaper'] = input_shaper
+    tool = Tool('tool T0', tc.printer.toolhead)
+    tool.extruder = Extruder()
+    tool.extruder_stepper = None
+    tool.motion_profile = {
+        'input_shaper': {'SHAPER_TYPE_X': 'ei', 'SHAPER_FREQ_X': 79.8},
+        'pressure_advance': 0.035, 'pressure_advance_smooth_time': 0.04}
+    tc._apply_motion_profile(tool)
+    return tc, tool
+
+
+def test_profile_applied_without_responses():
+    input_shaper = InputShaper()
+    tc, tool = apply_profile(input_shaper)
+    assert input_shaper.applied == [{'SHAPER_TYPE_X': 'ei', 'SHAPER_FREQ_X': '79.8'}]
+    assert tool.extruder.extruder_stepper.applied == [{'ADVANCE': '0.035'}]
+    assert tc.gcode.responses == []
+
+
+def test_rejected_shaper_does_not_stop_the_change():
+    tc, tool = apply_profile(InputShaper(error="Unsupported shaper type"))
+    assert tool.extruder.extruder_stepper.applied == [{'ADVANCE': '0.035'}]
+    assert tc.gcode.responses == [
+        "Input shaper of tool T0 not applied: Unsupported shaper type"]
@@ -0,0 +1,64 @@
+# Speculative pickup: the MCU halts stage 2 through a trsync on the detection pin
+from extras import toolchanger
+from toolchanger_sim import Tool, make_toolchanger
+
+
+def start_pickup(tc):
+    toolhead = tc.printer.toolhead
+    tool = Tool('tool T1', toolhead)
+    check = tc._start_detection_check(tool, pickup_trigger=True)
+    tc.speculative_check = check
+    # Stage 2 is queued, then the lookahead reaches the end of stage 1
+    toolhead.flush_lookahead()
+    return tool, check
+
+
+def test_trigger_armed_at_the_check_point():
+    tc = make_toolchanger()
+    tool, check = start_pickup(tc)
+    assert tool.detection_endstop.starts == [(10. + toolchanger.PICKUP_SETTLE_TIME, False)]
+    assert tc.loss_trigger['kind'] == 'pickup'
+    # Arming does not commit or wait for the motion
+    assert tc.printer.toolhead.calls == []
+
+
+def test_missing_tool_halts_stage2_and_resyncs_position():
+    tc = make_toolchanger()
+    tool, check = start_pickup(tc)
+    tool.detection_endstop.fire(halt_steps=500)
+    tc.printer.reactor.run_callbacks()
+    assert check['done'] and not check['ok']
+    assert tc._speculative_check_failed()
+    ok = tc._finish_pickup_trigger(tool, True)
+    assert not ok
+    assert tc.loss_trigger is None
+    assert tool.detection_endstop.waits == 1
+    # The host position moved back to where the steppers halted
+    assert tc.printer.toolhead.position[:3] == [-5., -5., -5.]
+
+
+def test_successful_pickup_removes_the_trigger():
+    tc = make_toolchanger()
+    tool, check = start_pickup(tc)
+    assert tc._finish_pickup_trigger(tool, True)
+    assert tc.loss_trigger is None
+    assert tool.detection_endstop.waits == 1
+    # Stopping a trsync stops its steppers, the queue drained first
+    assert tc.printer.toolhead.calls == ['wait_moves', 'get_last_move_time']
+
+
+def test_successful_pickup_keeps_the_trigger_as_loss_trigger():
+    tc = make_toolchanger()
+    tool, check = start_pickup(tc)
+    tool.tool_loss_trigger = True
+    assert tc._finish_pickup_trigger(tool, True)
+    assert tc.loss_trigger['kind'] == 'loss'
+    assert tc.printer.toolhead.calls == []
+
+
+def test_failed_host_check_does_not_keep_the_trigger():
+    tc = make_toolchanger()
+    tool, check = start_pickup(tc)
+    tool.tool_loss_trigger = True
+    assert not tc._finish_pickup_trigger(tool, False)
+    assert tc.loss_trigger is None
@@ -0,0 +1,41 @@
+# The toolchanger completes an open ROUNDED_G0 chain before waiting on the toolhead
+from extras import toolchanger
+from toolchanger_sim import Tool, make_toolchanger
+
+
+class RoundedPath:
+    def __init__(self, toolhead):
+        self.toolhead = toolhead
+        self.flushes = []
+
+    def flush(self):
+        # Record what the toolhead had seen when the chain was completed
+        self.flushes.append(list(self.toolhead.calls) + list(
+            'lookahead' for c in self.toolhead.lookahead_callbacks))
+
+
+def test_detection_wait_flushes_first():
+    tc = make_toolchanger()
+    toolhead = tc.printer.toolhead
+    rounded_path = tc.printer.objects['rounded_path'] = RoundedPath(toolhead)
+    tool = Tool('tool T1', toolhead)
+    assert tc._wait_for_detection_state(tool, expect_present=True, retries=1)
+    assert rounded_path.flushes == [[]]
+    assert toolhead.calls == ['wait_moves']
+
+
+def test_speculative_check_point_after_flush():
+    tc = make_toolchanger()
+    toolhead = tc.printer.toolhead
+    rounded_path = tc.printer.objects['rounded_path'] = RoundedPath(toolhead)
+    tc._start_detection_check(Tool('tool T1', toolhead))
+    # Flushed before the check attached to the end of the queue
+    assert rounded_path.flushes == [[]]
+    assert len(toolhead.lookahead_callbacks) == 1
+
+
+def test_without_rounded_path():
+    tc = make_toolchanger()
+    tool = Tool('tool T1', tc.printer.toolhead)
+    assert tool.detect_state == toolchanger.DETECT_PRESENT
+    assert tc._wait_for_detection_state(tool, expect_present=True, retries=1)
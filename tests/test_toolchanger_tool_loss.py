@@ -0,0 +1,58 @@
+# Tool loss fast path: drop the queued moves, never wait for the motion
+from toolchanger_sim import Move, Tool, make_toolchanger
+
+
+def queue_moves(toolhead, count):
+    toolhead.lookahead.queue.extend(Move([float(i), 1., 2., 3.]) for i in range(count))
+
+
+def test_host_path_drops_lookahead_without_waiting():
+    tc = make_toolchanger()
+    toolhead = tc.printer.toolhead
+    tool = Tool('tool T1', toolhead)
+    queue_moves(toolhead, 5)
+    tc.stop_for_tool_loss(tool, tc.printer.reactor.monotonic())
+    assert 'wait_moves' not in toolhead.calls
+    assert toolhead.lookahead.queue == []
+    # Back to where the committed motion ends
+    assert toolhead.position == [0., 1., 2., 3.]
+    assert tc.last_tool_loss['dropped_moves'] == 5
+    assert not tc.last_tool_loss['mcu_halted']
+    # estimated_print_time(100.) is 10., the committed motion ends at 10.
+    assert tc.last_tool_loss['queued_motion_ms'] == 0
+
+
+def test_committed_motion_is_reported():
+    tc = make_toolchanger()
+    toolhead = tc.printer.toolhead
+    toolhead.last_move_time = 10.5
+    tc.stop_for_tool_loss(Tool('tool T1', toolhead), tc.printer.reactor.monotonic())
+    assert tc.last_tool_loss['queued_motion_ms'] == 500
+    assert tc.last_tool_loss['motion_stop_ms'] == 500
+    assert 'wait_moves' not in toolhead.calls
+
+
+def test_mcu_trigger_halts_and_resyncs_without_waiting():
+    tc = make_toolchanger()
+    toolhead = tc.printer.toolhead
+    tool = Tool('tool T1', toolhead)
+    tc._start_trigger(tool, 10., 'loss')
+    queue_moves(toolhead, 3)
+    tool.detection_endstop.fire(halt_steps=200)
+    tc.stop_for_tool_loss(tool, tc.printer.reactor.monotonic())
+    assert tc.loss_trigger is None
+    assert tc.last_tool_loss['mcu_halted']
+    assert toolhead.position[:3] == [-2., -2., -2.]
+    assert 'wait_moves' not in toolhead.calls
+
+
+def test_unreported_trigger_falls_back_to_host_path():
+    tc = make_toolchanger()
+    toolhead = tc.printer.toolhead
+    tool = Tool('tool T1', toolhead)
+    tc._start_trigger(tool, 10., 'loss')
+    queue_moves(toolhead, 2)
+    tc.stop_for_tool_loss(tool, tc.printer.reactor.monotonic())
+    assert not tc.last_tool_loss['mcu_halted']
+    assert tc.last_tool_loss['dropped_moves'] == 2
+    assert 'wait_moves' not in toolhead.calls
@@ -0,0 +1,34 @@
+# Change envelope limits go straight to the toolhead
+from toolchanger_sim import make_toolchanger
+
+
+class LimitsToolhead:
+    def __init__(self):
+        self.max_velocity = 300.
+        self.max_accel = 3000.
+        self.square_corner_velocity = 5.
+        self.min_cruise_ratio = 0.5
+        self.junction_updates = 0
+
+    def get_status(self, eventtime):
+        return {'max_velocity': self.max_velocity, 'max_accel': self.max_accel,
+                'square_corner_velocity': self.square_corner_velocity,
+                'minimum_cruise_ratio': self.min_cruise_ratio}
+
+    def _calc_junction_deviation(self):
+        self.junction_updates += 1
+
+
+def test_envelope_sets_and_restores_only_changed_limits():
+    tc = make_toolchanger()
+    toolhead = tc.printer.objects['toolhead'] = LimitsToolhead()
+    tc.change_envelope = {'ACCEL': 15000., 'VELOCITY': 300., 'MINIMUM_CRUISE_RATIO': 0.3}
+    tc.change_envelope_saved = None
+    tc._enter_change_envelope()
+    assert tc.change_envelope_saved == {'ACCEL': 3000., 'MINIMUM_CRUISE_RATIO': 0.5}
+    assert (toolhead.max_accel, toolhead.min_cruise_ratio) == (15000., 0.3)
+    assert toolhead.junction_updates == 1
+    tc._exit_change_envelope()
+    assert (toolhead.max_accel, toolhead.min_cruise_ratio) == (3000., 0.5)
+    assert toolhead.junction_updates == 2
+    assert tc.gcode.responses == []
@@ -0,0 +1,298 @@
+# Simulated Klipper objects for driving the toolchanger's trsync handling
+#
+# The MCU side is reduced to what the toolchanger sees of it: home_start()
+# returns a completion, the test completes it to fire the trsync and moves
+# the stepper MCU positions back to where the steppers halted.
+#
+# Copyright (C) 2025 PrintStructor
+# This file may be distributed under the terms of the GNU GPLv3 license.
+from extras import toolchanger
+
+
+class CommandError(Exception):
+    pass
+
+
+class NotReady(Exception):
+    """A simulated greenlet waits on a completion that is not done yet."""
+
+
+class Completion:
+    def __init__(self):
+        self.done = False
+        self.result = None
+
+    def test(self):
+        return self.done
+
+    def complete(self, result):
+        self.done = True
+        self.result = result
+
+    def wait(self):
+        if not self.done:
+            raise NotReady()
+        return self.result
+
+
+class Reactor:
+    NOW = 0.
+    NEVER = 9999999999999999.
+
+    def __init__(self):
+        self.time = 100.
+        self.callbacks = []
+        self.timers = []
+
+    def monotonic(self):
+        return self.time
+
+    def completion(self):
+        return Completion()
+
+    def register_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def register_timer(self, callback, waketime=NEVER):
+        self.timers.append(callback)
+        return callback
+
+    def unregister_timer(self, timer):
+        self.timers.remove(timer)
+
+    def pause(self, waketime):
+        # Other greenlets run while this one sleeps
+        self.time = max(self.time, waketime)
+        self.run_callbacks()
+        return self.time
+
+    def run_callbacks(self):
+        """Runs the callbacks whose completion is done, like the reactor would."""
+        pending, self.callbacks = self.callbacks, []
+        for callback in pending:
+            try:
+                callback(self.time)
+            except NotReady:
+                # Callbacks wait on their completion first, retry later
+                self.callbacks.append(callback)
+
+
+class Stepper:
+    def __init__(self, name, step_dist=0.01):
+        self.name = name
+        self.step_dist = step_dist
+        self.commanded = 0.
+        self.mcu_position = 0
+        self.halt_steps = 0
+
+    def get_name(self):
+        return self.name
+
+    def get_commanded_position(self):
+        return self.commanded
+
+    def get_mcu_position(self):
+        return self.mcu_position
+
+    def get_step_dist(self):
+        return self.step_dist
+
+
+class Kinematics:
+    def __init__(self):
+        self.steppers = [Stepper('stepper_' + a) for a in 'xyz']
+
+    def get_steppers(self):
+        return self.steppers
+
+    def calc_position(self, stepper_positions):
+        return [stepper_positions['stepper_' + a] for a in 'xyz']
+
+
+class ToolheadMCU:
+    def __init__(self, reactor):
+        self.reactor = reactor
+
+    def estimated_print_time(self, eventtime):
+        return eventtime - 90.
+
+
+class Move:
+    def __init__(self, start_pos):
+        self.start_pos = start_pos
+
+
+class LookAheadQueue:
+    """Moves the toolhead has not committed to print times yet."""
+    def __init__(self):
+        self.queue = []
+
+    def reset(self):
+        del self.queue[:]
+
+
+class Toolhead:
+    """Queues moves as print times; wait_moves() and get_last_move_time() are
+    recorded since they stop or commit the motion."""
+    def __init__(self, reactor):
+        self.reactor = reactor
+        self.mcu = ToolheadMCU(reactor)
+        self.kin = Kinematics()
+        self.lookahead = LookAheadQueue()
+        self.position = [0., 0., 0., 0.]
+        self.last_move_time = 10.
+        self.lookahead_callbacks = []
+        self.calls = []
+
+    def get_kinematics(self):
+        return self.kin
+
+    def get_position(self):
+        return list(self.position)
+
+    def set_position(self, newpos, homing_axes=()):
+        self.calls.append('set_position')
+        self.position = list(newpos)
+
+    def get_last_move_time(self):
+        self.calls.append('get_last_move_time')
+        return self.last_move_time
+
+    def register_lookahead_callback(self, callback):
+        self.lookahead_callbacks.append(callback)
+
+    def flush_lookahead(self):
+        """Runs the lookahead callbacks the way a lookahead flush does."""
+        pending, self.lookahead_callbacks = self.lookahead_callbacks, []
+        for callback in pending:
+            callback(self.last_move_time)
+
+    def wait_moves(self):
+        self.calls.append('wait_moves')
+
+    def flush_step_generation(self):
+        pass
+
+
+class DetectionEndstop:
+    def __init__(self, toolhead):
+        self.toolhead = toolhead
+        self.starts = []
+        self.waits = 0
+        self.completion = None
+
+    def home_start(self, print_time, sample_time, sample_count, rest_time, triggered=True):
+        assert self.completion is None or self.completion.done, \
+            "Can't add signal that is already active"
+        self.starts.append((print_time, triggered))
+        self.completion = Completion()
+        return self.completion
+
+    def home_wait(self, home_end_time):
+        # Stopping the trsync resets the steppers to their MCU positions
+        self.waits += 1
+        if not self.completion.done:
+            self.completion.complete(None)
+        for stepper in self.toolhead.kin.steppers:
+            stepper.mcu_position -= stepper.halt_steps
+            stepper.halt_steps = 0
+        return 0.
+
+    def fire(self, halt_steps=0, is_failure=False):
+        """The pin reads absent: the MCU halts the steppers halt_steps short."""
+        for stepper in self.toolhead.kin.steppers:
+            stepper.halt_steps = halt_steps
+        self.completion.complete(is_failure)
+
+
+class Tool:
+    def __init__(self, name, toolhead):
+        self.name = name
+        self.tool_loss_trigger = False
+        self.detection_endstop = DetectionEndstop(toolhead)
+        self.detect_state = toolchanger.DETECT_PRESENT
+
+
+class GCodeCommand:
+    def __init__(self, gcode, command, params):
+        self.command = command
+        self.params = params
+        self.respond_info = gcode.respond_info
+        self.respond_raw = gcode.respond_info
+
+    def get_command_parameters(self):
+        return self.params
+
+
+class Mutex:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class GCode:
+    def __init__(self):
+        self.responses = []
+        self.scripts = []
+
+    def get_mutex(self):
+        return Mutex()
+
+    def create_gcode_command(self, command, commandline, params):
+        return GCodeCommand(self, command, params)
+
+    def respond_info(self, msg, log=True):
+        self.responses.append(msg)
+
+    def run_script_from_command(self, script):
+        self.scripts.append(script)
+
+
+class SDCard:
+    def __init__(self, active):
+        self.active = active
+
+    def is_active(self):
+        return self.active
+
+
+class Printer:
+    command_error = CommandError
+
+    def __init__(self):
+        self.reactor = Reactor()
+        self.toolhead = Toolhead(self.reactor)
+        self.objects = {'toolhead': self.toolhead,
+                        'virtual_sdcard': SDCard(True)}
+
+    def get_reactor(self):
+        return self.reactor
+
+    def lookup_object(self, name, default=None):
+        return self.objects.get(name, default)
+
+    def is_shutdown(self):
+        return False
+
+
+def make_toolchanger():
+    """A Toolchanger with only the state the trsync handling uses."""
+    printer = Printer()
+    tc = toolchanger.Toolchanger.__new__(toolchanger.Toolchanger)
+    tc.printer = printer
+    tc.gcode = GCode()
+    tc.event_log = None
+    tc.active_tool = None
+    tc.loss_trigger = None
+    tc.speculative_check = None
+    tc.status = toolchanger.STATUS_READY
+    tc.homing_rails = False
+    tc.deferred_restore = None
+    tc.deferred_restore_z = 0.
+    tc.paused_restore = None
+    tc.tool_loss_count = 0
+    tc.last_tool_loss = None
+    tc.metrics = None
+    return tc